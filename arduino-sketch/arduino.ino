@@ -10,6 +10,14 @@ const int BULB1 = 9;
 const int BULB2 = 10;
 const int BULB3 = 5;
 
+// Binary level frames (negotiated by the bridge with CAPS):
+// 0xA5, opcode, seq, channel mask, one value per masked channel, CRC8 of opcode..values
+// Answered with one byte: 0x80 | seq (ACK) or 0xC0 | seq (NAK)
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_OP_LEVELS = 0x01;
+const byte FRAME_ACK = 0x80;
+const byte FRAME_NAK = 0xC0;
+
 // Current state tracking
 int bulb1Brightness = 0;
 int bulb2Brightness = 0;
@@ -100,14 +108,83 @@ void setup() {
     Serial.println("SMART_BULBS_VOICE_READY");
 }
 
+// CRC-8, polynomial 0x07 (matches the bridge)
+byte crc8(const byte *data, byte len) {
+    byte crc = 0;
+    for (byte i = 0; i < len; i++) {
+        crc ^= data[i];
+        for (byte bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+// Read one binary level frame (sync byte already peeked): no echo, no voice
+void processBinaryFrame() {
+    byte frame[7];  // opcode, seq, mask, up to 3 values, crc
+    Serial.read();  // sync
+    if (Serial.readBytes(frame, 3) < 3) {
+        return;
+    }
+    byte seq = frame[1] & 0x3F;
+    byte mask = frame[2] & 0x07;
+    byte count = 0;
+    for (byte i = 0; i < 3; i++) {
+        if (mask & (1 << i)) count++;
+    }
+    if (Serial.readBytes(frame + 3, count + 1) < count + 1 ||
+        frame[0] != FRAME_OP_LEVELS ||
+        crc8(frame, 3 + count) != frame[3 + count]) {
+        Serial.write(FRAME_NAK | seq);
+        return;
+    }
+    
+    byte *value = frame + 3;
+    if (mask & 0x01) { bulb1Brightness = *value++; analogWrite(BULB1, bulb1Brightness); }
+    if (mask & 0x02) { bulb2Brightness = *value++; analogWrite(BULB2, bulb2Brightness); }
+    if (mask & 0x04) { bulb3Brightness = *value++; analogWrite(BULB3, bulb3Brightness); }
+    currentMode = "MANUAL";
+    effectRunning = false;
+    Serial.write(FRAME_ACK | seq);
+}
+
 // Process incoming serial commands
-void processCommand(String cmd) {
+void processCommand(String cmd, bool echo) {
     cmd.toUpperCase();
-    Serial.print("CMD: ");
-    Serial.println(cmd);
+    
+    // Frame updates are the hot path for effects, so they are not echoed
+    if (echo && !cmd.startsWith("SET ")) {
+        Serial.print("CMD: ");
+        Serial.println(cmd);
+    }
+    
+    // Frame update: all 3 bulbs at once, no voice feedback
+    if (cmd.startsWith("SET ")) {
+        int v1, v2, v3;
+        if (sscanf(cmd.c_str() + 4, "%d %d %d", &v1, &v2, &v3) == 3) {
+            bulb1Brightness = constrain(v1, 0, 255);
+            bulb2Brightness = constrain(v2, 0, 255);
+            bulb3Brightness = constrain(v3, 0, 255);
+            analogWrite(BULB1, bulb1Brightness);
+            analogWrite(BULB2, bulb2Brightness);
+            analogWrite(BULB3, bulb3Brightness);
+            currentMode = "MANUAL";
+            effectRunning = false;
+            Serial.print("OK:SET:");
+            Serial.print(bulb1Brightness);
+            Serial.print(":");
+            Serial.print(bulb2Brightness);
+            Serial.print(":");
+            Serial.println(bulb3Brightness);
+        } else {
+            Serial.print("ERROR:UNKNOWN:");
+            Serial.println(cmd);
+        }
+    }
     
     // Individual bulb control
-    if (cmd == "B1 ON") {
+    else if (cmd == "B1 ON") {
         analogWrite(BULB1, 255);
         bulb1Brightness = 255;
         currentMode = "MANUAL";
@@ -257,6 +334,10 @@ void processCommand(String cmd) {
         Serial.print(":MODE:");
         Serial.println(currentMode);
     }
+    else if (cmd == "CAPS") {
+        // Capabilities: binary level frames v1, tagged replies (pipelining), 3 channels
+        Serial.println("CAPS:BIN1:SEQ:CH3");
+    }
     else if (cmd == "PING" || cmd == "TEST") {
         speakBulbAction(0, "ACK");
         Serial.println("PONG:VOICE_ACTIVE");
@@ -295,12 +376,24 @@ void loop() {
         runStrobeEffect();
     }
     
-    // Check for incoming commands
-    if (Serial.available()) {
+    // Handle every waiting command (a pipelining bridge sends the next before our reply)
+    while (Serial.available()) {
+        if (Serial.peek() == FRAME_SYNC) {
+            processBinaryFrame();
+            continue;
+        }
         String cmd = Serial.readStringUntil('\n');
         cmd.trim();
-        if (cmd.length() > 0) {
-            processCommand(cmd);
+        if (cmd.startsWith("#")) {
+            // Tagged command from a pipelining bridge: "#12 B1 255" -> "#12 OK:B1:255", no echo
+            int space = cmd.indexOf(' ');
+            if (space > 1) {
+                Serial.print(cmd.substring(0, space + 1));
+                processCommand(cmd.substring(space + 1), false);
+            }
+        }
+        else if (cmd.length() > 0) {
+            processCommand(cmd, true);
         }
     }
     
@@ -1,13 +1,39 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, validator
-from typing import Optional
+from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+import asyncio
+import collections
+import argparse
+import json
 import serial
+import sqlite3
 import time
 import threading
+import queue
 import glob
+import itertools
+import contextlib
+import logging
+import math
+import os
+import subprocess
+import sys
+import uuid
 
-app = FastAPI(title="Smart Bulb Control API - 3 Bulbs")
+import bridge_metrics
+from bridge_metrics import Counter, Gauge, Histogram
+from bridge_state import StateStore, diff_state
+from bridge_db import StateDatabase
+from bridge_scheduler import CronSpec, Ramp, Rule, Scheduler
+from bridge_intents import IntentEngine
+from bridge_live import FRAME_HEADER, JitterBuffer, LiveFrame
+from bridge_history import History, HistorySpill, parse_duration
+from bridge_workers import BROKER_SHM, BROKER_SOCKET, SnapshotWriter
+
+app = FastAPI(title="Smart Bulb Control API")
 
 # CORS
 app.add_middleware(
@@ -17,20 +43,238 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global state for 3 bulbs
-current_state = {
-    "bulb1": {"state": "off", "brightness": 0, "pin": 9},
-    "bulb2": {"state": "off", "brightness": 0, "pin": 10},
-    "bulb3": {"state": "off", "brightness": 0, "pin": 11},
-    "mode": "manual",
-    "strobe_speed": 2,
-    "connected": False
-}
+# Logging: per-command lines are DEBUG, connection events INFO (LOG_LEVEL=WARNING for production)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")     # "text" or "json" (one object per line)
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per record, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+logger = logging.getLogger("arduino_api")
+configure_logging()
+
+# Device registry config (JSON), see DeviceRegistry
+BRIDGE_CONFIG = os.environ.get(
+    "BRIDGE_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "bridge_config.json")
+)
+DEFAULT_PINS = {1: 9, 2: 10, 3: 11}     # sketch pins per channel (for display)
+
+# Port discovery settings
+SERIAL_PORT = os.environ.get("SERIAL_PORT", "")    # comma-separated ports to try first
+SERIAL_INCLUDE_TTYS = os.environ.get("SERIAL_INCLUDE_TTYS", "") == "1"  # probe non-USB /dev/ttyS*
+PORT_CACHE_FILE = os.environ.get(
+    "PORT_CACHE_FILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "smart-bulbs", "last_port.json")
+)
+# Last known state and scenes survive restarts in this SQLite file ("" keeps them in memory only)
+STATE_DB = os.environ.get(
+    "STATE_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "smart-bulbs", "bridge.db")
+)
+STATE_SAVE_DELAY = 1.0      # seconds a state change settles before it is written (coalesces bursts)
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "4"))  # seconds to wait for a board to identify itself
+PROBE_QUERY_DELAY = 1.0     # seconds after open before asking STATUS (bootloader window)
+PROBE_QUERY_INTERVAL = 0.5  # seconds between STATUS queries while probing
+
+# Serial worker settings
+SERIAL_QUEUE_SIZE = 64      # max commands waiting for the port
+RESPONSE_TIMEOUT = 3.0      # seconds to wait for a reply (sketch speech can block ~2s)
+SUBMIT_TIMEOUT = 1.0        # seconds to wait for room in a full queue
+REPLY_TIMEOUT = RESPONSE_TIMEOUT * 2 + SUBMIT_TIMEOUT   # caller's overall wait for a reply
+
+# Pipelining: firmware that offers SEQ in CAPS echoes a tag ("#12 B1 255" -> "#12 OK:B1:255"),
+# so several commands can be in flight; 1 keeps strict stop-and-wait
+SERIAL_WINDOW = max(1, min(int(os.environ.get("SERIAL_WINDOW", "4")), 16))
+SERIAL_WINDOW_BYTES = 56    # unanswered bytes on the wire, below the Uno's 64-byte receive buffer
+SERIAL_RETRANSMITS = 1      # resends of a lost level write or query before it fails
+
+# Serial protocol: "auto" negotiates binary level frames with CAPS, "text" never uses them
+SERIAL_PROTOCOL = os.environ.get("SERIAL_PROTOCOL", "auto").lower()
+
+# Binary level frame: SYNC, opcode, seq, channel mask, one value per masked channel, CRC8.
+# The sketch answers with a single byte: ACK_BIT | seq, or NAK_BIT | seq on a bad frame.
+FRAME_SYNC = 0xA5
+FRAME_OP_LEVELS = 0x01
+FRAME_SEQ_MASK = 0x3F
+FRAME_ACK_BIT = 0x80
+FRAME_NAK_BIT = 0xC0
+FRAME_RETRIES = 1           # resends of a NAKed frame before giving up
+
+# Serial queue priorities (lower goes first)
+PRIORITY_MANUAL = 0         # API requests
+PRIORITY_EFFECT = 1         # effect frames
+PRIORITY_BACKGROUND = 2     # status polls
+
+# Connection health (tracked passively from traffic, never on the send path)
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", "30"))  # PING after this long with no line received
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # silence after which the link is declared dead
+RECONNECT_MIN_DELAY = 1.0   # first reconnect backoff in seconds
+RECONNECT_MAX_DELAY = 30.0  # backoff ceiling in seconds
+
+# Background STATUS poll interval in seconds (0 disables the poller)
+STATUS_POLL_INTERVAL = float(os.environ.get("STATUS_POLL_INTERVAL", "5"))
+
+# Batch settings
+BATCH_MAX_OPERATIONS = 256      # operations accepted in one POST /api/batch
+
+# Scheduler settings
+SCHEDULE_WORKERS = int(os.environ.get("SCHEDULE_WORKERS", "4"))  # threads carrying out due rules
+SCHEDULE_MISFIRE_GRACE = float(os.environ.get("SCHEDULE_MISFIRE_GRACE", "300"))  # missed one-shots still run this late
+RAMP_MIN_INTERVAL = 0.05        # a ramp writes at most 20 times a second, however fast its values change
+
+# Live shows (WebSocket /api/live, see bridge_live)
+LIVE_JITTER_MS = float(os.environ.get("LIVE_JITTER_MS", "30"))   # default playout delay for client frames
+LIVE_MAX_JITTER_MS = 500.0
+LIVE_MAX_IN_FLIGHT = 2          # live frames on their way to the boards; the next is picked when one lands
+LIVE_REPORT_INTERVAL = 1.0      # seconds between stats messages to the client
+LIVE_MODE = "live"
+
+# History (GET /api/history, see bridge_history)
+HISTORY_FILE = os.environ.get("HISTORY_FILE", "")       # spill file; empty = keep the history in memory only
+HISTORY_SPILL_INTERVAL = float(os.environ.get("HISTORY_SPILL_INTERVAL", "60"))  # seconds between spills
+HISTORY_DEFAULT_RANGE = "1h"
+HISTORY_DEFAULT_WINDOWS = 120   # windows returned when no step is given
+
+# Multi-process serving (python arduino_api.py --workers N, see bridge_workers)
+BRIDGE_WORKERS = int(os.environ.get("BRIDGE_WORKERS", "1"))
+SNAPSHOT_REFRESH = 1.0          # republish at least this often while the status cache ages
+
+# State stream settings
+STREAM_MAX_FPS = float(os.environ.get("STREAM_MAX_FPS", "10"))  # max diff frames per second
+STREAM_KEEPALIVE = 15.0     # seconds between keepalives (and a safety diff check)
+STREAM_CLIENT_QUEUE = 32    # frames buffered per slow client before it is resynced
+
+# Line classes produced by the sketch
+LINE_ECHO = "echo"              # CMD: B1 255
+LINE_OK = "ok"                  # OK:B1:255
+LINE_STATUS = "status"          # STATUS:B1:0:B2:0:B3:0:MODE:MANUAL
+LINE_PONG = "pong"              # PONG:VOICE_ACTIVE
+LINE_READY = "ready"            # SMART_BULBS_VOICE_READY (board reset)
+LINE_EFFECT = "effect"          # EFFECT:STROBE:STARTED / EFFECT:STOPPED
+LINE_ERROR = "error"            # ERROR:UNKNOWN:FOO
+LINE_CAPS = "caps"              # CAPS:BIN1:CH3 (firmware capabilities)
+LINE_ACK = "ack"                # binary frame acknowledged (single byte)
+LINE_NAK = "nak"                # binary frame rejected (single byte)
+LINE_UNSOLICITED = "unsolicited"
+
+RESPONSE_KINDS = {LINE_OK, LINE_STATUS, LINE_PONG, LINE_EFFECT, LINE_ERROR, LINE_CAPS}
+
+# ========== METRICS (GET /metrics) ==========
+
+SERIAL_RTT = Histogram(
+    "bridge_serial_rtt_seconds", "Time from writing a command to its reply", ["controller", "command"])
+SERIAL_QUEUE_WAIT = Histogram(
+    "bridge_serial_queue_wait_seconds", "Time a command waited in the queue before it was written", ["controller"])
+SERIAL_QUEUE_DEPTH = Histogram(
+    "bridge_serial_queue_depth", "Commands already queued when a command was submitted", ["controller"],
+    buckets=bridge_metrics.DEPTH_BUCKETS)
+SERIAL_QUEUE_LENGTH = Gauge("bridge_serial_queue_length", "Commands waiting for the port", ["controller"])
+SERIAL_COMMANDS = Counter(
+    "bridge_serial_commands_total",
+    "Serial commands by outcome (ok, error, timeout, cancelled, coalesced, skipped, not_connected, write_error, queue_full)",
+    ["controller", "outcome"])
+SERIAL_RETRIES = Counter(
+    "bridge_serial_retries_total", "Commands re-sent as per-bulb writes after a SET was rejected", ["controller"])
+SERIAL_RETRANSMITTED = Counter(
+    "bridge_serial_retransmits_total", "Pipelined commands re-sent after a timeout, a NAK or a lost reply", ["controller"])
+SERIAL_WINDOW_LENGTH = Gauge("bridge_serial_window_length", "Pipelined commands awaiting their reply", ["controller"])
+SERIAL_UNMATCHED = Counter(
+    "bridge_serial_unmatched_lines_total", "Reply lines that matched no command in flight", ["controller"])
+BOARD_RESETS = Counter("bridge_board_resets_total", "Unexpected SMART_BULBS_VOICE_READY lines", ["controller"])
+RESTORE_TIME = Histogram(
+    "bridge_restore_seconds", "Board reset seen to its last levels acknowledged again", ["controller"])
+CONNECTED = Gauge("bridge_controller_connected", "1 while the controller's port is open", ["controller"])
+RECONNECTS = Counter("bridge_reconnects_total", "Successful background reconnects", ["controller"])
+DISCONNECTS = Counter("bridge_disconnects_total", "Connections dropped after an I/O error or silence", ["controller"])
+EFFECT_FRAMES_SENT = Counter("bridge_effect_frames_sent_total", "Effect frames written", ["effect"])
+EFFECT_FRAMES_DROPPED = Counter(
+    "bridge_effect_frames_dropped_total", "Effect frames skipped because the link fell behind", ["effect"])
+SCHEDULE_LATENESS = Histogram(
+    "bridge_schedule_lateness_seconds", "How late scheduled rules and ramp steps start",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+SCHEDULE_RULES = Gauge("bridge_schedule_jobs", "Scheduled rules and running ramps")
+RAMP_WRITES = Counter("bridge_ramp_writes_total", "Level writes sent by ramps")
+VOICE_PARSE_TIME = Histogram(
+    "bridge_voice_parse_seconds", "Time to turn a voice/text phrase into operations",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+LIVE_FRAMES = Counter(
+    "bridge_live_frames_total", "Live show frames by outcome (played, dropped, invalid)", ["outcome"])
+LIVE_LATENCY = Histogram(
+    "bridge_live_latency_seconds", "Live show frame arrival to the boards' acknowledgement",
+    buckets=(0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0))
+HTTP_LATENCY = Histogram(
+    "bridge_http_request_duration_seconds", "Time to response headers per route", ["method", "route", "status"])
+
+# Bulb levels (percent, on change) and serial round trips (ms) per controller, over time
+history = History()
+history_spill = HistorySpill(history, HISTORY_FILE, HISTORY_SPILL_INTERVAL) if HISTORY_FILE else None
+if history_spill is not None:
+    logger.info("📈 %d history samples loaded from %s", history_spill.load(), HISTORY_FILE)
+
+def command_label(cmd):
+    """Low-cardinality metric label for a command (B1 255 -> B, SET 1 2 3 -> SET)"""
+    verb = cmd.split(" ", 1)[0].upper()
+    if len(verb) > 1 and verb[0] == "B" and verb[1:].isdigit():
+        return "B"
+    return verb if verb in ("SET", "BSET", "ALL", "STATUS", "PING", "TEST", "STOP", "START", "CAPS") else "OTHER"
+
+class RequestMetricsMiddleware:
+    """Per-route HTTP latency histogram (plain ASGI, so streamed responses pass through untouched)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        recorded = False
 
-# Serial connection
-arduino = None
-effect_thread = None
-stop_effects = threading.Event()
+        def record(status):
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.labels(scope["method"], path, status).observe(time.perf_counter() - started)
+
+        async def send_with_metrics(message):
+            nonlocal recorded
+            if message["type"] == "http.response.start" and not recorded:
+                recorded = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
+
+app.add_middleware(RequestMetricsMiddleware)
 
 class BulbCommand(BaseModel):
     bulb: int
@@ -72,279 +316,1903 @@ class GroupCommand(BaseModel):
         except (ValueError, TypeError):
             return None
 
-def get_available_ports():
-    """Find all available serial ports"""
-    ports = []
+class BatchOperation(BaseModel):
+    """One step of a batch, shaped like a BulbCommand (bulb set), an EffectCommand (effect set)
+    or else a GroupCommand"""
+    bulb: Optional[int] = None
+    action: Optional[str] = None
+    value: Optional[int] = None
+    brightness: Optional[int] = None
+    effect: Optional[str] = None
+    speed: Optional[int] = None
+    
+    @validator('value', 'brightness', 'speed', pre=True)
+    def convert_int(cls, v):
+        if v is None or v == '':
+            return None
+        try:
+            return int(v)
+        except (ValueError, TypeError):
+            return None
+
+class BatchCommand(BaseModel):
+    operations: List[BatchOperation]
+
+class VoiceCommand(BaseModel):
+    command: Optional[str] = None   # "turn_on", "turn_off", "set_brightness", "start_effect", "stop_effects"
+                                    # (anything else is read as a phrase)
+    text: Optional[str] = None      # "turn light two to fifty percent", "all lights off", "start rainbow fast"
+    bulb: Optional[int] = None      # the bulb meant (for a phrase: when it names none)
+    value: Optional[int] = None     # set_brightness: 0-100
+    effect: Optional[str] = None    # start_effect
+    speed: Optional[int] = None
     
+    @validator('bulb', 'value', 'speed', pre=True)
+    def convert_int(cls, v):
+        if v is None or v == '':
+            return None
+        try:
+            return int(v)
+        except (ValueError, TypeError):
+            return None
+
+class SceneCommand(BaseModel):
+    action: str                     # "apply", "save" or "delete"
+    name: str
+    levels: Optional[dict] = None   # save: {"bulb1": 0-100, ...}, default the current levels
+
+class ScheduleCommand(BaseModel):
+    action: str                     # "add" or "delete"
+    id: Optional[str] = None        # rule id (add: replaces a rule with this id, default a new one)
+    # When: exactly one of
+    cron: Optional[str] = None      # "30 6 * * 1-5" - repeat (minute hour day month weekday, local time)
+    at: Optional[float] = None      # once, at this Unix time
+    delay: Optional[float] = None   # once, this many seconds from now
+    # What: exactly one of
+    levels: Optional[dict] = None   # {"bulb1": 0-100, ...}
+    scene: Optional[str] = None     # a stored scene
+    effect: Optional[str] = None    # an effect name, or "stop"
+    speed: Optional[int] = None     # effect speed
+    duration: Optional[float] = None    # fade to the levels / scene over this many seconds (a ramp)
+
+def classify_line(line):
+    """Classify one line received from the sketch"""
+    upper = line.upper()
+    if upper.startswith("CMD:"):
+        return LINE_ECHO
+    if upper.startswith("OK:"):
+        return LINE_OK
+    if upper.startswith("STATUS:"):
+        return LINE_STATUS
+    if upper.startswith("PONG"):
+        return LINE_PONG
+    if upper.startswith("EFFECT:"):
+        return LINE_EFFECT
+    if upper.startswith("ERROR:"):
+        return LINE_ERROR
+    if upper.startswith("CAPS:"):
+        return LINE_CAPS
+    if "READY" in upper:
+        return LINE_READY
+    return LINE_UNSOLICITED
+
+def crc8(data):
+    """CRC-8 (polynomial 0x07, init 0) as computed by the sketch"""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def encode_levels_frame(seq, writes):
+    """Binary frame setting {channel: pwm} (channels 1-8) in one write"""
+    mask = 0
+    for channel in writes:
+        mask |= 1 << (channel - 1)
+    body = bytes([FRAME_OP_LEVELS, seq & FRAME_SEQ_MASK, mask]
+                 + [writes[channel] for channel in sorted(writes)])
+    return bytes([FRAME_SYNC]) + body + bytes([crc8(body)])
+
+def binary_command_text(writes):
+    """Readable form of a binary level frame, for logs, metrics and coalescing (BSET 1:255 3:0)"""
+    return "BSET " + " ".join(f"{channel}:{writes[channel]}" for channel in sorted(writes))
+
+def split_tag(line):
+    """(seq, line) for a pipelined reply ("#12 OK:B1:255" -> (12, "OK:B1:255")), seq None if untagged"""
+    if line.startswith("#"):
+        tag, _, rest = line.partition(" ")
+        if tag[1:].isdigit():
+            return int(tag[1:]), rest.strip()
+    return None, line
+
+class LineFramer:
+    """Buffer raw serial bytes and split them into classified lines.
+
+    Bytes with the high bit set are binary frame ACK/NAKs; the sketch only
+    sends them between lines, and text never contains them.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add bytes, return (kind, line, seq) for every complete line.
+
+        seq is the tag of a pipelined reply (None for untagged lines); ACK/NAK
+        bytes come through as (kind, None, seq).
+        """
+        if data.isascii():
+            return self._feed_text(data)
+        items = []
+        start = 0
+        for index, byte in enumerate(data):
+            if byte & FRAME_ACK_BIT:
+                items.extend(self._feed_text(data[start:index]))
+                kind = LINE_NAK if (byte & FRAME_NAK_BIT) == FRAME_NAK_BIT else LINE_ACK
+                items.append((kind, None, byte & FRAME_SEQ_MASK))
+                start = index + 1
+        items.extend(self._feed_text(data[start:]))
+        return items
+
+    def _feed_text(self, data):
+        self.buffer.extend(data)
+        lines = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+            raw = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+            seq, line = split_tag(raw.decode('utf-8', errors='ignore').strip())
+            if line:
+                lines.append((classify_line(line), line, seq))
+        return lines
+
+    def clear(self):
+        self.buffer.clear()
+
+def describe_ports():
+    """USB identity (vid, pid, serial number) of each port pyserial knows about"""
+    try:
+        from serial.tools import list_ports
+        infos = list_ports.comports()
+    except Exception:
+        return {}
+    return {
+        info.device: {"vid": info.vid, "pid": info.pid, "serial_number": info.serial_number}
+        for info in infos
+    }
+
+def get_available_ports(identities=None):
+    """Find all available serial ports (configured SERIAL_PORT entries first)"""
+    ports = []
+
     # Linux patterns
     patterns = ['/dev/ttyACM*', '/dev/ttyUSB*', '/dev/ttyS*', '/dev/ttyAMA*']
-    
+
     for pattern in patterns:
         ports.extend(glob.glob(pattern))
-    
+
     # Filter out duplicates and sort
     ports = list(set(ports))
     ports.sort()
-    
-    return ports
+
+    # Most /dev/ttyS* are legacy UARTs with nothing attached; only keep USB-backed ones
+    if not SERIAL_INCLUDE_TTYS:
+        identities = identities if identities is not None else describe_ports()
+        ports = [port for port in ports
+                 if not port.startswith('/dev/ttyS') or identities.get(port, {}).get("vid")]
+
+    configured = [port.strip() for port in SERIAL_PORT.split(",") if port.strip()]
+    return configured + [port for port in ports if port not in configured]
+
+def load_port_cache():
+    """Last port (and its USB identity) that answered, per controller name"""
+    try:
+        with open(PORT_CACHE_FILE) as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_port_cache(name, port, identity):
+    cache = load_port_cache()
+    cache[name] = {"device": port, **(identity or {})}
+    try:
+        os.makedirs(os.path.dirname(PORT_CACHE_FILE), exist_ok=True)
+        with open(PORT_CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        logger.warning("⚠️ Could not save port cache: %s", e)
+
+def find_cached_port(name, ports, identities):
+    """Which available port is the board this controller used last time?"""
+    cached = load_port_cache().get(name)
+    if not cached:
+        return None
+
+    # The same board can come back under another name (ttyACM0 -> ttyACM1)
+    if cached.get("serial_number"):
+        for port in ports:
+            if identities.get(port, {}).get("serial_number") == cached["serial_number"]:
+                return port
+    if cached.get("vid") is not None:
+        for port in ports:
+            identity = identities.get(port, {})
+            if (identity.get("vid"), identity.get("pid")) == (cached.get("vid"), cached.get("pid")):
+                return port
+    if cached.get("device") in ports:
+        return cached["device"]
+    return None
+
+def probe_port(port, found=None):
+    """Open a port and wait for the sketch to identify itself.
+
+    Returns (handle, first line) or None. Opening the port resets the Uno, so
+    the first thing we expect is SMART_BULBS_VOICE_READY. Boards that don't
+    reset are asked for STATUS once the bootloader window has passed. Stops
+    early if another probe wins.
+    """
+    try:
+        conn = serial.Serial(
+            port=port,
+            baudrate=9600,
+            timeout=0.1,
+            write_timeout=1,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            exclusive=True
+        )
+    except PermissionError:
+        logger.warning("❌ Permission denied on %s (try: sudo chmod 666 %s)", port, port)
+        return None
+    except (serial.SerialException, OSError) as e:
+        logger.info("❌ Serial error on %s: %s", port, e)
+        return None
+
+    try:
+        framer = LineFramer()
+        opened = time.monotonic()
+        deadline = opened + PROBE_TIMEOUT
+        next_query = opened + PROBE_QUERY_DELAY
+
+        while time.monotonic() < deadline:
+            if found is not None and found.is_set():
+                break
+
+            data = conn.read(conn.in_waiting or 1)
+            for kind, line, _ in framer.feed(data):
+                if kind in (LINE_READY, LINE_STATUS, LINE_PONG, LINE_OK):
+                    logger.info("📨 %s: %s (%.2fs)", port, line, time.monotonic() - opened)
+                    conn.timeout = 1
+                    return conn, line
+
+            if time.monotonic() >= next_query:
+                conn.write(b"STATUS\n")
+                next_query = time.monotonic() + PROBE_QUERY_INTERVAL
+    except Exception as e:
+        logger.warning("❌ Error on %s: %s", port, e)
+
+    conn.close()
+    return None
+
+# Only one controller scans for unclaimed ports at a time
+discovery_lock = threading.Lock()
+
+def connect_controller(controller):
+    """Connect one controller - its configured port, else its last known port, else parallel discovery"""
+    # Boards with a configured port never race for the same device, so they connect in parallel
+    with discovery_lock if not controller.port_hint else contextlib.nullcontext():
+        identities = describe_ports()
+        if controller.port_hint:
+            available_ports = [controller.port_hint]
+        else:
+            # Ports owned (or reserved by config) for other controllers are off limits
+            claimed = {c.port for c in registry.controllers.values() if c is not controller and c.conn is not None}
+            claimed |= {c.port_hint for c in registry.controllers.values() if c.port_hint}
+            available_ports = [p for p in get_available_ports(identities) if p not in claimed]
+        logger.info("🔍 [%s] Available serial ports: %s", controller.name, available_ports)
+
+        if not available_ports:
+            logger.warning("❌ [%s] No serial ports found!", controller.name)
+            return False
+
+        result = None
+        port = find_cached_port(controller.name, available_ports, identities)
+        if port is not None:
+            logger.info("🔌 [%s] Trying last known port %s...", controller.name, port)
+            result = probe_port(port)
+            remaining = [p for p in available_ports if p != port]
+        else:
+            remaining = available_ports
+
+        if result is None and remaining:
+            logger.info("🔌 [%s] Probing %d port(s) in parallel...", controller.name, len(remaining))
+            found = threading.Event()
+            with ThreadPoolExecutor(max_workers=min(len(remaining), 16)) as pool:
+                probes = {pool.submit(probe_port, p, found): p for p in remaining}
+                for probe in as_completed(probes):
+                    candidate = probe.result()
+                    if candidate is None:
+                        continue
+                    if result is None:
+                        result, port = candidate, probes[probe]
+                        found.set()
+                    else:
+                        candidate[0].close()
+
+        if result is None:
+            logger.warning("❌ [%s] Could not connect to Arduino on any available port", controller.name)
+            return False
+
+        conn, first_line = result
+        logger.info("✅ [%s] Arduino identified on %s", controller.name, port)
+        save_port_cache(controller.name, port, identities.get(port))
+        controller.attach(conn, port)
+        if classify_line(first_line) == LINE_STATUS:
+            parse_status(first_line, controller)
+        elif classify_line(first_line) == LINE_READY:
+            controller.board_reset()
+        controller.negotiate_protocol()
+        controller.restore_levels()
+        return True
 
 def connect_arduino():
-    """Connect to Arduino - dynamically find the correct port"""
-    global arduino, current_state
-    
-    # Get available ports
-    available_ports = get_available_ports()
-    print(f"🔍 Available serial ports: {available_ports}")
-    
-    if not available_ports:
-        print("❌ No serial ports found!")
-        current_state["connected"] = False
-        return False
-    
-    # Try each available port
-    for port in available_ports:
-        print(f"🔌 Attempting connection on {port}...")
-        
+    """Connect every configured controller (in parallel), True if all are up"""
+    controllers = list(registry.controllers.values())
+    with ThreadPoolExecutor(max_workers=len(controllers)) as pool:
+        results = list(pool.map(connect_controller, controllers))
+    return all(results)
+
+def expected_prefix(cmd):
+    """Prefix of the reply line that acknowledges a command, or None if any reply will do"""
+    parts = cmd.strip().upper().split()
+    if not parts:
+        return None
+    if parts[0] == "STATUS":
+        return "STATUS:"
+    if parts[0] in ("PING", "TEST"):
+        return "PONG"
+    if parts[0] in ("STOP", "START"):
+        return "EFFECT:"
+    if parts[0] == "SET":
+        return "OK:SET:"
+    if parts[0] == "CAPS":
+        return "CAPS:"
+    if parts[0] == "ALL" or (len(parts[0]) == 2 and parts[0][0] == "B" and parts[0][1].isdigit()):
+        return f"OK:{parts[0]}:"
+    return None
+
+def level_writes(cmd, channels=3):
+    """PWM each channel ends up at after a level command ({channel: 0-255}), None for other commands"""
+    parts = cmd.strip().upper().split()
+    try:
+        if len(parts) == 2 and parts[0] == "ALL" and parts[1] in ("ON", "OFF"):
+            return {channel: 255 if parts[1] == "ON" else 0 for channel in range(1, channels + 1)}
+        if len(parts) == 2 and len(parts[0]) > 1 and parts[0][0] == "B" and parts[0][1:].isdigit():
+            value = {"ON": 255, "OFF": 0}.get(parts[1])
+            return {int(parts[0][1:]): value if value is not None else max(0, min(255, int(parts[1])))}
+        if len(parts) == channels + 1 and parts[0] == "SET":
+            return {channel: max(0, min(255, int(v))) for channel, v in enumerate(parts[1:], start=1)}
+        if len(parts) > 1 and parts[0] == "BSET":
+            pairs = (part.split(":") for part in parts[1:])
+            return {int(channel): max(0, min(255, int(v))) for channel, v in pairs}
+    except ValueError:
+        pass
+    return None
+
+def noop_reply(cmd, writes):
+    """The reply the sketch would give to a level command that was skipped as a no-op"""
+    parts = cmd.strip().upper().split()
+    if parts[0] == "BSET":
+        return "ACK"
+    if parts[0] == "SET":
+        return "OK:SET:" + ":".join(str(writes[channel]) for channel in sorted(writes))
+    if parts[1] in ("ON", "OFF"):
+        return f"OK:{parts[0]}:{parts[1]}"
+    return f"OK:{parts[0]}:{next(iter(writes.values()))}"
+
+class SerialCommand:
+    """A command waiting for the serial worker, resolved with its response line"""
+
+    def __init__(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None, channels=3, binary=False):
+        self.cmd = cmd
+        self.binary = binary        # sent as a binary level frame, answered by ACK/NAK
+        self.tagged = False         # sent pipelined, the reply carries our seq
+        self.seq = None
+        self.payload = None
+        self.retries = 0
+        self.priority = priority
+        self.cancel_event = cancel_event    # skipped unsent once this is set
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.sent_at = None
+        self.echoed = False
+        self.prefix = expected_prefix(cmd)
+        # Coalescing: level writes still in the queue are replaced by newer ones
+        self.writes = level_writes(cmd, channels)
+        self.taken = False          # picked up by the writer, can no longer be replaced
+        self.superseded = False     # replaced by a newer write, skipped by the writer
+        self.merged = []            # older writes this one replaced; resolved with its reply
+
+    def matches(self, kind, line, seq=None):
+        """Does this reply line belong to this command?"""
+        if self.binary:
+            return kind in (LINE_ACK, LINE_NAK) and seq == self.seq
+        if self.tagged:
+            return kind in RESPONSE_KINDS and seq == self.seq
+        if kind == LINE_ERROR:
+            return line.upper().endswith(self.cmd.strip().upper())
+        if kind not in RESPONSE_KINDS:
+            return False
+        if self.prefix is None:
+            return True
+        return line.upper().startswith(self.prefix)
+
+    @property
+    def spoken(self):
+        """The sketch speaks (blocking for a second or more) before it answers"""
+        return command_label(self.cmd) not in ("SET", "BSET", "STATUS", "CAPS")
+
+    @property
+    def idempotent(self):
+        """Safe to send again if it may have been lost (level writes and queries)"""
+        return bool(self.writes) or self.prefix in ("STATUS:", "CAPS:")
+
+class SerialWorker:
+    """Single owner of one controller's serial port: a writer fed by a bounded queue
+    and a continuous reader that frames lines and matches them to the command in flight.
+
+    With firmware that tags its replies, the writer keeps up to SERIAL_WINDOW commands
+    (and SERIAL_WINDOW_BYTES bytes) in flight instead of waiting for each reply. The
+    board answers in order, so a reply to a later command proves that every earlier one
+    still in the window was lost; lost or timed-out commands are resent once if that is
+    safe (level writes not yet rewritten, queries) and failed otherwise.
+    """
+
+    def __init__(self, controller, maxsize=SERIAL_QUEUE_SIZE):
+        self.controller = controller
+        self.queue = queue.PriorityQueue(maxsize=maxsize)
+        self.sequence = itertools.count()
+        self.thread = None
+        self.reader_thread = None
+        self.lock = threading.Lock()
+        self.inflight = None
+        self.framer = LineFramer()
+        self.unmatched_lines = 0
+        self.last_rx_at = None      # monotonic time of the last byte received
+        self.loop = None            # event loop of async submitters waiting for room
+        self.room_waiters = collections.deque()
+        self.pending_writes = {}    # channel -> latest unresolved level write
+        self.pending_queries = {}   # command text -> identical read-only query not yet sent
+        self.frame_sequence = itertools.count()
+        self.write_lock = threading.Lock()      # the reader resends NAKed frames itself
+        self.window = collections.OrderedDict()     # seq -> pipelined command awaiting its reply, oldest first
+        self.window_bytes = 0
+        self.window_open = threading.Condition(self.lock)
+        self.progress_at = None     # monotonic time of the last reply to a pipelined command
+
+        # Metric series resolved once, so the per-command cost is a few additions
+        name = controller.name
+        self.rtt = {}
+        self.rtt_history = history.series(f"rtt:{name}")
+        self.queue_wait = SERIAL_QUEUE_WAIT.labels(name)
+        self.queue_depth = SERIAL_QUEUE_DEPTH.labels(name)
+        self.outcomes = {}
+        self.unmatched = SERIAL_UNMATCHED.labels(name)
+        self.retransmits = SERIAL_RETRANSMITTED.labels(name)
+        SERIAL_QUEUE_LENGTH.labels(name).set_function(self.queue.qsize)
+        SERIAL_WINDOW_LENGTH.labels(name).set_function(lambda: len(self.window))
+
+    def count(self, outcome):
+        series = self.outcomes.get(outcome)
+        if series is None:
+            series = self.outcomes[outcome] = SERIAL_COMMANDS.labels(self.controller.name, outcome)
+        series.inc()
+
+    def observe_rtt(self, command, seconds):
+        label = command_label(command.cmd)
+        series = self.rtt.get(label)
+        if series is None:
+            series = self.rtt[label] = SERIAL_RTT.labels(self.controller.name, label)
+        series.observe(seconds)
+        self.rtt_history.add(seconds * 1000)
+
+    def ensure_started(self):
+        """Start the writer and reader threads on first use"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run,
+                    name=f"serial-writer-{self.controller.name}",
+                    daemon=True
+                )
+                self.thread.start()
+            if self.reader_thread is None or not self.reader_thread.is_alive():
+                self.reader_thread = threading.Thread(
+                    target=self._read_loop,
+                    name=f"serial-reader-{self.controller.name}",
+                    daemon=True
+                )
+                self.reader_thread.start()
+
+    def submit(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None, binary=False):
+        """Queue a command and return a future for its response line"""
+        self.ensure_started()
+        command = SerialCommand(cmd, priority, cancel_event, self.controller.channels, binary)
+        if not self._coalesce(command):
+            return command.future
+        self.queue_depth.observe(self.queue.qsize())
         try:
-            # Try to connect
-            arduino = serial.Serial(
-                port=port,
-                baudrate=9600,
-                timeout=1,
-                write_timeout=1,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
-            )
-            
-            # Give Arduino time to reset
-            time.sleep(2)
-            
-            # Clear any existing data
-            arduino.flushInput()
-            arduino.flushOutput()
-            
-            # Test 1: Send a newline to trigger response
-            arduino.write(b"\n")
-            arduino.flush()
-            time.sleep(0.5)
-            
-            # Read response
-            if arduino.in_waiting:
-                response = arduino.readline().decode('utf-8', errors='ignore').strip()
-                print(f"   📨 Response to newline: {response}")
-                
-                # Check if this looks like an Arduino response
-                if response and any(keyword in response.upper() for keyword in ['SMART_BULBS', 'STATUS:', 'OK:', 'READY', 'ARDUINO', 'PONG']):
-                    print(f"✅✅✅ Arduino identified on {port}")
-                    current_state["connected"] = True
-                    return True
-            
-            # Test 2: Send STATUS command
-            arduino.write(b"STATUS\n")
-            arduino.flush()
-            time.sleep(0.5)
-            
-            if arduino.in_waiting:
-                response = arduino.readline().decode('utf-8', errors='ignore').strip()
-                print(f"   📨 STATUS response: {response}")
-                
-                if response and ("STATUS:" in response or "OK:" in response):
-                    print(f"✅✅✅ Arduino identified on {port}")
-                    current_state["connected"] = True
-                    return True
-            
-            # If we get here, close and try next port
-            arduino.close()
-            arduino = None
-            
-        except PermissionError:
-            print(f"   ❌ Permission denied on {port}")
-            print(f"   💡 Try: sudo chmod 666 {port}")
-            continue
-            
-        except serial.SerialException as e:
-            print(f"   ❌ Serial error on {port}: {e}")
-            continue
-            
+            # The sequence number keeps FIFO order within a priority
+            self.queue.put((priority, next(self.sequence), command), timeout=SUBMIT_TIMEOUT)
+        except queue.Full:
+            self._drop(command)
+        return command.future
+
+    async def submit_async(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None, binary=False):
+        """submit() for the event loop: waits for room in a full queue without blocking the loop.
+
+        Waiting coroutines cost nothing, so instead of SUBMIT_TIMEOUT they may wait
+        up to REPLY_TIMEOUT; the writer wakes them in arrival order as it frees slots.
+        """
+        self.ensure_started()
+        command = SerialCommand(cmd, priority, cancel_event, self.controller.channels, binary)
+        if not self._coalesce(command):
+            return command.future
+        self.queue_depth.observe(self.queue.qsize())
+        item = (priority, next(self.sequence), command)
+        try:
+            self.queue.put_nowait(item)
+            return command.future
+        except queue.Full:
+            pass
+
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        deadline = loop.time() + REPLY_TIMEOUT
+        while True:
+            waiter = loop.create_future()
+            self.room_waiters.append(waiter)
+            try:
+                # Re-check after registering, so a slot freed in between is not missed
+                self.queue.put_nowait(item)
+                return command.future
+            except queue.Full:
+                pass
+            try:
+                await asyncio.wait_for(waiter, timeout=deadline - loop.time())
+            except asyncio.TimeoutError:
+                self._drop(command)
+                return command.future
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+                with contextlib.suppress(ValueError):
+                    self.room_waiters.remove(waiter)
+            try:
+                self.queue.put_nowait(item)
+                return command.future
+            except queue.Full:
+                continue
+
+    def _room_freed(self):
+        """(event loop) A queue slot opened up: wake the longest-waiting submitter"""
+        while self.room_waiters:
+            waiter = self.room_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _drop(self, command):
+        logger.warning("⚠️ [%s] Serial queue full, dropping: %s", self.controller.name, command.cmd)
+        self.count("queue_full")
+        self._resolve(command, None)
+
+    def _coalesce(self, command):
+        """Last writer wins for level writes; False if the command needn't be queued at all.
+
+        A queued write whose channels are all rewritten by the new command is
+        marked superseded (the writer skips it) and its caller is resolved with
+        the new command's reply, so a slider drag sends only the latest value.
+        A write that matches what the board last reported, with nothing for those
+        channels in flight, is answered immediately without touching the port.
+        A STATUS query joins an identical one that is still waiting in the queue.
+        """
+        writes = command.writes
+        if not writes:
+            if command.prefix != "STATUS:":
+                return True
+            with self.lock:
+                queued = self.pending_queries.get(command.cmd)
+                if queued is not None and not queued.taken and not queued.future.done():
+                    queued.merged.append(command)
+                    self.count("coalesced")
+                    return False
+                self.pending_queries[command.cmd] = command
+            return True
+
+        with self.lock:
+            pending = {self.pending_writes.get(channel) for channel in writes} - {None}
+            if not pending and self.controller.reports(writes):
+                command.future.set_result(noop_reply(command.cmd, writes))
+                self.count("skipped")
+                return False
+
+            for old in pending:
+                if old.taken or not old.writes.keys() <= writes.keys():
+                    continue
+                # A frame that may be cancelled must not swallow a write that won't be
+                if command.cancel_event is not None and old.cancel_event is not command.cancel_event:
+                    continue
+                old.superseded = True
+                command.merged.append(old)
+                command.merged.extend(old.merged)
+                old.merged = []
+                self.count("coalesced")
+            for channel in writes:
+                self.pending_writes[channel] = command
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                # Idle with commands in the window: wake up in time to expire them
+                _, _, command = self.queue.get(timeout=self._expire_overdue())
+            except queue.Empty:
+                continue
+            if self.room_waiters:
+                self.loop.call_soon_threadsafe(self._room_freed)
+            if self.controller.pipelined:
+                # Still open to coalescing while it waits for the window
+                self._wait_for_window(command)
+            with self.lock:
+                # Replaced by a newer write: its caller gets that write's reply
+                skip = command.superseded
+                command.taken = True
+                if self.pending_queries.get(command.cmd) is command:
+                    del self.pending_queries[command.cmd]
+            if skip:
+                self.queue.task_done()
+                continue
+            try:
+                if command.cancel_event is not None and command.cancel_event.is_set():
+                    # Frame of a cancelled effect: never hits the wire
+                    self._resolve(command, None)
+                    self.count("cancelled")
+                    continue
+                self._execute(command)
+            except Exception as e:
+                self._resolve(command, exception=e)
+                self.count("error")
+            finally:
+                self.queue.task_done()
+
+    def _execute(self, command):
+        """Write one command and wait until the reader matches its reply"""
+        arduino_conn = self.controller.get_connection()
+        if arduino_conn is None:
+            # Fail fast; reconnecting is the supervisor's job, not the request's
+            logger.debug("⚠️ [%s] Arduino not connected, not sending: %s", self.controller.name, command.cmd)
+            self._resolve(command, None)
+            self.count("not_connected")
+            return
+
+        if self.controller.pipelined:
+            self._execute_pipelined(arduino_conn, command)
+            return
+
+        with self.lock:
+            self.inflight = command
+        logger.debug("📨 [%s] Sending: %s", self.controller.name, command.cmd)
+        if command.binary:
+            command.seq = next(self.frame_sequence) & FRAME_SEQ_MASK
+            command.payload = encode_levels_frame(command.seq, command.writes)
+        else:
+            command.payload = f"{command.cmd}\n".encode()
+        command.sent_at = time.monotonic()
+        self.queue_wait.observe(command.sent_at - command.submitted_at)
+        if not self._transmit(arduino_conn, command):
+            return
+
+        try:
+            command.future.exception(timeout=RESPONSE_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning("📨 [%s] No response received for: %s", self.controller.name, command.cmd)
+            if self._resolve(command, None):
+                self.count("timeout")
+
+    def _wait_for_window(self, command):
+        """Block the writer until the window admits this command (or a newer write replaces it)"""
+        while True:
+            timeout = self._expire_overdue()
+            with self.window_open:
+                if command.superseded or self._admits(command):
+                    return
+                self.window_open.wait(timeout)
+
+    def _admits(self, command):
+        """(lock held) Is there room in the window for this command now?
+
+        Only silent commands overlap: while the sketch speaks, the few ms a pipeline
+        saves are lost in seconds of speech, and a command committed early can no
+        longer be coalesced. A manual level write also waits for an earlier write to
+        any of its channels, and a query for an identical one, so a burst of slider
+        updates or fresh reads still collapses in the queue. Effect frames stream:
+        the engine paces them and drops frames itself.
+        """
+        if not self.window:
+            return True
+        if command.spoken or any(other.spoken for other in self.window.values()):
+            return False
+        # Payload size before the tag is known: "#63 " + command + newline, or the binary frame
+        size = 5 + len(command.writes) if command.binary else len(command.cmd) + 5
+        if len(self.window) >= SERIAL_WINDOW or self.window_bytes + size > SERIAL_WINDOW_BYTES:
+            return False
+        if command.priority == PRIORITY_EFFECT:
+            return True
+        if command.writes:
+            return not any(other.writes and other.writes.keys() & command.writes.keys()
+                           for other in self.window.values())
+        return not any(other.cmd == command.cmd for other in self.window.values())
+
+    def _execute_pipelined(self, conn, command):
+        """Write a tagged command into the window without waiting for its reply"""
+        with self.lock:
+            command.tagged = True
+            command.seq = self._next_seq()
+            if command.binary:
+                command.payload = encode_levels_frame(command.seq, command.writes)
+            else:
+                command.payload = f"#{command.seq} {command.cmd}\n".encode()
+            self.window[command.seq] = command
+            self.window_bytes += len(command.payload)
+            command.sent_at = time.monotonic()
+        logger.debug("📨 [%s] Sending #%d: %s", self.controller.name, command.seq, command.cmd)
+        self.queue_wait.observe(command.sent_at - command.submitted_at)
+        self._transmit(conn, command)
+
+    def _next_seq(self):
+        """(lock held) Next sequence number not used by a command still in the window"""
+        while True:
+            seq = next(self.frame_sequence) & FRAME_SEQ_MASK
+            if seq not in self.window:
+                return seq
+
+    def _transmit(self, conn, command):
+        """Write a command's payload, False (and the command failed) if the port is gone"""
+        try:
+            with self.write_lock:
+                conn.write(command.payload)
+                conn.flush()
+            return True
         except Exception as e:
-            print(f"   ❌ Error on {port}: {e}")
-            continue
-    
-    print("❌ Could not connect to Arduino on any available port")
-    current_state["connected"] = False
-    arduino = None
-    return False
+            logger.error("❌ [%s] Error sending command: %s", self.controller.name, e)
+            if self._resolve(command, None):
+                self.count("write_error")
+            self.controller.mark_disconnected(conn, e)
+            return False
+
+    def _expire_overdue(self):
+        """Resend or fail pipelined commands the board stopped answering.
+
+        Returns seconds until the window next needs checking (None if it is empty).
+        The board answers in order, so only the oldest command can be overdue: it
+        gets RESPONSE_TIMEOUT from its own send or from the last reply, whichever is
+        later, and once it is overdue the board is not answering the rest either.
+        """
+        with self.lock:
+            if not self.window:
+                return None
+            head = next(iter(self.window.values()))
+            deadline = max(head.sent_at, self.progress_at or 0) + RESPONSE_TIMEOUT
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                return remaining
+            overdue = list(self.window.values())
+        for command in overdue:
+            self._retransmit(command, "no response")
+        return self._expire_overdue()
+
+    def _retransmit(self, command, reason):
+        """Send a lost pipelined command again under the same seq, or fail it"""
+        with self.lock:
+            if self.window.get(command.seq) is not command:
+                return      # answered in the meantime
+            # A level write is only safe to repeat while nothing newer has touched its channels
+            retry = (command.retries < SERIAL_RETRANSMITS and command.idempotent
+                     and all(self.pending_writes.get(channel) is command for channel in command.writes or ()))
+            if retry:
+                command.retries += 1
+                command.sent_at = time.monotonic()
+                self.window.move_to_end(command.seq)
+        conn = self.controller.conn
+        if not retry or conn is None:
+            logger.warning("📨 [%s] No response received for: %s (%s)", self.controller.name, command.cmd, reason)
+            if self._resolve(command, None):
+                self.count("timeout")
+            return
+        logger.debug("📨 [%s] %s for #%d, resending: %s", self.controller.name, reason, command.seq, command.cmd)
+        self.retransmits.inc()
+        self._transmit(conn, command)
+
+    def _resolve(self, command, result=None, exception=None):
+        """Complete a command exactly once, whichever thread gets there first"""
+        with self.lock:
+            if self.inflight is command:
+                self.inflight = None
+            if command.tagged and self.window.get(command.seq) is command:
+                del self.window[command.seq]
+                self.window_bytes -= len(command.payload)
+                self.window_open.notify()
+            if command.future.done():
+                return False
+            for channel in command.writes or ():
+                if self.pending_writes.get(channel) is command:
+                    del self.pending_writes[channel]
+            for future in [command.future] + [old.future for old in command.merged]:
+                if future.done():
+                    continue
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+            return True
+
+    def _read_loop(self):
+        """Continuously read the port, frame lines and dispatch them"""
+        conn = None
+
+        while True:
+            current = self.controller.conn
+            if current is not conn:
+                # New (or lost) connection: drop any half line from the old one
+                self.framer.clear()
+                conn = current
+                if conn is not None:
+                    self.last_rx_at = time.monotonic()
+            if conn is None:
+                time.sleep(0.05)
+                continue
+
+            try:
+                data = conn.read(conn.in_waiting or 1)
+            except Exception as e:
+                self.controller.mark_disconnected(conn, f"read error: {e}")
+                conn = None
+                continue
+
+            if data:
+                self.last_rx_at = time.monotonic()
+                for kind, line, seq in self.framer.feed(data):
+                    self._dispatch(kind, line, seq)
+
+    def _waiting_for(self, seq):
+        """The command a reply belongs to, plus older pipelined commands it proves were lost"""
+        with self.lock:
+            command = self.window.get(seq) if seq is not None else None
+            if command is None:
+                return self.inflight, []
+            self.progress_at = time.monotonic()
+            lost = list(itertools.takewhile(lambda older: older is not command, self.window.values()))
+            return command, lost
+
+    def _dispatch(self, kind, line, seq=None):
+        """Match one framed line (seq: its pipelining tag) to the command waiting for it"""
+        command, lost = self._waiting_for(seq)
+        self._dispatch_line(command, kind, line, seq)
+        for older in lost:
+            self._retransmit(older, "reply missing")
+
+    def _dispatch_line(self, command, kind, line, seq):
+        if kind == LINE_ECHO:
+            if command is not None:
+                command.echoed = True
+            return
+
+        if kind in (LINE_ACK, LINE_NAK):
+            self._dispatch_ack(command, kind, seq)
+            return
+
+        # Every OK/STATUS line is real board state, matched or not
+        if kind == LINE_STATUS:
+            parse_status(line, self.controller)
+        elif kind == LINE_OK:
+            parse_ok(line, self.controller)
+
+        if command is not None and command.matches(kind, line, seq):
+            logger.debug("📨 [%s] Response: %s", self.controller.name, line)
+            if self._resolve(command, line):
+                self.observe_rtt(command, time.monotonic() - command.sent_at)
+                self.count("error" if kind == LINE_ERROR else "ok")
+            return
+
+        if kind == LINE_READY:
+            logger.warning("🔄 [%s] Arduino reset detected: %s", self.controller.name, line)
+            BOARD_RESETS.labels(self.controller.name).inc()
+            self.controller.board_reset()
+            # Put the lights back from the supervisor thread, the reader must keep reading
+            self.controller.supervisor.wake()
+        else:
+            self.unmatched_lines += 1
+            self.unmatched.inc()
+            logger.debug("📨 [%s] Unsolicited: %s", self.controller.name, line)
+
+    def _dispatch_ack(self, command, kind, seq):
+        """ACK/NAK byte for a binary frame: apply its levels, or resend it once"""
+        if command is None or not command.matches(kind, None, seq):
+            self.unmatched_lines += 1
+            self.unmatched.inc()
+            logger.debug("📨 [%s] Unexpected %s for frame %d", self.controller.name, kind.upper(), seq)
+            return
+
+        if kind == LINE_NAK and command.retries < FRAME_RETRIES:
+            # Corrupted on the wire: resend from here (the write lock keeps it whole)
+            with self.lock:
+                command.retries += 1
+                command.sent_at = time.monotonic()
+                if command.tagged:
+                    self.window.move_to_end(command.seq)
+            self.retransmits.inc()
+            logger.debug("📨 [%s] NAK for frame %d, resending", self.controller.name, seq)
+            conn = self.controller.conn
+            if conn is not None:
+                self._transmit(conn, command)
+            return
+
+        if kind == LINE_ACK:
+            set_channels_from_pwm(self.controller, command.writes)
+            status_cache.touch()
+            reply = f"ACK:{seq}"
+        else:
+            reply = f"ERROR:NAK:{seq}"
+        logger.debug("📨 [%s] Response: %s", self.controller.name, reply)
+        if self._resolve(command, reply):
+            self.observe_rtt(command, time.monotonic() - command.sent_at)
+            self.count("ok" if kind == LINE_ACK else "error")
+
+class ConnectionSupervisor:
+    """Background thread that reconnects one controller with exponential backoff and
+    sends an occasional heartbeat, so nothing on the request path ever probes ports"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.delay = RECONNECT_MIN_DELAY
+        self.reconnects = 0
+
+    def ensure_started(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self._run,
+                name=f"serial-supervisor-{self.controller.name}",
+                daemon=True
+            )
+            self.thread.start()
+
+    def wake(self):
+        """Ask for a reconnect attempt now instead of at the end of the backoff"""
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            if self.controller.conn is None:
+                if connect_controller(self.controller):
+                    self.reconnects += 1
+                    RECONNECTS.labels(self.controller.name).inc()
+                    self.delay = RECONNECT_MIN_DELAY
+                    continue
+                logger.info("🔄 [%s] Reconnecting in %.0fs", self.controller.name, self.delay)
+                self.wakeup.wait(self.delay)
+                self.wakeup.clear()
+                self.delay = min(self.delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            self.wakeup.wait(HEARTBEAT_INTERVAL)
+            self.wakeup.clear()
+            if self.controller.restore:
+                self.controller.restore_levels()
+            self._check_health()
+
+    def _check_health(self):
+        """PING only when the line has been quiet (the status poller usually keeps it busy)"""
+        conn = self.controller.conn
+        last_rx = self.controller.worker.last_rx_at
+        if conn is None or last_rx is None:
+            return
+        quiet = time.monotonic() - last_rx
+        if quiet < HEARTBEAT_INTERVAL:
+            return
+        # Note: the sketch speaks a short acknowledgement for PING
+        self.controller.send("PING", priority=PRIORITY_BACKGROUND)
+        if time.monotonic() - (self.controller.worker.last_rx_at or 0) >= HEARTBEAT_TIMEOUT:
+            self.controller.mark_disconnected(conn, f"no data for {HEARTBEAT_TIMEOUT:.0f}s")
+
+class Controller:
+    """One Arduino board: its serial port, I/O worker, supervisor and channel map"""
+
+    def __init__(self, name, port=None, channels=3):
+        self.name = name
+        self.port_hint = port       # configured port, None = discover
+        self.port = None            # port actually in use
+        self.conn = None
+        self.channels = channels
+        self.bulbs = {}             # channel -> bulb id
+        self.levels = [0] * channels    # last PWM sent to / reported by each channel
+        self.reported = [None] * channels   # last PWM the board confirmed (None = unknown)
+        # Set to False if the firmware answers SET with ERROR (sketch older than the frame command)
+        self.frame_command_supported = True
+        self.binary = False         # firmware offered binary level frames at connect (CAPS)
+        self.pipelined = False      # firmware tags its replies, so commands may overlap (CAPS)
+        self.restore = None         # {channel: pwm} lost in a board reset, until restore_levels() sends it
+        self.reset_at = None        # monotonic time of that reset
+        self.worker = SerialWorker(self)
+        self.supervisor = ConnectionSupervisor(self)
+        CONNECTED.labels(name).set_function(lambda: 1 if self.conn is not None else 0)
+
+    @property
+    def connected(self):
+        return self.conn is not None
+
+    def start(self):
+        self.worker.ensure_started()
+        self.supervisor.ensure_started()
+
+    def attach(self, conn, port):
+        """Hand a freshly identified port to the worker"""
+        self.conn = conn
+        self.port = port
+        self.reported = [None] * self.channels
+        # Until negotiate_protocol() has heard from this firmware, speak plain text
+        self.binary = False
+        self.pipelined = False
+        refresh_connection_state()
+
+    def get_connection(self):
+        """Current connection, or None while the supervisor reconnects in the background"""
+        if self.conn is None:
+            self.supervisor.wake()
+        return self.conn
+
+    def mark_disconnected(self, conn, reason):
+        """Drop a failed connection and let the supervisor reconnect"""
+        if conn is None or conn is not self.conn:
+            return
+        logger.error("❌ [%s] Arduino connection lost: %s", self.name, reason)
+        DISCONNECTS.labels(self.name).inc()
+        self.conn = None
+        self.reported = [None] * self.channels
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.supervisor.wake()
+        refresh_connection_state()
+
+    @property
+    def protocol(self):
+        return "binary" if self.binary else "text"
+
+    @property
+    def window(self):
+        """Commands that may be in flight at once"""
+        return SERIAL_WINDOW if self.pipelined else 1
+
+    def submit(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None, binary=False):
+        return self.worker.submit(cmd, priority, cancel_event, binary)
+
+    async def submit_async(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None, binary=False):
+        return await self.worker.submit_async(cmd, priority, cancel_event, binary)
+
+    def send(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None):
+        """Send one command and wait for its reply"""
+        return wait_reply(self.submit(cmd, priority, cancel_event), cmd)
+
+    async def send_async(self, cmd, priority=PRIORITY_MANUAL, cancel_event=None):
+        """Send one command and await its reply without holding a thread"""
+        return await wait_reply_async(await self.submit_async(cmd, priority, cancel_event), cmd)
+
+    def reports(self, writes):
+        """Has the board already confirmed every one of these {channel: pwm} levels?"""
+        return all(
+            1 <= channel <= self.channels and self.reported[channel - 1] == pwm
+            for channel, pwm in writes.items()
+        )
+
+    def board_reset(self):
+        """The sketch starts with every channel off; remember what was lit for restore_levels()"""
+        lost = {channel: pwm for channel, pwm in enumerate(self.levels, start=1) if pwm}
+        if lost:
+            self.restore = lost
+            self.reset_at = time.monotonic()
+        set_channels_from_pwm(self, {channel: 0 for channel in range(1, self.channels + 1)})
+
+    def restore_levels(self):
+        """Put back the levels a board reset lost, in one batched write (not while an effect plays)"""
+        lost, self.restore = self.restore, None
+        if not lost or effect_running():
+            return None
+        response = send_levels({self.bulbs[channel]: pwm for channel, pwm in lost.items() if channel in self.bulbs})
+        if response:
+            elapsed = time.monotonic() - self.reset_at
+            RESTORE_TIME.labels(self.name).observe(elapsed)
+            logger.info("💡 [%s] Restored %d level(s) %.0f ms after the reset", self.name, len(lost), elapsed * 1000)
+        else:
+            logger.warning("⚠️ [%s] Could not restore the levels lost in the reset", self.name)
+        return response
+
+    def frame_command(self, channel_values):
+        """SET command for this board, unchanged channels keep their last level"""
+        values = list(self.levels)
+        for channel, value in channel_values.items():
+            values[channel - 1] = max(0, min(255, int(value)))
+        self.levels = values
+        return "SET " + " ".join(str(v) for v in values)
+
+    def level_frame(self, channel_values):
+        """(command, binary) that sets these channels in one write, or None for per-bulb writes"""
+        if self.binary:
+            writes = {channel: max(0, min(255, int(value))) for channel, value in channel_values.items()}
+            for channel, value in writes.items():
+                self.levels[channel - 1] = value
+            return binary_command_text(writes), True
+        if self.frame_command_supported:
+            return self.frame_command(channel_values), False
+        return None
+
+    def negotiate_protocol(self):
+        """Ask the firmware what it supports (CAPS); older sketches answer ERROR and stay on text"""
+        self.binary = False
+        self.pipelined = False
+        reply = self.send("CAPS")
+        capabilities = reply.upper().split(":")[1:] if reply and reply.upper().startswith("CAPS:") else []
+        self.binary = SERIAL_PROTOCOL != "text" and "BIN1" in capabilities
+        self.pipelined = SERIAL_WINDOW > 1 and "SEQ" in capabilities
+        logger.info("🔧 [%s] Serial protocol: %s, window %d", self.name, self.protocol, self.window)
+        refresh_connection_state()
+
+def wait_reply(future, cmd):
+    """Wait for a submitted command's reply line, None on timeout or error"""
+    try:
+        return future.result(timeout=REPLY_TIMEOUT)
+    except FutureTimeoutError:
+        logger.warning("⚠️ Timed out waiting for: %s", cmd)
+    except Exception as e:
+        logger.error("❌ Error sending command: %s", e)
+    return None
+
+async def wait_reply_async(future, cmd):
+    """wait_reply() for the event loop: awaits the worker's future instead of blocking a thread"""
+    try:
+        # shield: a timeout or a client disconnect must not cancel the command under the worker
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=REPLY_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("⚠️ Timed out waiting for: %s", cmd)
+    except Exception as e:
+        logger.error("❌ Error sending command: %s", e)
+    return None
+
+class Bulb:
+    """A bulb in the registry: which controller and channel drive it"""
+
+    def __init__(self, bulb_id, controller, channel, pin=None, name=None):
+        self.id = bulb_id
+        self.key = f"bulb{bulb_id}"
+        self.controller = controller
+        self.channel = channel
+        self.pin = pin
+        self.name = name            # what voice commands may call it besides "light N" ("desk lamp")
+
+class DeviceRegistry:
+    """Maps bulb ids to (controller, channel), loaded from BRIDGE_CONFIG.
+
+    Config file (JSON):
+        {
+          "controllers": [{"name": "living-room", "port": "/dev/ttyACM0"},
+                          {"name": "kitchen"}],
+          "bulbs": [{"id": 1, "controller": "living-room", "channel": 1, "pin": 9, "name": "sofa lamp"}, ...]
+        }
+    A controller without "port" is auto-discovered; "name" is optional. Without "bulbs", every
+    controller gets 3 bulbs numbered in order. Without a config file there is
+    one auto-discovered controller, "main", driving bulbs 1-3.
+    """
+
+    def __init__(self):
+        self.controllers = {}
+        self.bulbs = {}
+        self.by_key = {}            # "bulbN" -> bulb
+
+    def load(self, config):
+        for entry in config.get("controllers") or [{"name": "main"}]:
+            controller = Controller(entry["name"], entry.get("port"), entry.get("channels", 3))
+            self.controllers[controller.name] = controller
+
+        bulb_entries = config.get("bulbs")
+        if not bulb_entries:
+            bulb_entries = []
+            for controller in self.controllers.values():
+                for channel in range(1, controller.channels + 1):
+                    bulb_entries.append({
+                        "id": len(bulb_entries) + 1,
+                        "controller": controller.name,
+                        "channel": channel,
+                        "pin": DEFAULT_PINS.get(channel)
+                    })
+
+        for entry in sorted(bulb_entries, key=lambda e: e["id"]):
+            controller = self.controllers[entry["controller"]]
+            bulb = Bulb(entry["id"], controller, entry["channel"], entry.get("pin"), entry.get("name"))
+            if bulb.channel in controller.bulbs:
+                raise ValueError(f"Channel {bulb.channel} of {controller.name} is mapped twice")
+            controller.bulbs[bulb.channel] = bulb.id
+            self.bulbs[bulb.id] = bulb
+            self.by_key[bulb.key] = bulb
+        return self
+
+    @property
+    def primary(self):
+        return next(iter(self.controllers.values()))
+
+    def bulb_for(self, controller, channel):
+        bulb_id = controller.bulbs.get(channel)
+        return self.bulbs[bulb_id] if bulb_id is not None else None
+
+def load_registry():
+    """Build the device registry from BRIDGE_CONFIG (or the single-board default)"""
+    config = {}
+    if os.path.exists(BRIDGE_CONFIG):
+        with open(BRIDGE_CONFIG) as f:
+            config = json.load(f)
+        logger.info("📄 Loaded device config from %s", BRIDGE_CONFIG)
+    return DeviceRegistry().load(config)
+
+registry = load_registry()
+
+# Light state: one "bulbN" entry per registered bulb, plus bridge-wide fields
+state_store = StateStore(((bulb.key, bulb.pin) for bulb in registry.bulbs.values()), registry.controllers,
+                         on_level=lambda key, percent: history.series(key, level=True).set(percent))
+for bulb in registry.bulbs.values():
+    history.series(bulb.key, level=True)
+
+# Voice/text phrases: bulb names, and controller names for all of a board's bulbs
+intent_engine = IntentEngine(
+    {bulb.id: [bulb.name] if bulb.name else [] for bulb in registry.bulbs.values()},
+    groups={name: list(controller.bulbs.values()) for name, controller in registry.controllers.items()
+            if len(registry.controllers) > 1}
+)
+
+def open_state_db():
+    """The state database, in memory only if STATE_DB is empty or unusable"""
+    if STATE_DB:
+        try:
+            return StateDatabase(STATE_DB)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("⚠️ Could not open state database %s: %s (state will not survive a restart)", STATE_DB, e)
+    return StateDatabase(":memory:")
+
+def warm_restore(saved):
+    """Start from the last saved levels instead of all off.
+
+    The dashboard shows them until a board reports otherwise, and a board that comes
+    up reset gets them back in one write (Controller.board_reset / restore_levels).
+    """
+    if not saved:
+        return
+    levels = {}
+    for key, pwm in saved["levels"].items():
+        bulb = registry.by_key.get(key)
+        if bulb is not None and 1 <= bulb.channel <= bulb.controller.channels:
+            bulb.controller.levels[bulb.channel - 1] = levels[key] = max(0, min(255, int(pwm)))
+    state_store.set_pwm(levels)
+    logger.info("💾 Last state restored from %s (saved %.0fs ago)", STATE_DB, time.time() - saved["saved_at"])
+
+state_db = open_state_db()
+warm_state = state_db.load_state()
+warm_restore(warm_state)
+
+def refresh_connection_state():
+    """Mirror controller connections into the state store (connected = every board is up)"""
+    state_store.set_controllers({
+        c.name: {"connected": c.connected, "port": c.port, "protocol": c.protocol, "window": c.window}
+        for c in registry.controllers.values()
+    })
+
+def resolve_controller(name=None):
+    """Controller by name (the first configured one by default)"""
+    if name is None:
+        return registry.primary
+    if name not in registry.controllers:
+        raise HTTPException(status_code=400, detail=f"Unknown controller '{name}'")
+    return registry.controllers[name]
+
+def validate_levels(levels):
+    """Stored levels ({bulb key: brightness 0-100}), or HTTPException 400"""
+    for key, brightness in levels.items():
+        if key not in registry.by_key:
+            raise HTTPException(status_code=400, detail=f"Unknown bulb '{key}'")
+        # bool is an int subclass; true would be stored and applied as 1%
+        if isinstance(brightness, bool) or not isinstance(brightness, int) or not 0 <= brightness <= 100:
+            raise HTTPException(status_code=400, detail=f"Brightness of '{key}' must be a whole number 0-100")
+    return levels
+
+def send_to_arduino(cmd, priority=PRIORITY_MANUAL, cancel_event=None, controller=None):
+    """Send command to an Arduino (the primary one by default) and wait for its reply"""
+    controller = controller or registry.primary
+    return assume_reply(cmd, controller, controller.send(cmd, priority, cancel_event))
+
+async def send_to_arduino_async(cmd, priority=PRIORITY_MANUAL, cancel_event=None, controller=None):
+    """send_to_arduino() for async endpoints"""
+    controller = controller or registry.primary
+    return assume_reply(cmd, controller, await controller.send_async(cmd, priority, cancel_event))
+
+def assume_reply(cmd, controller, response):
+    if response is None:
+        # For simple commands, assume success
+        simple_commands = ["B1 ON", "B1 OFF", "B2 ON", "B2 OFF", "B3 ON", "B3 OFF",
+                         "ALL ON", "ALL OFF", "BOTH ON", "BOTH OFF"]
+        if cmd.upper() in simple_commands and controller.connected:
+            return f"OK:{cmd}"
+        return None
+
+    return response
+
+def first_reply(responses):
+    """First non-empty reply from a broadcast (None if every controller failed)"""
+    return next((r for r in responses if r), None)
+
+def broadcast(cmd, priority=PRIORITY_MANUAL):
+    """Send the same command to every controller at once, returns the replies"""
+    pending = [c.submit(cmd, priority) for c in registry.controllers.values()]
+    return [wait_reply(future, cmd) for future in pending]
+
+async def broadcast_async(cmd, priority=PRIORITY_MANUAL):
+    """broadcast() for async endpoints"""
+    pending = [await c.submit_async(cmd, priority) for c in registry.controllers.values()]
+    return list(await asyncio.gather(*(wait_reply_async(future, cmd) for future in pending)))
+
+def percent_to_pwm(percent):
+    """Brightness 0-100 as PWM 0-255, rounded (so 100% is a full 255, as ON sends)"""
+    return round(percent * 255 / 100)
+
+def levels_by_controller(levels):
+    """Group {bulb id: pwm} into {controller: {channel: pwm}}"""
+    by_controller = {}
+    for bulb_id, value in levels.items():
+        bulb = registry.bulbs[bulb_id]
+        by_controller.setdefault(bulb.controller, {})[bulb.channel] = value
+    return by_controller
+
+def frame_rejected(controller, channel_values, response, binary=False):
+    """Did the board refuse the frame? Then stop using that frame type and write per bulb"""
+    if not (response or "").upper().startswith("ERROR"):
+        return False
+    if binary:
+        logger.warning("⚠️ [%s] Binary frames keep failing, switching to the text protocol", controller.name)
+        controller.binary = False
+        refresh_connection_state()
+    else:
+        logger.warning("⚠️ [%s] Firmware has no SET command, falling back to per-bulb writes", controller.name)
+        controller.frame_command_supported = False
+    SERIAL_RETRIES.labels(controller.name).inc(len(channel_values))
+    return True
+
+def send_levels(levels, priority=PRIORITY_MANUAL, cancel_event=None):
+    """Set PWM for any set of bulbs ({bulb id: 0-255}).
+
+    Each controller gets one frame (binary if negotiated, else SET), and all controllers
+    are written concurrently, so a frame costs one round trip however many boards there are.
+    """
+    return collect_levels(submit_levels(levels, priority, cancel_event), priority, cancel_event)
+
+def submit_levels(levels, priority=PRIORITY_MANUAL, cancel_event=None):
+    """First half of send_levels(): queue one frame per controller, don't wait for the replies"""
+    pending = []
+    for controller, channel_values in levels_by_controller(levels).items():
+        frame = controller.level_frame(channel_values)
+        if frame is not None:
+            cmd, binary = frame
+            pending.append((controller, channel_values, frame,
+                            controller.submit(cmd, priority, cancel_event, binary)))
+        else:
+            pending.append((controller, channel_values, None, None))
+    return pending
+
+def collect_levels(pending, priority=PRIORITY_MANUAL, cancel_event=None):
+    """Second half of send_levels(): wait for the frames, falling back to per-bulb writes"""
+    responses = []
+    for controller, channel_values, frame, future in pending:
+        if future is not None:
+            response = wait_reply(future, frame[0])
+            if not frame_rejected(controller, channel_values, response, frame[1]):
+                responses.append(response)
+                continue
+        for channel, value in channel_values.items():
+            response = controller.send(f"B{channel} {int(value)}", priority, cancel_event)
+        responses.append(response)
+    return responses[-1] if responses else None
+
+async def send_levels_async(levels, priority=PRIORITY_MANUAL, cancel_event=None):
+    """send_levels() for async endpoints"""
+    return await collect_levels_async(await submit_levels_async(levels, priority, cancel_event), priority, cancel_event)
+
+async def submit_levels_async(levels, priority=PRIORITY_MANUAL, cancel_event=None):
+    """submit_levels() for the event loop"""
+    pending = []
+    for controller, channel_values in levels_by_controller(levels).items():
+        frame = controller.level_frame(channel_values)
+        if frame is not None:
+            cmd, binary = frame
+            pending.append((controller, channel_values, frame,
+                            await controller.submit_async(cmd, priority, cancel_event, binary)))
+        else:
+            pending.append((controller, channel_values, None, None))
+    return pending
+
+async def collect_levels_async(pending, priority=PRIORITY_MANUAL, cancel_event=None):
+    """collect_levels() for the event loop"""
+    responses = []
+    for controller, channel_values, frame, future in pending:
+        if future is not None:
+            response = await wait_reply_async(future, frame[0])
+            if not frame_rejected(controller, channel_values, response, frame[1]):
+                responses.append(response)
+                continue
+        for channel, value in channel_values.items():
+            response = await controller.send_async(f"B{channel} {int(value)}", priority, cancel_event)
+        responses.append(response)
+    return responses[-1] if responses else None
 
-def get_arduino_connection():
-    """Get or create Arduino connection with retry"""
-    global arduino
-    
-    # If we have a working connection, return it
-    if arduino is not None and current_state["connected"]:
-        try:
-            # Quick test to see if connection is still alive
-            arduino.write(b"\n")
-            time.sleep(0.1)
-            return arduino
-        except:
-            # Connection lost
-            current_state["connected"] = False
-            arduino = None
-    
-    # Try to reconnect
-    if connect_arduino():
-        return arduino
-    
-    return None
+class StatusCache:
+    """When the state store was last refreshed from the board"""
 
-def send_to_arduino(cmd):
-    """Send command to Arduino with auto-reconnect"""
-    max_retries = 2
-    
-    for attempt in range(max_retries):
+    def __init__(self):
+        self.response = None        # last STATUS line
+        self.updated_at = None      # monotonic time of the last STATUS/OK line
+        self.status_at = None       # monotonic time of the last STATUS line
+
+    def touch(self, response=None):
+        now = time.monotonic()
+        self.updated_at = now
+        if response is not None:
+            self.response = response
+            self.status_at = now
+
+    def age(self):
+        """Seconds since the cache was last refreshed, or None if never"""
+        if self.updated_at is None:
+            return None
+        return time.monotonic() - self.updated_at
+
+class StateStream:
+    """Push coalesced state store diffs to WebSocket and SSE subscribers.
+
+    The store calls notify() after every change, from any thread; the
+    broadcaster task on the event loop wakes at most STREAM_MAX_FPS times a
+    second, diffs once and fans the same serialized frame out to every
+    subscriber, so viewers cost no serial traffic. Frames carry the store's
+    version, the same one the HTTP responses report.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.wakeup = None
+        self.pending = False
+        self.subscribers = set()
+        self.version, self.last_snapshot = state_store.versioned()
+        self.task = None
+        state_store.subscribe(self.notify)
+
+    def start(self, loop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.version, self.last_snapshot = state_store.versioned()
+        self.task = loop.create_task(self._broadcast())
+
+    def notify(self):
+        """Mark the state dirty (cheap, callable from any thread)"""
+        if self.loop is None or self.pending:
+            return
+        self.pending = True
         try:
-            arduino_conn = get_arduino_connection()
-            if arduino_conn is None:
-                print(f"⚠️ Arduino not connected (attempt {attempt + 1}/{max_retries})")
-                if attempt < max_retries - 1:
-                    time.sleep(1)
-                    continue
-                return None
-            
-            print(f"📨 Sending: {cmd}")
-            arduino_conn.write(f"{cmd}\n".encode())
-            arduino_conn.flush()
-            
-            # Wait for response
-            time.sleep(0.1)
-            
-            # Try to read response
-            if arduino_conn.in_waiting:
-                response = arduino_conn.readline().decode('utf-8', errors='ignore').strip()
-                print(f"📨 Response: {response}")
-                
-                # Update state if STATUS command
-                if cmd.upper() == "STATUS":
-                    parse_status(response)
-                
-                return response
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            # Event loop already closed
+            self.pending = False
+
+    def snapshot_frame(self):
+        return json.dumps({
+            "type": "snapshot",
+            "version": self.version,
+            "state": self.last_snapshot,
+            "timestamp": time.time()
+        })
+
+    def subscribe(self):
+        subscriber = asyncio.Queue(maxsize=STREAM_CLIENT_QUEUE)
+        subscriber.put_nowait(self.snapshot_frame())
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _broadcast(self):
+        min_interval = 1.0 / STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else 0
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self.pending = False
+
+            version, snapshot = state_store.versioned()
+            changes = None
+            if version != self.version:
+                # The store shares unchanged bulb dicts between versions, so this diff is cheap
+                changes = diff_state(self.last_snapshot, snapshot)
+                self.version, self.last_snapshot = version, snapshot
+            if changes:
+                frame = json.dumps({
+                    "type": "diff",
+                    "version": self.version,
+                    "changes": changes,
+                    "timestamp": time.time()
+                })
             else:
-                # No response, but command might have succeeded
-                print(f"📨 No response received for: {cmd}")
-                
-                # For simple commands, assume success
-                simple_commands = ["B1 ON", "B1 OFF", "B2 ON", "B2 OFF", "B3 ON", "B3 OFF", 
-                                 "ALL ON", "ALL OFF", "BOTH ON", "BOTH OFF"]
-                if cmd.upper() in simple_commands:
-                    return f"OK:{cmd}"
-                
-                return None
-                
-        except Exception as e:
-            print(f"❌ Error sending command (attempt {attempt + 1}): {e}")
-            current_state["connected"] = False
-            arduino = None
-            
-            if attempt < max_retries - 1:
-                print("🔄 Retrying connection...")
-                time.sleep(1)
+                frame = json.dumps({"type": "keepalive", "version": self.version})
+            self._publish(frame)
+
+            # Coalesce everything that changes during this window into the next frame
+            if min_interval:
+                await asyncio.sleep(min_interval)
+
+    def _publish(self, frame):
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Slow client: throw away its backlog and resync it with a snapshot
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(self.snapshot_frame())
+
+def desired_state(previous=None):
+    """What a restart should bring back: the levels set by hand (including any a reset board
+    is still waiting for) and the effect playing. Effect frames are not levels anyone chose,
+    so while one plays the previously saved levels are kept."""
+    run = effect_engine.current
+    if live_shows.active():
+        # Same for a client's live show
+        return {"levels": previous["levels"] if previous else {}, "mode": "manual", "effect": None}
+    if effect_running():
+        return {
+            "levels": previous["levels"] if previous else {},
+            "mode": run.name,
+            "effect": {"name": run.name, "speed": run.speed},
+        }
+    levels = {}
+    for bulb in registry.bulbs.values():
+        controller = bulb.controller
+        if 1 <= bulb.channel <= controller.channels:
+            levels[bulb.key] = (controller.restore or {}).get(bulb.channel, controller.levels[bulb.channel - 1])
+    return {"levels": levels, "mode": state_store.mode, "effect": None}
+
+class StateSaver:
+    """Write the desired state to the database in the background.
+
+    Subscribed to the state store: a change marks the state dirty, and the saver
+    writes once things have been quiet for STATE_SAVE_DELAY, and only if the
+    result differs from what is already saved, so effects and slider drags cost
+    at most one small write per second. Callers on the event loop take a
+    checkpoint() instead of writing themselves.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.checkpointed = threading.Event()
+        self.thread = None
+        self.saved = None           # last state written
+        self.latest = None          # last state worked out, written or not
+
+    def start(self, saved=None):
+        if self.thread is not None:
+            return
+        self.saved = self.latest = saved and {key: saved[key] for key in ("levels", "mode", "effect")}
+        state_store.subscribe(self.dirty.set)
+        self.thread = threading.Thread(target=self._run, name="state-saver", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.dirty.wait()
+            # Let a burst of changes settle into one write; a checkpoint is written right away
+            # (effect frames never settle)
+            while not self.checkpointed.is_set():
+                self.dirty.clear()
+                if not self.checkpointed.wait(STATE_SAVE_DELAY) and not self.dirty.is_set():
+                    break
+            checkpoint = self.checkpointed.is_set()
+            self.checkpointed.clear()
+            self.save(checkpoint)
+
+    def checkpoint(self):
+        """Remember the desired state as it is now (no I/O, safe on the event loop); the saver
+        thread writes it. Called as an effect starts, so the levels set by hand are what gets
+        kept while it plays."""
+        with self.lock:
+            if self.thread is None:
+                return
+            self.latest = desired_state(self.latest)
+        self.checkpointed.set()
+        self.dirty.set()
+
+    def save(self, checkpoint=False):
+        """Write the desired state now (the last checkpoint as taken if `checkpoint`) if it
+        changed since the last write"""
+        with self.lock:
+            if self.thread is None:
+                # Not started yet: what is saved is still the state we warm-started from
+                return
+            state = self.latest if checkpoint else desired_state(self.latest)
+            self.latest = state
+            if state == self.saved:
+                return
+            try:
+                self.db.save_state(**state)
+                self.saved = state
+            except sqlite3.Error as e:
+                logger.warning("⚠️ Could not save state: %s", e)
+
+state_stream = StateStream()
+state_saver = StateSaver(state_db)
+status_cache = StatusCache()
+status_poller_thread = None
+
+class SnapshotPublisher:
+    """Broker side of multi-process serving: copy each state snapshot to shared memory for the workers.
+
+    The store only marks it dirty; one thread serializes the latest snapshot,
+    so a burst of changes (effect frames) costs one write per wake-up. A
+    status poll that changed nothing is republished too, so the workers'
+    "age" stays right.
+    """
+
+    def __init__(self):
+        self.writer = None
+        self.changed = threading.Event()
+        self.thread = None
+        self.version = None         # store version and status cache time last published
+        self.updated_at = None
+
+    def start(self, path=BROKER_SHM):
+        self.writer = SnapshotWriter(path)
+        self.publish()
+        state_store.subscribe(self.changed.set)
+        self.thread = threading.Thread(target=self._run, name="snapshot-publisher", daemon=True)
+        self.thread.start()
+
+    def publish(self):
+        version, state = state_store.versioned()
+        updated_at = status_cache.updated_at
+        age = status_cache.age()
+        self.writer.publish(json.dumps({
+            "version": version,
+            "state": state,
+            "arduino_response": status_cache.response,
+            "updated_at": time.time() - age if age is not None else None,
+        }).encode())
+        self.version, self.updated_at = version, updated_at
+
+    def _run(self):
+        while True:
+            self.changed.wait(SNAPSHOT_REFRESH)
+            self.changed.clear()
+            if state_store.version == self.version and status_cache.updated_at == self.updated_at:
                 continue
-    
-    return None
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("❌ Could not publish the state snapshot")
 
-def parse_status(response):
-    """Parse Arduino status response for 3 bulbs"""
+snapshot_publisher = SnapshotPublisher()
+
+def set_channels_from_pwm(controller, channel_pwms, mode=None):
+    """Record {channel: pwm} levels the board reported, as one state change"""
+    levels = {}
+    for channel, pwm in channel_pwms.items():
+        if 1 <= channel <= controller.channels:
+            controller.levels[channel - 1] = pwm
+            controller.reported[channel - 1] = pwm
+        bulb = registry.bulb_for(controller, channel)
+        if bulb is not None:
+            levels[bulb.key] = pwm
+    state_store.set_pwm(levels, mode)
+
+def effect_running():
+    return effect_engine.running()
+
+def parse_status(response, controller=None):
+    """Parse one controller's status line (STATUS:B1:0:B2:0:B3:0:MODE:MANUAL)"""
+    controller = controller or registry.primary
     if response and ("STATUS:" in response):
         try:
             parts = response.split(":")
-            if len(parts) >= 9:  # STATUS:B1:0:B2:0:B3:0:MODE:MANUAL
-                # Bulb 1
-                b1_val = int(parts[2])
-                current_state["bulb1"]["brightness"] = int(b1_val / 2.55)
-                current_state["bulb1"]["state"] = "on" if b1_val > 0 else "off"
-                
-                # Bulb 2
-                b2_val = int(parts[4])
-                current_state["bulb2"]["brightness"] = int(b2_val / 2.55)
-                current_state["bulb2"]["state"] = "on" if b2_val > 0 else "off"
-                
-                # Bulb 3
-                b3_val = int(parts[6])
-                current_state["bulb3"]["brightness"] = int(b3_val / 2.55)
-                current_state["bulb3"]["state"] = "on" if b3_val > 0 else "off"
-                
-                # Mode
-                current_state["mode"] = parts[8].lower() if len(parts) > 8 else "manual"
+            fields = dict(zip(parts[1::2], parts[2::2]))
+            channel_pwms = {int(key[1:]): int(value) for key, value in fields.items()
+                            if key.upper().startswith("B") and key[1:].isdigit()}
+            # Mode (bridge-side effects drive the sketch in MANUAL mode)
+            mode = None if effect_running() or live_shows.active() else fields.get("MODE", "manual").lower()
+            set_channels_from_pwm(controller, channel_pwms, mode)
+            status_cache.touch(response)
+        except Exception as e:
+            logger.warning("⚠️ Error parsing status: %s", e)
+
+def parse_ok(response, controller=None):
+    """Update the state store from an OK:B1:255, OK:B2:ON, OK:ALL:OFF or OK:SET:255:0:128 reply"""
+    controller = controller or registry.primary
+    try:
+        parts = response.split(":")
+        if len(parts) < 3:
+            return
+        target, value = parts[1].upper(), parts[2].upper()
+        
+        if target == "SET":
+            set_channels_from_pwm(controller, {channel: int(pwm) for channel, pwm in enumerate(parts[2:], start=1)})
+            status_cache.touch()
+            return
+        if value == "ON":
+            pwm = 255
+        elif value == "OFF":
+            pwm = 0
+        else:
+            pwm = int(value)
+        
+        if target == "ALL":
+            channels = range(1, controller.channels + 1)
+        else:
+            channels = [int(target[1:])]
+        
+        set_channels_from_pwm(controller, {channel: pwm for channel in channels})
+        status_cache.touch()
+    except Exception as e:
+        logger.warning("⚠️ Error parsing reply: %s", e)
+
+def status_poller():
+    """Keep the status cache fresh with one background STATUS per controller per interval"""
+    while True:
+        time.sleep(STATUS_POLL_INTERVAL)
+        # A fresh=1 read may already have refreshed it
+        if status_cache.status_at is not None and time.monotonic() - status_cache.status_at < STATUS_POLL_INTERVAL:
+            continue
+        try:
+            broadcast("STATUS", priority=PRIORITY_BACKGROUND)
         except Exception as e:
-            print(f"⚠️ Error parsing status: {e}")
+            logger.warning("⚠️ Status poll failed: %s", e)
+
+@app.on_event("startup")
+async def start_state_stream():
+    """Start the state stream broadcaster on the server's event loop"""
+    state_stream.start(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+def save_state_on_shutdown():
+    """Don't lose the last second of changes to the save delay"""
+    state_saver.save()
+    if history_spill is not None:
+        history_spill.spill()
+
+@app.on_event("startup")
+def start_background_workers():
+    """Start each controller's serial worker and supervisor, and the status poller, with the app"""
+    global status_poller_thread
+    for controller in registry.controllers.values():
+        controller.start()
+    # Pick up the effect that was playing when the bridge went down
+    effect = warm_state and warm_state["effect"]
+    if effect and effect["name"] in EFFECTS and not effect_running():
+        logger.info("🎬 Resuming %s effect", effect["name"])
+        start_effect(effect["name"], effect["speed"])
+    state_saver.start(warm_state)
+    if history_spill is not None:
+        history_spill.start()
+    if scheduler.thread is None:
+        load_rules()
+        scheduler.start()
+    if STATUS_POLL_INTERVAL > 0 and status_poller_thread is None:
+        status_poller_thread = threading.Thread(
+            target=status_poller,
+            name="status-poller",
+            daemon=True
+        )
+        status_poller_thread.start()
 
 # ========== API ENDPOINTS ==========
 
 @app.get("/")
-def root():
+async def root():
     return {
         "service": "Smart Bulb Control",
         "version": "4.0",
-        "bulbs": 3,
-        "pins": {"bulb1": 9, "bulb2": 10, "bulb3": 11},
+        "bulbs": len(registry.bulbs),
+        "pins": {bulb.key: bulb.pin for bulb in registry.bulbs.values()},
+        "controllers": {
+            name: {"port": c.port, "connected": c.connected, "bulbs": sorted(c.bulbs.values())}
+            for name, c in registry.controllers.items()
+        },
         "endpoints": {
             "bulb_control": "POST /api/bulb",
             "effect": "POST /api/effect",
             "group": "POST /api/group",
+            "scene": "POST /api/scene",
+            "scenes": "GET /api/scene",
+            "batch": "POST /api/batch",
+            "voice": "POST /api/voice",
+            "schedule": "POST /api/schedule",
+            "schedules": "GET /api/schedule",
+            "history": "GET /api/history",
             "status": "GET /api/status",
-            "command": "POST /api/command"
+            "stream": "WS /api/stream",
+            "stream_sse": "GET /api/stream/sse",
+            "live": "WS /api/live",
+            "command": "POST /api/command",
+            "metrics": "GET /metrics"
         },
-        "arduino_connected": current_state["connected"]
+        "arduino_connected": state_store.connected
     }
 
 @app.post("/api/command")
-def send_command(cmd: str):
-    """Send raw command to Arduino"""
-    response = send_to_arduino(cmd)
+async def send_command(cmd: str, controller: Optional[str] = None):
+    """Send raw command to an Arduino (the first controller unless one is named)"""
+    response = await send_to_arduino_async(cmd, controller=resolve_controller(controller))
+    version, state = state_store.versioned()
     
     if response:
         return {
             "success": True,
             "command": cmd,
             "response": response,
-            "state": current_state,
-            "connected": current_state["connected"]
+            "state": state,
+            "version": version,
+            "connected": state["connected"]
         }
     else:
         return {
             "success": False,
             "error": "Arduino not connected or no response",
-            "state": current_state,
-            "connected": current_state["connected"]
+            "state": state,
+            "version": version,
+            "connected": state["connected"]
         }
 
 @app.post("/api/bulb")
-def control_bulb(command: BulbCommand):
-    """Control individual bulb (1, 2, or 3)"""
-    # Stop any running effects first
-    if effect_thread and effect_thread.is_alive():
-        stop_effects.set()
-        effect_thread.join(timeout=1)
-        stop_effects.clear()
-    
-    if command.bulb not in [1, 2, 3]:
-        raise HTTPException(status_code=400, detail="Bulb must be 1, 2, or 3")
-    
-    bulb_key = f"bulb{command.bulb}"
+async def control_bulb(command: BulbCommand):
+    """Control an individual bulb"""
+    bulb = registry.bulbs.get(command.bulb)
+    if bulb is None:
+        raise HTTPException(status_code=400, detail=f"Bulb must be one of {list(registry.bulbs)}")
+    
+    # Cancel any running effect or live show (its queued frames are skipped, nothing waits) and stop
+    # ramping this bulb
+    effect_engine.stop()
+    live_shows.stop()
+    release_ramps([bulb.key])
+    
+    bulb_key = bulb.key
     response = None
     
     if command.action == "on":
-        response = send_to_arduino(f"B{command.bulb} ON")
-        current_state[bulb_key]["state"] = "on"
-        current_state[bulb_key]["brightness"] = 100
-        current_state["mode"] = "manual"
+        response = await send_to_arduino_async(f"B{bulb.channel} ON", controller=bulb.controller)
+        state_store.set_brightness({bulb_key: 100}, mode="manual")
         
     elif command.action == "off":
-        response = send_to_arduino(f"B{command.bulb} OFF")
-        current_state[bulb_key]["state"] = "off"
-        current_state[bulb_key]["brightness"] = 0
-        current_state["mode"] = "manual"
+        response = await send_to_arduino_async(f"B{bulb.channel} OFF", controller=bulb.controller)
+        state_store.set_brightness({bulb_key: 0}, mode="manual")
         
     elif command.action == "brightness":
         if command.value is None or not 0 <= command.value <= 100:
@@ -352,311 +2220,1025 @@ def control_bulb(command: BulbCommand):
         
         # Convert to PWM (0-255)
         pwm_value = int(command.value * 2.55)
-        response = send_to_arduino(f"B{command.bulb} {pwm_value}")
-        current_state[bulb_key]["brightness"] = command.value
-        current_state[bulb_key]["state"] = "on" if command.value > 0 else "off"
-        current_state["mode"] = "manual"
+        response = await send_to_arduino_async(f"B{bulb.channel} {pwm_value}", controller=bulb.controller)
+        state_store.set_brightness({bulb_key: command.value}, mode="manual")
     
     else:
         raise HTTPException(status_code=400, detail="Action must be 'on', 'off', or 'brightness'")
     
+    version, state = state_store.bulb(bulb_key)
+    
     return {
         "success": True if response else False,
         "bulb": command.bulb,
         "action": command.action,
         "value": command.value,
         "response": response,
-        "state": current_state[bulb_key],
-        "connected": current_state["connected"]
+        "state": state,
+        "version": version,
+        "connected": state_store.connected
     }
 
 @app.post("/api/effect")
-def control_effect(command: EffectCommand):
+async def control_effect(command: EffectCommand):
     """Start/stop effects"""
-    global effect_thread
-    
-    # Stop any running effects
-    if effect_thread and effect_thread.is_alive():
-        stop_effects.set()
-        effect_thread.join(timeout=1)
-        effect_thread = None
-    
-    stop_effects.clear()
-    current_state["mode"] = command.effect
-    
-    if command.effect == "strobe":
-        # Start strobe effect thread
-        effect_thread = threading.Thread(
-            target=strobe_effect, 
-            args=(command.speed or 2,),
-            daemon=True
-        )
-        effect_thread.start()
-        response = "Strobe effect started"
-        
-    elif command.effect == "fade":
-        # Start fade effect thread
-        effect_thread = threading.Thread(
-            target=fade_effect,
-            daemon=True
-        )
-        effect_thread.start()
-        response = "Fade effect started"
-        
-    elif command.effect == "pulse":
-        # Start pulse effect thread
-        effect_thread = threading.Thread(
-            target=pulse_effect,
-            daemon=True
-        )
-        effect_thread.start()
-        response = "Pulse effect started"
-        
-    elif command.effect == "alternate":
-        # Start alternate effect thread
-        effect_thread = threading.Thread(
-            target=alternate_effect,
-            daemon=True
-        )
-        effect_thread.start()
-        response = "Alternate effect started"
-        
-    elif command.effect == "rainbow":
-        # Start rainbow effect thread
-        effect_thread = threading.Thread(
-            target=rainbow_effect,
-            daemon=True
-        )
-        effect_thread.start()
-        response = "Rainbow effect started"
-        
-    elif command.effect == "stop":
-        # Send stop command to Arduino
-        response = send_to_arduino("ALL OFF")
-        current_state["mode"] = "manual"
-        for i in range(1, 4):
-            current_state[f"bulb{i}"]["state"] = "off"
-            current_state[f"bulb{i}"]["brightness"] = 0
-        stop_effects.set()
+    if command.effect not in EFFECTS and command.effect != "stop":
+        raise HTTPException(status_code=400, detail="Invalid effect")
+    
+    # Cancel any running effect or live show without waiting for its thread, and any ramp
+    effect_engine.stop()
+    live_shows.stop("Manual control took over" if command.effect == "stop" else "An effect took over")
+    release_ramps()
+    target_fps = None
+    
+    if command.effect == "stop":
+        # Send stop command to every Arduino
+        await broadcast_async("ALL OFF")
+        state_store.set_brightness({bulb.key: 0 for bulb in registry.bulbs.values()}, mode="manual")
         response = "All effects stopped"
         
     else:
-        raise HTTPException(status_code=400, detail="Invalid effect")
+        target_fps = start_effect(command.effect, command.speed or 2)
+        response = f"{command.effect.capitalize()} effect started"
+    
+    version, state = state_store.versioned()
     
     return {
         "success": True,
         "effect": command.effect,
         "speed": command.speed,
         "response": response,
-        "mode": current_state["mode"],
-        "connected": current_state["connected"]
+        "target_fps": target_fps,
+        "mode": state["mode"],
+        "version": version,
+        "connected": state["connected"]
+    }
+
+@app.get("/api/effect")
+async def get_effect_stats():
+    """Achieved vs target frame rate of the running (or last) effect"""
+    return {
+        "success": True,
+        "running": effect_running(),
+        "mode": state_store.mode,
+        "stats": effect_engine.stats()
     }
 
 @app.post("/api/group")
-def group_control(command: GroupCommand):
+async def group_control(command: GroupCommand):
     """Control all bulbs together"""
-    # Stop any running effects
-    if effect_thread and effect_thread.is_alive():
-        stop_effects.set()
-        effect_thread.join(timeout=1)
-        stop_effects.clear()
+    # Cancel any running effect or live show (its queued frames are skipped, nothing waits) and any ramp
+    effect_engine.stop()
+    live_shows.stop()
+    release_ramps()
     
     response = None
     
     if command.action == "on":
-        response = send_to_arduino("ALL ON")
-        for i in range(1, 4):
-            current_state[f"bulb{i}"]["state"] = "on"
-            current_state[f"bulb{i}"]["brightness"] = 100
+        response = first_reply(await broadcast_async("ALL ON"))
+        state_store.set_brightness({bulb.key: 100 for bulb in registry.bulbs.values()}, mode="manual")
         
     elif command.action == "off":
-        response = send_to_arduino("ALL OFF")
-        for i in range(1, 4):
-            current_state[f"bulb{i}"]["state"] = "off"
-            current_state[f"bulb{i}"]["brightness"] = 0
+        response = first_reply(await broadcast_async("ALL OFF"))
+        state_store.set_brightness({bulb.key: 0 for bulb in registry.bulbs.values()}, mode="manual")
         
     elif command.action == "brightness":
         if command.brightness is None or not 0 <= command.brightness <= 100:
             raise HTTPException(status_code=400, detail="Brightness must be 0-100")
         
         pwm_value = int(command.brightness * 2.55)
-        # Set all bulbs to same brightness
-        for i in range(1, 4):
-            send_to_arduino(f"B{i} {pwm_value}")
-        
-        for i in range(1, 4):
-            current_state[f"bulb{i}"]["brightness"] = command.brightness
-            current_state[f"bulb{i}"]["state"] = "on" if command.brightness > 0 else "off"
+        # Set all bulbs to same brightness: one frame per controller, in parallel
+        await send_levels_async({bulb_id: pwm_value for bulb_id in registry.bulbs})
+        state_store.set_brightness({bulb.key: command.brightness for bulb in registry.bulbs.values()}, mode="manual")
         
         response = f"All bulbs set to {command.brightness}%"
     
     else:
         raise HTTPException(status_code=400, detail="Action must be 'on', 'off', or 'brightness'")
     
-    current_state["mode"] = "manual"
+    version, state = state_store.versioned()
     
     return {
         "success": True if response else False,
         "action": command.action,
         "brightness": command.brightness,
         "response": response,
-        "state": current_state,
-        "connected": current_state["connected"]
+        "state": state,
+        "version": version,
+        "connected": state["connected"]
+    }
+
+def compile_batch(operations):
+    """Fold batch operations, in order, into what is left to do once they have all run.
+
+    Returns (levels, effect): the final {bulb id: percent} of every bulb a level
+    operation touched, and the effect to start as (name, speed) or None. Later
+    operations overwrite earlier ones, an effect drops the levels before it (its
+    frames drive every bulb) and a level operation after an effect cancels it
+    (as POST /api/bulb stops a running effect). Raises HTTPException 400 naming
+    the first bad operation, before anything is sent.
+    """
+    if not operations:
+        raise HTTPException(status_code=400, detail="A batch needs at least one operation")
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {BATCH_MAX_OPERATIONS} operations")
+    
+    levels = {}
+    effect = None
+    for index, op in enumerate(operations):
+        def invalid(detail):
+            return HTTPException(status_code=400, detail=f"Operation {index}: {detail}")
+        
+        if op.effect is not None:
+            if op.effect == "stop":
+                effect = None
+                levels = {bulb_id: 0 for bulb_id in registry.bulbs}
+            elif op.effect in EFFECTS:
+                effect = (op.effect, op.speed or 2)
+                levels = {}
+            else:
+                raise invalid("Invalid effect")
+            continue
+        
+        if op.bulb is not None:
+            if op.bulb not in registry.bulbs:
+                raise invalid(f"Bulb must be one of {list(registry.bulbs)}")
+            targets = [op.bulb]
+        else:
+            targets = list(registry.bulbs)
+        
+        if op.action == "on":
+            brightness = 100
+        elif op.action == "off":
+            brightness = 0
+        elif op.action == "brightness":
+            brightness = op.value if op.value is not None else op.brightness
+            if brightness is None or not 0 <= brightness <= 100:
+                raise invalid("Brightness must be 0-100")
+        else:
+            raise invalid("Action must be 'on', 'off', or 'brightness' (or give an 'effect')")
+        
+        effect = None
+        for bulb_id in targets:
+            levels[bulb_id] = brightness
+    return levels, effect
+
+async def apply_batch(operations):
+    """Validate and run batch operations as one change, returns the endpoint's response fields.
+
+    The resulting levels go out as one frame per controller (all controllers
+    at once) and the state store takes them in a single change.
+    """
+    levels, effect = compile_batch(operations)
+    
+    effect_engine.stop()
+    live_shows.stop()
+    release_ramps([registry.bulbs[bulb_id].key for bulb_id in levels] if effect is None else None)
+    
+    response = None
+    target_fps = None
+    if levels:
+        response = await send_levels_async({bulb_id: percent_to_pwm(value) for bulb_id, value in levels.items()})
+        state_store.set_brightness({registry.bulbs[bulb_id].key: value for bulb_id, value in levels.items()},
+                                   mode="manual")
+    if effect is not None:
+        target_fps = start_effect(*effect)
+        response = f"{effect[0].capitalize()} effect started"
+    
+    version, state = state_store.versioned()
+    
+    return {
+        "success": True if response else False,
+        "operations": len(operations),
+        "bulbs": len(levels),
+        "frames": len(levels_by_controller(levels)),
+        "effect": effect[0] if effect else None,
+        "target_fps": target_fps,
+        "response": response,
+        "state": state,
+        "version": version,
+        "connected": state["connected"]
+    }
+
+@app.post("/api/batch")
+async def batch_control(command: BatchCommand):
+    """Run bulb, group and effect operations as one change (all validated before anything is sent)"""
+    return await apply_batch(command.operations)
+
+# The structured commands the dashboard's own parser produces
+VOICE_COMMANDS = {
+    "turn_on": lambda c: {"bulb": c.bulb, "action": "on"},
+    "turn_off": lambda c: {"bulb": c.bulb, "action": "off"},
+    "set_brightness": lambda c: {"bulb": c.bulb, "action": "brightness", "value": c.value},
+    "start_effect": lambda c: {"effect": c.effect, "speed": c.speed},
+    "stop_effects": lambda c: {"effect": "stop"},
+}
+
+@app.post("/api/voice")
+async def voice_control(command: VoiceCommand):
+    """Carry out a voice/text phrase (or a structured command) as one batch"""
+    intent = None
+    if command.command in VOICE_COMMANDS:
+        operations = [VOICE_COMMANDS[command.command](command)]
+    else:
+        text = (command.text or command.command or "").strip()
+        if not text:
+            raise HTTPException(status_code=400, detail="Give a 'text' phrase or a 'command'")
+        started = time.perf_counter()
+        intent = intent_engine.parse(text, command.bulb)
+        VOICE_PARSE_TIME.observe(time.perf_counter() - started)
+        if intent.unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown bulb {', '.join(map(str, intent.unknown))} "
+                                                        f"in '{text}' (bulbs: {sorted(registry.bulbs)})")
+        if not intent.operations:
+            raise HTTPException(status_code=400, detail=f"Command not understood: '{text}'")
+        operations = intent.operations
+    
+    result = await apply_batch([BatchOperation(**operation) for operation in operations])
+    result["intent"] = intent.view() if intent is not None else {"operations": operations}
+    return result
+
+@app.get("/api/scene")
+async def list_scenes():
+    """Stored scenes: name -> brightness (0-100) per bulb"""
+    return {"success": True, "scenes": state_db.scenes}
+
+@app.post("/api/scene")
+async def scene_control(command: SceneCommand):
+    """Apply, save or delete a named scene"""
+    name = command.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Scene name must not be empty")
+    
+    response = None
+    
+    if command.action == "apply":
+        scene = state_db.scenes.get(name)
+        if scene is None:
+            raise HTTPException(status_code=404, detail=f"No scene named '{name}'")
+        effect_engine.stop()
+        live_shows.stop()
+        scene = {key: brightness for key, brightness in scene.items() if key in registry.by_key}
+        release_ramps(scene)
+        # Every bulb of the scene in one frame per controller, all controllers at once
+        response = await send_levels_async(
+            {registry.by_key[key].id: percent_to_pwm(brightness) for key, brightness in scene.items()})
+        state_store.set_brightness(scene, mode="manual")
+        
+    elif command.action == "save":
+        state = state_store.snapshot()
+        levels = command.levels
+        if levels is None:
+            levels = {bulb.key: state[bulb.key]["brightness"] for bulb in registry.bulbs.values()}
+        await asyncio.to_thread(state_db.save_scene, name, validate_levels(levels))
+        response = f"Scene '{name}' saved"
+        
+    elif command.action == "delete":
+        if not await asyncio.to_thread(state_db.delete_scene, name):
+            raise HTTPException(status_code=404, detail=f"No scene named '{name}'")
+        response = f"Scene '{name}' deleted"
+    
+    else:
+        raise HTTPException(status_code=400, detail="Action must be 'apply', 'save' or 'delete'")
+    
+    version, state = state_store.versioned()
+    
+    return {
+        "success": True if response else False,
+        "action": command.action,
+        "name": name,
+        "response": response,
+        "scene": state_db.scenes.get(name),
+        "state": state,
+        "version": version,
+        "connected": state["connected"]
+    }
+
+@app.get("/api/schedule")
+async def list_schedule():
+    """Scheduled rules (with their next run, Unix time) and ramps in progress"""
+    rules, ramps = describe_schedule()
+    return {"success": True, "rules": rules, "ramps": ramps, "timestamp": time.time()}
+
+@app.post("/api/schedule")
+async def schedule_control(command: ScheduleCommand):
+    """Add or delete a scheduled rule"""
+    if command.action == "add":
+        spec = validate_rule(command)
+        rule_id = (command.id or "").strip() or uuid.uuid4().hex[:8]
+        await asyncio.to_thread(state_db.save_rule, rule_id, spec)
+        next_run = schedule_rule(rule_id, spec)
+        response = f"Rule '{rule_id}' scheduled"
+        
+    elif command.action == "delete":
+        rule_id = (command.id or "").strip()
+        if not await asyncio.to_thread(state_db.delete_rule, rule_id):
+            raise HTTPException(status_code=404, detail=f"No rule '{rule_id}'")
+        scheduler.cancel(rule_id)
+        scheduler.cancel(f"ramp:{rule_id}")
+        spec, next_run = None, None
+        response = f"Rule '{rule_id}' deleted"
+    
+    else:
+        raise HTTPException(status_code=400, detail="Action must be 'add' or 'delete'")
+    
+    return {
+        "success": True,
+        "action": command.action,
+        "id": rule_id,
+        "rule": spec,
+        "next_run": next_run,
+        "response": response,
+        "rules": len(state_db.rules)
     }
 
+@app.get("/api/history")
+async def get_history(series: Optional[str] = None, span: str = Query(HISTORY_DEFAULT_RANGE, alias="range"),
+                      step: Optional[str] = None, end: Optional[float] = None):
+    """Min/max/avg per time window of bulb levels (percent) and serial round trips (rtt:<controller>, ms).
+
+    `series` is a comma-separated list (default every bulb); `range` reaches back from `end`
+    (Unix time, default now) and `step` is the window, both in seconds or with s/m/h/d ("15m", "1d").
+    Windows come from pre-aggregated buckets, so a day costs the same as a minute.
+    """
+    if series:
+        names = [name.strip() for name in series.split(",") if name.strip()]
+    else:
+        names = [bulb.key for bulb in registry.bulbs.values()]
+    unknown = [name for name in names if name not in history.by_name]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown series {unknown} (have: {history.names()})")
+    try:
+        seconds = parse_duration(span)
+        window = parse_duration(step) if step else seconds / HISTORY_DEFAULT_WINDOWS
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Bad range or step: {e}")
+    end = time.time() if end is None else end
+    if not math.isfinite(end):
+        raise HTTPException(status_code=400, detail="'end' must be a Unix time")
+    try:
+        result = await asyncio.to_thread(history.query, names, end - seconds, end, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "columns": ["time", "min", "max", "avg", "count"], **result, "timestamp": time.time()}
+
 @app.get("/api/status")
-def get_status():
-    """Get system status"""
+async def get_status(fresh: bool = False):
+    """Get system status from the cache (pass fresh=1 to force a live read)"""
     try:
-        response = send_to_arduino("STATUS")
-        if response:
-            parse_status(response)
+        response = status_cache.response
+        if fresh:
+            replies = await broadcast_async("STATUS")
+            response = replies[0] if len(replies) == 1 else dict(zip(registry.controllers, replies))
+        age = status_cache.age()
+        version, state = state_store.versioned()
         
         return {
             "success": True,
-            "state": current_state,
+            "state": state,
+            "version": version,
             "arduino_response": response,
-            "connected": current_state["connected"],
+            "connected": state["connected"],
+            "cached": not fresh,
+            "age": round(age, 3) if age is not None else None,
             "timestamp": time.time()
         }
     except Exception as e:
         return {
             "success": False,
-            "state": current_state,
+            "state": state_store.snapshot(),
             "error": str(e),
             "connected": False,
             "timestamp": time.time()
         }
 
-# ========== EFFECT FUNCTIONS (Updated for 3 bulbs) ==========
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics (serial round trips, queue depth, request latency, error counters)"""
+    return Response(bridge_metrics.render(), media_type=bridge_metrics.CONTENT_TYPE)
 
-def strobe_effect(speed: int = 2):
-    """Continuous strobe effect for 3 bulbs"""
-    speed_map = {1: 0.5, 2: 0.25, 3: 0.1, 4: 0.05, 5: 0.025}
-    delay = speed_map.get(speed, 0.25)
-    
-    while not stop_effects.is_set():
-        send_to_arduino("ALL ON")
-        time.sleep(delay)
-        if stop_effects.is_set():
-            break
-        send_to_arduino("ALL OFF")
-        time.sleep(delay)
+@app.websocket("/api/stream")
+async def stream_state_ws(websocket: WebSocket):
+    """Push a state snapshot, then coalesced diffs, over a WebSocket"""
+    await websocket.accept()
+    subscriber = state_stream.subscribe()
+    try:
+        while True:
+            frame = await subscriber.get()
+            await websocket.send_text(frame)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        state_stream.unsubscribe(subscriber)
 
-def fade_effect():
-    """Continuous fade effect for 3 bulbs"""
-    step = 5
-    delay = 0.05
-    
-    while not stop_effects.is_set():
-        # Pattern 1: Sequential fade
-        for i in range(0, 256, step):
-            if stop_effects.is_set():
+@app.get("/api/stream/sse")
+async def stream_state_sse(request: Request):
+    """Push a state snapshot, then coalesced diffs, as Server-Sent Events"""
+    subscriber = state_stream.subscribe()
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                frame = await subscriber.get()
+                yield f"data: {frame}\n\n"
+        finally:
+            state_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/live")
+async def live_show(websocket: WebSocket, jitter: float = LIVE_JITTER_MS):
+    """Client-driven light show: binary level frames in, acknowledgements and stats out.
+
+    Each frame is a FRAME_HEADER (sequence number, client send time in ms) and
+    one PWM byte per bulb, in the order the hello message lists them. `jitter`
+    is the playout delay in ms that absorbs uneven arrival (0 = play on arrival).
+    """
+    await websocket.accept()
+    session = await live_shows.start(websocket, min(max(jitter, 0.0), LIVE_MAX_JITTER_MS) / 1000)
+    await session.send({
+        "type": "hello",
+        "bulbs": session.bulb_ids,
+        "header_bytes": FRAME_HEADER.size,
+        "jitter_ms": round(session.buffer.delay * 1000, 1),
+        "max_in_flight": session.depth,
+    })
+    player = asyncio.create_task(session.play())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
                 break
-            send_to_arduino(f"B1 {i}")
-            send_to_arduino(f"B2 {255 - i}")
-            send_to_arduino(f"B3 {(i + 128) % 255}")
-            time.sleep(delay)
-        
-        # Pattern 2: Reverse
-        for i in range(0, 256, step):
-            if stop_effects.is_set():
+            if message.get("bytes") is None:
+                await session.send({"type": "error", "error": "Frames must be binary messages"})
+                continue
+            try:
+                session.push(message["bytes"])
+            except ValueError as e:
+                await session.send({"type": "error", "error": str(e)})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        player.cancel()
+        live_shows.finish(session)
+
+# ========== EFFECT ENGINE ==========
+
+class EffectRun:
+    """One playback of an effect: its cancel token and frame counters"""
+
+    def __init__(self, name, frames, speed=None):
+        self.name = name
+        self.speed = speed
+        self.frames = frames
+        self.bulb_ids = list(registry.bulbs)    # frame columns, in bulb order
+        self.cancel = threading.Event()
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.nominal_fps = EffectEngine.target_fps(frames)
+        self.sent_counter = EFFECT_FRAMES_SENT.labels(name)
+        self.dropped_counter = EFFECT_FRAMES_DROPPED.labels(name)
+
+    def stats(self):
+        """Frame counters and achieved vs target FPS"""
+        end = self.stopped_at or time.monotonic()
+        elapsed = max(end - self.started_at, 1e-6)
+        return {
+            "effect": self.name,
+            "elapsed": round(elapsed, 3),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "target_fps": round(self.nominal_fps, 2),
+            "achieved_fps": round(self.frames_sent / elapsed, 2)
+        }
+
+class EffectEngine:
+    """Play an effect's keyframe table against a monotonic clock.
+
+    Each keyframe is ([pwm per bulb, in bulb id order], duration). Frames are due at fixed
+    offsets from the start, independent of how long each serial write takes.
+    When the link falls behind, keyframes whose whole slot has already passed
+    are dropped so the effect jumps to the frame that is due now instead of
+    drifting slower and slower.
+
+    Every run has its own cancel token. Stopping never joins the thread: the
+    token is set, the run's queued frame is skipped by the serial worker, and
+    the thread exits on its own after at most the frame already on the wire.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None
+        self.thread = None
+
+    @staticmethod
+    def target_fps(frames):
+        cycle = sum(duration for _, duration in frames)
+        return len(frames) / cycle if cycle > 0 else 0.0
+
+    def start(self, name, frames, speed=None):
+        """Cancel whatever is playing and start a new run, returns its target FPS"""
+        run = EffectRun(name, frames, speed)
+        with self.lock:
+            if self.current is not None:
+                self.current.cancel.set()
+            self.current = run
+            self.thread = threading.Thread(
+                target=self._run,
+                args=(run,),
+                name=f"effect-{name}",
+                daemon=True
+            )
+            self.thread.start()
+        return run.nominal_fps
+
+    def stop(self):
+        """Cancel the running effect without waiting, returns True if one was running"""
+        with self.lock:
+            run = self.current
+            if run is None or run.cancel.is_set():
+                return False
+            run.cancel.set()
+            return True
+
+    def running(self):
+        run = self.current
+        return run is not None and not run.cancel.is_set() and self.thread.is_alive()
+
+    def _run(self, run):
+        """Loop over the keyframes until the run is cancelled"""
+        frames = run.frames
+        count = len(frames)
+        index = 0
+        due = run.started_at
+        # Pipelining boards take the next frame before the last one is acknowledged
+        depth = min(c.window for c in registry.controllers.values())
+        in_flight = collections.deque()
+
+        while not run.cancel.is_set():
+            values, duration = frames[index]
+
+            # Behind schedule: skip keyframes whose slot is already over
+            now = time.monotonic()
+            while due + duration <= now:
+                run.frames_dropped += 1
+                run.dropped_counter.inc()
+                due += duration
+                index = (index + 1) % count
+                values, duration = frames[index]
+
+            in_flight.append(submit_levels(dict(zip(run.bulb_ids, values)),
+                                           priority=PRIORITY_EFFECT, cancel_event=run.cancel))
+            while len(in_flight) >= depth:
+                collect_levels(in_flight.popleft(), priority=PRIORITY_EFFECT, cancel_event=run.cancel)
+            if run.cancel.is_set():
+                break
+            run.frames_sent += 1
+            run.sent_counter.inc()
+
+            due += duration
+            index = (index + 1) % count
+            wait = due - time.monotonic()
+            if wait > 0 and run.cancel.wait(wait):
                 break
-            send_to_arduino(f"B1 {255 - i}")
-            send_to_arduino(f"B2 {i}")
-            send_to_arduino(f"B3 {255 - ((i + 128) % 255)}")
-            time.sleep(delay)
 
-def pulse_effect():
-    """Continuous pulse/breathe effect for 3 bulbs"""
+        run.stopped_at = time.monotonic()
+
+    def stats(self):
+        run = self.current
+        return run.stats() if run is not None else None
+
+effect_engine = EffectEngine()
+
+def start_effect(name, speed=2):
+    """Build the keyframe table and hand it to the effect engine thread, returns its target FPS"""
+    # Keep the levels set by hand first, the effect's frames are not saved over them
+    if not effect_running():
+        state_saver.checkpoint()
+    state_store.set_mode(name, strobe_speed=speed if name == "strobe" else None)
+    frames = EFFECTS[name](speed, len(registry.bulbs))
+    if name != "strobe":
+        scale = EFFECT_SPEED_SCALE.get(speed, 1.0)
+        frames = [(levels, delay * scale) for levels, delay in frames]
+    return effect_engine.start(name, frames, speed)
+
+# ========== EFFECT DEFINITIONS (keyframe tables for any number of bulbs) ==========
+
+STROBE_SPEEDS = {1: 0.5, 2: 0.25, 3: 0.1, 4: 0.05, 5: 0.025}
+EFFECT_SPEED_SCALE = {1: 2.0, 2: 1.0, 3: 0.8, 4: 0.6, 5: 0.5}   # frame delay factor for the other effects
+
+def strobe_frames(speed=2, count=3):
+    """All bulbs on/off; speed 1-5 sets the flash period"""
+    delay = STROBE_SPEEDS.get(speed, 0.25)
+    return [([255] * count, delay), ([0] * count, delay)]
+
+def fade_frames(speed=None, count=3):
+    """Sequential cross-fade, then the reverse (bulbs cycle through 3 phase patterns)"""
+    step = 5
+    delay = 0.05
+    frames = []
+    # Pattern 1: Sequential fade
+    for i in range(0, 256, step):
+        pattern = (i, 255 - i, (i + 128) % 255)
+        frames.append(([pattern[n % 3] for n in range(count)], delay))
+    # Pattern 2: Reverse
+    for i in range(0, 256, step):
+        pattern = (255 - i, i, 255 - ((i + 128) % 255))
+        frames.append(([pattern[n % 3] for n in range(count)], delay))
+    return frames
+
+def pulse_frames(speed=None, count=3):
+    """All bulbs breathe in and out together"""
     step = 3
     delay = 0.03
-    
-    while not stop_effects.is_set():
-        # Fade in
-        for i in range(0, 256, step):
-            if stop_effects.is_set():
-                break
-            send_to_arduino(f"B1 {i}")
-            send_to_arduino(f"B2 {i}")
-            send_to_arduino(f"B3 {i}")
-            time.sleep(delay)
-        
-        # Fade out
-        for i in range(255, -1, -step):
-            if stop_effects.is_set():
-                break
-            send_to_arduino(f"B1 {i}")
-            send_to_arduino(f"B2 {i}")
-            send_to_arduino(f"B3 {i}")
-            time.sleep(delay)
+    # Fade in, then fade out
+    levels = list(range(0, 256, step)) + list(range(255, -1, -step))
+    return [([i] * count, delay) for i in levels]
 
-def alternate_effect():
-    """Continuous alternate blinking effect for 3 bulbs"""
+def alternate_frames(speed=None, count=3):
+    """One bulb on at a time"""
     delay = 0.3
-    
-    while not stop_effects.is_set():
-        # Pattern 1: 1 on, others off
-        send_to_arduino("B1 ON")
-        send_to_arduino("B2 OFF")
-        send_to_arduino("B3 OFF")
-        time.sleep(delay)
-        
-        if stop_effects.is_set():
-            break
-        
-        # Pattern 2: 2 on, others off
-        send_to_arduino("B1 OFF")
-        send_to_arduino("B2 ON")
-        send_to_arduino("B3 OFF")
-        time.sleep(delay)
-        
-        if stop_effects.is_set():
-            break
-        
-        # Pattern 3: 3 on, others off
-        send_to_arduino("B1 OFF")
-        send_to_arduino("B2 OFF")
-        send_to_arduino("B3 ON")
-        time.sleep(delay)
-
-def rainbow_effect():
-    """Continuous rainbow color cycle effect for 3 bulbs"""
-    colors = [
-        (255, 0, 0),    # Red
-        (255, 127, 0),  # Orange
-        (255, 255, 0),  # Yellow
-        (0, 255, 0),    # Green
-        (0, 0, 255),    # Blue
-        (75, 0, 130),   # Indigo
-        (148, 0, 211)   # Violet
+    return [([255 if n == on else 0 for n in range(count)], delay) for on in range(count)]
+
+RAINBOW_COLORS = [
+    (255, 0, 0),    # Red
+    (255, 127, 0),  # Orange
+    (255, 255, 0),  # Yellow
+    (0, 255, 0),    # Green
+    (0, 0, 255),    # Blue
+    (75, 0, 130),   # Indigo
+    (148, 0, 211)   # Violet
+]
+
+def rainbow_frames(speed=None, count=3):
+    """Rainbow colour cycle, RGB distributed across the bulbs"""
+    return [([color[n % 3] for n in range(count)], 0.5) for color in RAINBOW_COLORS]
+
+EFFECTS = {
+    "strobe": strobe_frames,
+    "fade": fade_frames,
+    "pulse": pulse_frames,
+    "alternate": alternate_frames,
+    "rainbow": rainbow_frames,
+}
+
+# ========== LIVE SHOWS (client frames over WS /api/live) ==========
+
+class LiveSession:
+    """One client's show: frames in from the WebSocket, the newest due frame out to the boards.
+
+    At most `depth` frames are on their way to the boards at once, and the next
+    one is only picked when one of them is acknowledged, so when the link is
+    saturated the jitter buffer skips to the newest frame instead of the
+    serial queues growing.
+    """
+
+    def __init__(self, websocket, delay):
+        self.websocket = websocket
+        self.buffer = JitterBuffer(delay)
+        self.bulb_ids = list(registry.bulbs)    # frame columns, in bulb order
+        self.depth = max(1, min([LIVE_MAX_IN_FLIGHT] + [c.window for c in registry.controllers.values()]))
+        self.cancel = threading.Event()         # frames still queued are skipped once the session ends
+        self.arrived = asyncio.Event()
+        self.received = 0
+        self.played = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.latencies = []                     # arrival to acknowledgement (s) since the last report
+        self.reported = (0, time.monotonic())   # frames played at the last report, and when
+
+    def push(self, data):
+        """Buffer one binary frame from the client (ValueError if it is malformed)"""
+        try:
+            frame = LiveFrame.parse(data, len(self.bulb_ids))
+        except ValueError:
+            self.invalid += 1
+            LIVE_FRAMES.labels("invalid").inc()
+            raise
+        self.received += 1
+        self.drop(self.buffer.push(frame, time.monotonic()))
+        self.arrived.set()
+
+    def drop(self, count):
+        if count:
+            self.dropped += count
+            LIVE_FRAMES.labels("dropped").inc(count)
+
+    async def play(self):
+        """Send frames as they fall due until the session ends or an effect takes over"""
+        in_flight = collections.deque()
+        next_report = time.monotonic() + LIVE_REPORT_INTERVAL
+        while not self.cancel.is_set():
+            if effect_running():
+                await self.end("An effect took over")
+                return
+            now = time.monotonic()
+            if now >= next_report:
+                await self.report(now)
+                next_report = now + LIVE_REPORT_INTERVAL
+            if len(in_flight) < self.depth:
+                frame, skipped = self.buffer.pop_due(now)
+                self.drop(skipped)
+                if frame is not None:
+                    in_flight.append((frame, await submit_levels_async(
+                        dict(zip(self.bulb_ids, frame.levels)), PRIORITY_EFFECT, self.cancel)))
+                    continue
+            if in_flight:
+                await self.confirm(*in_flight.popleft())
+                continue
+            # Nothing to send: sleep until the next frame is due, arrives, or a report is
+            due = self.buffer.next_due()
+            wait = next_report - now if due is None else min(due, next_report) - now
+            self.arrived.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.arrived.wait(), max(wait, 0.0))
+
+    async def confirm(self, frame, pending):
+        """Wait for the boards to take a frame, then tell the client how long it took.
+
+        The ack echoes the frame's client_time, so the client gets its own end to
+        end latency (its clock now minus client_time); bridge_ms is the part from
+        the frame's arrival to the boards' acknowledgement.
+        """
+        await collect_levels_async(pending, PRIORITY_EFFECT, self.cancel)
+        if self.cancel.is_set():
+            return
+        latency = time.monotonic() - frame.arrived
+        self.played += 1
+        self.latencies.append(latency)
+        LIVE_FRAMES.labels("played").inc()
+        LIVE_LATENCY.observe(latency)
+        await self.send({"type": "ack", "seq": frame.seq, "client_time": frame.client_time,
+                         "bridge_ms": round(latency * 1000, 2)})
+
+    async def report(self, now):
+        """Counters, played FPS and bridge latency percentiles since the last report"""
+        played, since = self.reported
+        latencies = sorted(self.latencies)
+        self.latencies = []
+        self.reported = (self.played, now)
+        await self.send({
+            "type": "stats",
+            "received": self.received,
+            "played": self.played,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "buffered": len(self.buffer),
+            "fps": round((self.played - played) / max(now - since, 1e-6), 1),
+            "bridge_ms": {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 2),
+                "p99": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+            } if latencies else None,
+        })
+
+    async def send(self, message):
+        with contextlib.suppress(WebSocketDisconnect, RuntimeError):
+            await self.websocket.send_text(json.dumps(message))
+
+    async def end(self, reason):
+        """Stop playing and close the client's socket"""
+        self.cancel.set()
+        self.arrived.set()
+        await self.send({"type": "end", "reason": reason})
+        with contextlib.suppress(RuntimeError):
+            await self.websocket.close()
+
+class LiveShows:
+    """The live session driving the bulbs (a new client takes over from the previous one)"""
+
+    def __init__(self):
+        self.current = None
+        self.loop = None
+
+    def active(self):
+        return self.current is not None
+
+    async def start(self, websocket, delay):
+        self.loop = asyncio.get_running_loop()
+        previous, self.current = self.current, LiveSession(websocket, delay)
+        if previous is not None:
+            await previous.end("Another live client took over")
+        effect_engine.stop()
+        release_ramps()
+        state_store.set_mode(LIVE_MODE)
+        logger.info("🎛️ Live show started (jitter buffer %.0f ms)", delay * 1000)
+        return self.current
+
+    def stop(self, reason="Manual control took over"):
+        """End the running show (callable from any thread), so the next frame does not overwrite
+        what the caller is about to send and the levels it sets are the ones saved"""
+        session, self.current = self.current, None
+        if session is None:
+            return
+        session.cancel.set()
+        if state_store.mode == LIVE_MODE:
+            state_store.set_mode("manual")
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(session.end(reason)))
+
+    def finish(self, session):
+        session.cancel.set()
+        logger.info("🎛️ Live show ended: %d frames played, %d dropped, %d invalid",
+                    session.played, session.dropped, session.invalid)
+        if self.current is session:
+            self.current = None
+            if state_store.mode == LIVE_MODE:
+                state_store.set_mode("manual")
+
+live_shows = LiveShows()
+
+# ========== SCHEDULER (cron rules, one-shot timers and ramps) ==========
+
+scheduler = Scheduler(SCHEDULE_WORKERS, observe_lateness=SCHEDULE_LATENESS.observe)
+SCHEDULE_RULES.set_function(lambda: len(scheduler))
+
+def current_pwm_levels():
+    """{bulb key: 0-255} as last sent to or reported by the boards"""
+    return {key: bulb.controller.levels[bulb.channel - 1] for key, bulb in registry.by_key.items()
+            if 1 <= bulb.channel <= bulb.controller.channels}
+
+def send_ramp_step(changes):
+    """One ramp write: the bulbs whose PWM value changed, one frame per board"""
+    RAMP_WRITES.inc()
+    send_levels({registry.by_key[key].id: pwm for key, pwm in changes.items()})
+
+def release_ramps(keys=None):
+    """Stop ramping these bulbs (every bulb if None): manual control and newer rules win"""
+    for job in list(scheduler.jobs.values()):
+        if isinstance(job, Ramp):
+            job.release(keys)
+
+def start_ramp(rule_id, levels, duration):
+    """Fade from the current levels to {bulb key: 0-100} over `duration` seconds"""
+    ramp = Ramp(f"ramp:{rule_id}", current_pwm_levels(), {key: percent_to_pwm(value) for key, value in levels.items()},
+                time.time(), duration, send_ramp_step, current_pwm_levels, RAMP_MIN_INTERVAL)
+    state_store.set_mode("manual")
+    if scheduler.add(ramp) is None:
+        logger.debug("⏰ Ramp %s: already at its target", ramp.id)
+
+def run_rule(rule_id, spec):
+    """Carry out a rule's action (on a scheduler pool thread, through the same serial queues as the API)"""
+    effect = spec.get("effect")
+    if effect == "stop":
+        effect_engine.stop()
+        live_shows.stop()
+        release_ramps()
+        broadcast("ALL OFF")
+        state_store.set_brightness({key: 0 for key in registry.by_key}, mode="manual")
+        return
+    if effect:
+        release_ramps()
+        start_effect(effect, spec.get("speed") or 2)
+        return
+
+    levels = spec.get("levels") or state_db.scenes.get(spec.get("scene"))
+    if levels is None:
+        logger.warning("⚠️ Schedule %s: no scene named '%s'", rule_id, spec.get("scene"))
+        return
+    levels = {key: value for key, value in levels.items() if key in registry.by_key}
+    effect_engine.stop()
+    live_shows.stop()
+    # The newest rule owns these bulbs
+    release_ramps(levels)
+    if spec.get("duration"):
+        start_ramp(rule_id, levels, spec["duration"])
+        return
+    send_levels({registry.by_key[key].id: percent_to_pwm(value) for key, value in levels.items()})
+    state_store.set_brightness(levels, mode="manual")
+
+def fire_rule(rule):
+    spec = state_db.rules.get(rule.id)
+    if spec is None:
+        return
+    logger.info("⏰ Running schedule %s", rule.id)
+    if rule.cron is None:
+        # One-shot: done once it has run
+        state_db.delete_rule(rule.id)
+    run_rule(rule.id, spec)
+
+def schedule_rule(rule_id, spec):
+    """Put a stored rule on the scheduler, returns its first due time"""
+    cron = CronSpec.parse(spec["cron"]) if spec.get("cron") else None
+    return scheduler.add(Rule(rule_id, fire_rule, cron=cron, at=spec.get("at")))
+
+def load_rules():
+    """Schedule the stored rules; one-shots missed while the bridge was down run late if within the grace"""
+    now = time.time()
+    for rule_id, spec in list(state_db.rules.items()):
+        if spec.get("at") is not None and spec["at"] < now - SCHEDULE_MISFIRE_GRACE:
+            logger.warning("⏰ Dropping schedule %s: missed by %.0fs", rule_id, now - spec["at"])
+            state_db.delete_rule(rule_id)
+            continue
+        try:
+            schedule_rule(rule_id, spec)
+        except ValueError as e:
+            logger.warning("⚠️ Schedule %s: %s", rule_id, e)
+    if state_db.rules:
+        logger.info("⏰ %d scheduled rule(s) loaded", len(state_db.rules))
+
+def validate_rule(command):
+    """The rule as stored (delay turned into a time), or HTTPException 400"""
+    when = [field for field in ("cron", "at", "delay") if getattr(command, field) is not None]
+    what = [field for field in ("levels", "scene", "effect") if getattr(command, field) is not None]
+    if len(when) != 1:
+        raise HTTPException(status_code=400, detail="Give exactly one of 'cron', 'at' or 'delay'")
+    if len(what) != 1:
+        raise HTTPException(status_code=400, detail="Give exactly one of 'levels', 'scene' or 'effect'")
+
+    spec = {}
+    if command.cron is not None:
+        try:
+            CronSpec.parse(command.cron).next_after(time.time())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        spec["cron"] = command.cron
+    else:
+        spec["at"] = command.at if command.at is not None else time.time() + command.delay
+
+    if command.levels is not None:
+        spec["levels"] = validate_levels(command.levels)
+    elif command.scene is not None:
+        if command.scene not in state_db.scenes:
+            raise HTTPException(status_code=400, detail=f"No scene named '{command.scene}'")
+        spec["scene"] = command.scene
+    else:
+        if command.effect not in EFFECTS and command.effect != "stop":
+            raise HTTPException(status_code=400, detail="Invalid effect")
+        spec["effect"] = command.effect
+        if command.speed is not None:
+            spec["speed"] = command.speed
+
+    if command.duration is not None:
+        if command.effect is not None or command.duration <= 0:
+            raise HTTPException(status_code=400, detail="A duration (seconds > 0) only applies to levels or a scene")
+        spec["duration"] = command.duration
+    return spec
+
+def describe_schedule():
+    """Stored rules with their next run, and the ramps in progress"""
+    now = time.time()
+    rules = []
+    for rule_id, spec in list(state_db.rules.items()):
+        job = scheduler.get(rule_id)
+        rules.append({"id": rule_id, **spec, "next_run": job.due if job is not None else None})
+    ramps = [
+        {"id": job.id, "progress": job.progress(now), "writes": job.writes, "target": job.end}
+        for job in list(scheduler.jobs.values()) if isinstance(job, Ramp)
     ]
-    
-    while not stop_effects.is_set():
-        for r, g, b in colors:
-            if stop_effects.is_set():
-                break
-            
-            # Distribute RGB across 3 bulbs
-            send_to_arduino(f"B1 {r}")
-            send_to_arduino(f"B2 {g}")
-            send_to_arduino(f"B3 {b}")
-            time.sleep(0.5)
+    return rules, ramps
 
 if __name__ == "__main__":
     import uvicorn
-    print("🚀 Starting Smart Bulb Control API v4.0 (3 Bulbs)...")
+    parser = argparse.ArgumentParser(description="Smart Bulb Control API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=BRIDGE_WORKERS,
+                        help="HTTP worker processes; above 1 this process becomes the serial broker")
+    args = parser.parse_args()
+    
+    print(f"🚀 Starting Smart Bulb Control API v4.0 ({len(registry.bulbs)} Bulbs, {len(registry.controllers)} Controller(s))...")
     print("=" * 50)
     
-    # Try to connect to Arduino
+    # Try to connect to every Arduino
     connect_arduino()
     
-    if current_state["connected"]:
+    if state_store.connected:
         print("✅ System ready - Arduino connected!")
     else:
         print("⚠️  Arduino not connected - basic functions available")
     
-    print("🌐 API available at: http://localhost:5000")
+    print(f"🌐 API available at: http://localhost:{args.port}")
     print("=" * 50)
     
-    uvicorn.run(app, host="0.0.0.0", port=5000, log_level="info")
\ No newline at end of file
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="info")
+        sys.exit()
+    
+    # Broker: this process keeps the serial ports and the state and serves the full API on a
+    # Unix socket; the workers answer clients on the public port
+    print(f"👷 {args.workers} HTTP workers, broker on {BROKER_SOCKET}")
+    snapshot_publisher.start()
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(BROKER_SOCKET)
+    workers = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bridge_workers:app", "--app-dir", os.path.dirname(os.path.abspath(__file__)),
+         "--http", "bridge_workers:WorkerHTTPProtocol",
+         "--host", args.host, "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        env={**os.environ, "BROKER_SOCKET": BROKER_SOCKET, "BROKER_SHM": BROKER_SHM, "BROKER_PID": str(os.getpid())}
+    )
+    
+    # On the app's shutdown: uvicorn re-raises SIGTERM once it has stopped, so a finally would not run
+    @app.on_event("shutdown")
+    def stop_workers():
+        workers.terminate()
+        workers.wait()
+        snapshot_publisher.writer.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(BROKER_SOCKET)
+    
+    uvicorn.run(app, uds=BROKER_SOCKET, log_level="info", timeout_keep_alive=300)
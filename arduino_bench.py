@@ -0,0 +1,837 @@
+"""Benchmark the bridge against simulated Arduinos.
+
+Starts arduino_sim boards, connects arduino_api to them and serves the app
+with uvicorn on a local port, then measures:
+
+  - latency (p50/p99) and throughput of POST /api/bulb, /api/group, /api/scene,
+    /api/batch (every bulb its own level) and GET /api/status (cached and
+    fresh) at increasing concurrency
+  - achieved vs nominal frame rate of every effect (strobe speeds 1-5 and
+    the others), plus the frames that actually reached the boards
+  - the most level frames per second the link acknowledges when the bridge
+    sends them back to back (the ceiling for any effect)
+  - warm restore: from bridge start (with a saved state) and from a board
+    reset until every board shows the saved levels again
+  - the scheduler: adding thousands of cron rules, how late one-shot timers
+    fire, and how many writes a ramp needs against fixed-rate updates
+  - live shows: frames streamed over WS /api/live at a fixed rate, how many
+    are played or dropped and the latency from send to acknowledgement
+  - the history buffer: cost of recording a sample, memory per series and
+    the time to answer /api/history over an hour, a day and a week
+  - the voice/text intent engine: parse time and accuracy over a generated
+    corpus of phrases (spelled-out numbers, chained clauses, typos)
+  - bytes per second on the serial links during each phase
+
+With --workers N the bridge runs split as in `arduino_api.py --workers N`:
+the app in this process serves as the broker on a Unix socket and N worker
+processes face the benchmark's requests.
+
+Results are written as JSON; pass --compare with an older file to see the
+change per metric:
+
+    python arduino_bench.py --output bench_results/after.json --compare bench_results/before.json
+"""
+import argparse
+import collections
+import contextlib
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import arduino_sim
+from bridge_db import StateDatabase
+
+DEFAULT_CONCURRENCY = "1,4,16,64"
+DEFAULT_REQUESTS = 100          # requests per endpoint per concurrency level
+DEFAULT_EFFECT_SECONDS = 3.0
+STROBE_BENCH_SPEEDS = [1, 2, 3, 4, 5]
+RESTORE_TIMEOUT = 10.0          # seconds to wait for the boards to show the saved levels
+SCHEDULE_BENCH_RULES = 2000     # cron rules added (and removed again) through the API
+SCHEDULE_BENCH_TIMERS = 200     # one-shot timers spread over the next two seconds
+INTENT_CORPUS_SIZE = 5000       # generated voice/text phrases
+INTENT_TYPO_RATE = 0.15         # share of phrases with two letters of one word swapped
+HISTORY_BENCH_DAYS = 7          # synthetic history: every bulb changing 30 times a second for a week
+HISTORY_BENCH_QUERIES = [("1h", "1m"), ("1d", "5m"), ("7d", "1h")]
+LIVE_BENCH_RATES = [30, 60, 120]    # frames per second a live show client sends
+LIVE_BENCH_JITTER_MS = 20
+
+
+def log(message):
+    # The bridge prints every serial command; keep our progress on stderr
+    print(message, file=sys.stderr, flush=True)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_workers(count, port, socket_path, shm_path):
+    """HTTP worker processes (bridge_workers) in front of a broker on socket_path"""
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bridge_workers:app", "--app-dir", os.path.dirname(os.path.abspath(__file__)),
+         "--http", "bridge_workers:WorkerHTTPProtocol",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(count), "--log-level", "warning"],
+        env={**os.environ, "BROKER_SOCKET": socket_path, "BROKER_SHM": shm_path, "BROKER_PID": str(os.getpid())})
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=1):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class SerialMeter:
+    """Byte and command counters of the simulated boards over one phase"""
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.start()
+
+    def totals(self):
+        keys = ("bytes_in", "bytes_out", "commands", "dropped_bytes")
+        return {key: sum(device.stats[key] for device in self.devices) for key in keys}
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.before = self.totals()
+
+    def result(self, baud):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        after = self.totals()
+        delta = {key: after[key] - self.before[key] for key in after}
+        capacity = baud / 10 * len(self.devices) if baud else None   # 8N1, all links
+        return {
+            "seconds": round(elapsed, 3),
+            "bytes_to_board_per_s": round(delta["bytes_in"] / elapsed, 1),
+            "bytes_from_board_per_s": round(delta["bytes_out"] / elapsed, 1),
+            "commands_per_s": round(delta["commands"] / elapsed, 2),
+            "dropped_bytes": delta["dropped_bytes"],
+            "link_utilisation": round(max(delta["bytes_in"], delta["bytes_out"]) / elapsed / capacity, 3)
+            if capacity else None,
+        }
+
+
+class Bench:
+    def __init__(self, port, devices, baud):
+        self.port = port
+        self.devices = devices
+        self.baud = baud
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        """One HTTP request on this thread's keep-alive connection, returns (status, json)"""
+        conn = getattr(self.local, "conn", None)
+        reused = conn is not None
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        payload = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self.local.conn = None
+            # The server drops keep-alive connections that sat idle; retry those once
+            if reused and isinstance(e, (ConnectionError, http.client.RemoteDisconnected)):
+                return self.request(method, path, body)
+            raise
+        return response.status, json.loads(data) if data else None
+
+    def load(self, make_request, concurrency, total):
+        """Fire `total` requests from `concurrency` threads, returns latency stats"""
+        counter = itertools.count()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            mine = []
+            failed = 0
+            while next(counter) < total:
+                method, path, body = make_request()
+                started = time.perf_counter()
+                try:
+                    status, _ = self.request(method, path, body)
+                    ok = status == 200
+                except Exception:
+                    ok = False
+                mine.append(time.perf_counter() - started)
+                failed += not ok
+            with lock:
+                latencies.extend(mine)
+                errors.append(failed)
+
+        meter = SerialMeter(self.devices)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": sum(errors),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "serial": meter.result(self.baud),
+        }
+
+    def stop_effects(self):
+        self.request("POST", "/api/effect", {"effect": "stop"})
+
+    def effect(self, name, speed, seconds):
+        """Run one effect for `seconds`, returns the engine's and the boards' frame rates"""
+        self.stop_effects()
+        meter = SerialMeter(self.devices)
+        status, started = self.request("POST", "/api/effect", {"effect": name, "speed": speed})
+        if status != 200:
+            return {"effect": name, "speed": speed, "error": status}
+        time.sleep(seconds)
+        _, stats = self.request("GET", "/api/effect")
+        serial_stats = meter.result(self.baud)
+        self.stop_effects()
+
+        stats = (stats or {}).get("stats") or {}
+        target = stats.get("target_fps") or started.get("target_fps") or 0
+        achieved = stats.get("achieved_fps", 0)
+        # Each frame is one SET per board, so board commands / boards = frames landed
+        landed = serial_stats["commands_per_s"] / max(len(self.devices), 1)
+        return {
+            "effect": name,
+            "speed": speed,
+            "target_fps": target,
+            "achieved_fps": achieved,
+            "achieved_ratio": round(achieved / target, 3) if target else None,
+            "landed_fps": round(landed, 2),
+            "frames_sent": stats.get("frames_sent"),
+            "frames_dropped": stats.get("frames_dropped"),
+            "serial": serial_stats,
+        }
+
+
+def latency_suite(bench, levels, total, bulbs):
+    """Latency per endpoint and concurrency level"""
+    values = itertools.cycle(range(0, 101, 7))
+    bulb_ids = itertools.cycle(bulbs)
+    # Two scenes to alternate between, so no apply is a no-op
+    for name, brightness in (("bench-dim", 20), ("bench-bright", 80)):
+        bench.request("POST", "/api/scene", {"action": "save", "name": name,
+                                              "levels": {f"bulb{bulb}": brightness for bulb in bulbs}})
+    scenes = itertools.cycle(["bench-dim", "bench-bright"])
+    phrases = itertools.cycle(text for text, expected in intent_corpus(bulbs, 200) if expected and "effect" not in text)
+    scenarios = {
+        "bulb": lambda: ("POST", "/api/bulb",
+                         {"bulb": next(bulb_ids), "action": "brightness", "value": next(values)}),
+        "group": lambda: ("POST", "/api/group", {"action": "brightness", "brightness": next(values)}),
+        "scene": lambda: ("POST", "/api/scene", {"action": "apply", "name": next(scenes)}),
+        "voice": lambda: ("POST", "/api/voice", {"text": next(phrases)}),
+        "batch": lambda: ("POST", "/api/batch", {"operations": [
+            {"bulb": bulb, "action": "brightness", "value": next(values)} for bulb in bulbs]}),
+        "status": lambda: ("GET", "/api/status", None),
+        "status_fresh": lambda: ("GET", "/api/status?fresh=1", None),
+    }
+    results = {}
+    for name, make_request in scenarios.items():
+        results[name] = []
+        for concurrency in levels:
+            result = bench.load(make_request, concurrency, max(total, concurrency))
+            log(f"  {name:<13} c={concurrency:<3} p50={result['p50_ms']:>8.2f}ms "
+                f"p99={result['p99_ms']:>8.2f}ms {result['throughput_rps']:>8.1f} req/s "
+                f"errors={result['errors']}")
+            results[name].append(result)
+    return results
+
+
+def effect_suite(bench, seconds, effects):
+    """Frame rate of every effect (strobe at each speed)"""
+    cases = [("strobe", speed) for speed in STROBE_BENCH_SPEEDS]
+    cases += [(name, None) for name in effects if name != "strobe"]
+    results = []
+    for name, speed in cases:
+        result = bench.effect(name, speed, seconds)
+        label = f"{name}" + (f" speed {speed}" if speed else "")
+        log(f"  {label:<15} target={result.get('target_fps', 0):>6.2f} fps "
+            f"achieved={result.get('achieved_fps', 0):>6.2f} landed={result.get('landed_fps', 0):>6.2f} "
+            f"dropped={result.get('frames_dropped')}")
+        results.append(result)
+    return results
+
+
+def seed_state(path, bulbs):
+    """Save a last known state for the bridge to warm-restore, returns its {bulb key: pwm}"""
+    levels = {f"bulb{bulb}": 40 + bulb * 53 % 200 for bulb in range(1, bulbs + 1)}
+    db = StateDatabase(path)
+    db.save_state(levels, "manual")
+    db.close()
+    return levels
+
+
+def wait_for_levels(devices, levels, started):
+    """Seconds from `started` until every board shows the levels (bulbs numbered as in bridge_config)"""
+    expected = [[levels[f"bulb{index * arduino_sim.CHANNELS + channel}"]
+                 for channel in range(1, arduino_sim.CHANNELS + 1)] for index in range(len(devices))]
+    while time.monotonic() - started < RESTORE_TIMEOUT:
+        if all(device.board.brightness == wanted for device, wanted in zip(devices, expected)):
+            return time.monotonic() - started
+        time.sleep(0.001)
+    return None
+
+
+def restore_suite(devices, levels):
+    """Reset every board at once and time how long until the bridge has put the levels back"""
+    for device in devices:
+        device.reset()
+    elapsed = wait_for_levels(devices, levels, time.monotonic())
+    result = {"reset_s": round(elapsed, 3) if elapsed is not None else None}
+    log(f"  board reset    restored in {elapsed * 1000:.0f} ms" if elapsed is not None
+        else "  board reset    levels not restored")
+    return result
+
+
+def schedule_suite(api, bench, devices, seconds):
+    """Cron rules added through the API, one-shot timer lateness, and the writes one ramp takes"""
+    bulbs = sorted(api.registry.by_key)
+    result = {"rules": SCHEDULE_BENCH_RULES}
+    started = time.monotonic()
+    for index in range(SCHEDULE_BENCH_RULES):
+        bench.request("POST", "/api/schedule", {
+            "action": "add", "id": f"bench-cron-{index}", "cron": f"{index % 60} {index // 60 % 24} * * *",
+            "levels": {bulbs[index % len(bulbs)]: index % 101}})
+    result["add_per_s"] = round(SCHEDULE_BENCH_RULES / (time.monotonic() - started), 1)
+    log(f"  {SCHEDULE_BENCH_RULES} cron rules added at {result['add_per_s']:.0f} rules/s")
+
+    # Timer lateness as the scheduler itself sees it
+    lateness = []
+    observe = api.scheduler.observe_lateness
+    api.scheduler.observe_lateness = lateness.append
+    now = time.time()
+    for index in range(SCHEDULE_BENCH_TIMERS):
+        bench.request("POST", "/api/schedule", {
+            "action": "add", "id": f"bench-timer-{index}", "at": now + 0.5 + index * 1.5 / SCHEDULE_BENCH_TIMERS,
+            "levels": {bulbs[index % len(bulbs)]: index % 101}})
+    deadline = time.monotonic() + RESTORE_TIMEOUT
+    while any(f"bench-timer-{index}" in api.state_db.rules for index in range(SCHEDULE_BENCH_TIMERS)) \
+            and time.monotonic() < deadline:
+        time.sleep(0.05)
+    api.scheduler.observe_lateness = observe
+    lateness = sorted(value * 1000 for value in lateness)
+    result.update({
+        "timers": len(lateness),
+        "lateness_p50_ms": round(percentile(lateness, 50), 3) if lateness else None,
+        "lateness_p99_ms": round(percentile(lateness, 99), 3) if lateness else None,
+    })
+    log(f"  {len(lateness)} timers fired, lateness p50={result['lateness_p50_ms']}ms "
+        f"p99={result['lateness_p99_ms']}ms")
+
+    # A slow ramp (few PWM steps for its length, like a sunrise): a write only when a value changes
+    bench.request("POST", "/api/group", {"action": "off"})
+    target = {key: 12 for key in bulbs}
+    meter = SerialMeter(devices)
+    bench.request("POST", "/api/schedule", {"action": "add", "id": "bench-ramp", "delay": 0,
+                                             "levels": target, "duration": seconds})
+    expected = {key: int(value * 2.55) for key, value in target.items()}
+    elapsed = wait_for_levels(devices, expected, time.monotonic())
+    writes = meter.totals()["commands"] - meter.before["commands"]
+    result.update({
+        "ramp_seconds": seconds,
+        "ramp_steps": max(expected.values()),
+        "ramp_writes": writes,
+        "fixed_rate_writes": int(seconds / api.RAMP_MIN_INTERVAL) * len(devices),
+        "ramp_done_s": round(elapsed, 3) if elapsed is not None else None,
+    })
+    log(f"  ramp to {max(expected.values())} steps over {seconds:.0f}s: {writes} writes "
+        f"(fixed {1 / api.RAMP_MIN_INTERVAL:.0f} Hz: {result['fixed_rate_writes']}), "
+        f"done in {elapsed if elapsed is not None else float('nan'):.2f}s")
+
+    for index in range(SCHEDULE_BENCH_RULES):
+        bench.request("POST", "/api/schedule", {"action": "delete", "id": f"bench-cron-{index}"})
+    return result
+
+
+UNIT_WORDS = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+              "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TEN_WORDS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+
+
+def spell(number):
+    """0-100 in words ("fifty five")"""
+    if number == 100:
+        return "one hundred"
+    if number < 20:
+        return UNIT_WORDS[number]
+    return TEN_WORDS[number // 10] + (f" {UNIT_WORDS[number % 10]}" if number % 10 else "")
+
+
+def intent_corpus(bulbs, size, seed=1):
+    """[(phrase, expected operations)] from templates, numbers in digits or words, some with a typo.
+    Phrases naming a bulb that does not exist expect no operations."""
+    rng = random.Random(seed)
+    speeds = {"slowly": 1, "fast": 4, "at speed three": 3}
+
+    def number(value):
+        return str(value) if rng.random() < 0.5 else spell(value)
+
+    def other(bulb):
+        return bulbs[0] if bulb != bulbs[0] else bulbs[-1]
+
+    def level(value):
+        return rng.choice([f"{number(value)} percent", f"{value}%", number(value)])
+
+    templates = [
+        lambda b, v: (f"turn on light {number(b)}", [{"bulb": b, "action": "on"}]),
+        lambda b, v: (f"switch light {number(b)} off", [{"bulb": b, "action": "off"}]),
+        lambda b, v: (f"set light {number(b)} to {level(v)}", [{"bulb": b, "action": "brightness", "value": v}]),
+        lambda b, v: (f"please turn the bulb number {number(b)} to {level(v)}",
+                      [{"bulb": b, "action": "brightness", "value": v}]),
+        lambda b, v: ("all lights off", [{"action": "off"}]),
+        lambda b, v: ("turn everything on", [{"action": "on"}]),
+        lambda b, v: (f"dim all the lights to {level(v)}", [{"action": "brightness", "value": v}]),
+        lambda b, v: ("stop", [{"effect": "stop"}]),
+        lambda b, v: (f"light {number(b)} on and light {number(other(b))} off",
+                      [{"bulb": b, "action": "on"}, {"bulb": other(b), "action": "off"}]),
+    ]
+    # Bulb numbers the registry does not have: rejected, never read as a brightness
+    missing = [0] + [max(bulbs) + k for k in (1, 2, 9)]
+    templates += [
+        lambda b, v: (f"turn off light {number(rng.choice(missing))}", []),
+        lambda b, v: (f"light {number(rng.choice(missing))} on", []),
+        lambda b, v: (f"set the lamp {number(rng.choice(missing))} to {level(v)}", []),
+        lambda b, v: (f"light {number(b)} on and bulb {number(rng.choice(missing))} off", []),
+    ]
+    for effect in ("strobe", "fade", "pulse", "alternate", "rainbow"):
+        for words, speed in speeds.items():
+            templates.append(lambda b, v, effect=effect, words=words, speed=speed:
+                             (f"start {effect} {words}", [{"effect": effect, "speed": speed}]))
+
+    corpus = []
+    for _ in range(size):
+        text, expected = rng.choice(templates)(rng.choice(bulbs), rng.randint(0, 100))
+        if rng.random() < INTENT_TYPO_RATE:
+            words = text.split(" ")
+            long_words = [i for i, word in enumerate(words) if len(word) >= 5 and word.isalpha()]
+            if long_words:
+                i = rng.choice(long_words)
+                at = rng.randrange(1, len(words[i]) - 1)
+                word = words[i]
+                words[i] = word[:at] + word[at + 1] + word[at] + word[at + 2:]
+                text = " ".join(words)
+        corpus.append((text, expected))
+    return corpus
+
+
+def intent_suite(api):
+    """Parse time and accuracy of the intent engine over a generated corpus"""
+    corpus = intent_corpus(list(api.registry.bulbs), INTENT_CORPUS_SIZE)
+    times, correct = [], 0
+    for text, expected in corpus:
+        started = time.perf_counter()
+        intent = api.intent_engine.parse(text)
+        times.append((time.perf_counter() - started) * 1e6)
+        correct += intent.operations == expected and bool(intent.unknown) == (not expected)
+    times.sort()
+    result = {
+        "phrases": len(corpus),
+        "accuracy": round(correct / len(corpus), 4),
+        "parse_p50_us": round(percentile(times, 50), 1),
+        "parse_p99_us": round(percentile(times, 99), 1),
+        "parse_max_us": round(times[-1], 1),
+    }
+    log(f"  {len(corpus)} phrases: {result['accuracy'] * 100:.1f}% understood, parse "
+        f"p50={result['parse_p50_us']}us p99={result['parse_p99_us']}us max={result['parse_max_us']}us")
+    return result
+
+
+def live_suite(api, devices, baud, seconds):
+    """Stream live show frames at fixed rates, count what is played and dropped, time send to ack.
+
+    The WebSocket runs in-process through Starlette's test client, so no
+    WebSocket library is needed; the latency excludes the network.
+    """
+    from fastapi.testclient import TestClient
+
+    header = struct.Struct("<Id")
+    results = []
+    for rate in LIVE_BENCH_RATES:
+        meter = SerialMeter(devices)
+        latencies, reports = [], []
+        with TestClient(api.app).websocket_connect(f"/api/live?jitter={LIVE_BENCH_JITTER_MS}") as ws:
+            bulbs = len(ws.receive_json()["bulbs"])
+
+            def receive():
+                while True:
+                    try:
+                        message = ws.receive_json()
+                    except Exception:
+                        return      # closed by ws.close() below
+                    if message["type"] == "ack":
+                        latencies.append(time.monotonic() * 1000 - message["client_time"])
+                    elif message["type"] == "stats":
+                        reports.append(message)
+                    elif message["type"] == "end":
+                        return
+
+            receiver = threading.Thread(target=receive, daemon=True)
+            receiver.start()
+            total = int(rate * seconds)
+            started = time.monotonic()
+            for frame in range(total):
+                time.sleep(max(0.0, started + frame / rate - time.monotonic()))
+                levels = bytes((frame * 37 + n * 85) % 256 for n in range(bulbs))
+                ws.send_bytes(header.pack(frame, time.monotonic() * 1000) + levels)
+            elapsed = time.monotonic() - started
+            time.sleep(max(LIVE_BENCH_JITTER_MS / 1000, 0.2) + api.LIVE_REPORT_INTERVAL)
+            ws.close()
+        latencies.sort()
+        last = reports[-1] if reports else {}
+        result = {
+            "offered_fps": rate,
+            "played_fps": round(len(latencies) / elapsed, 2),
+            "dropped": last.get("dropped"),
+            "max_buffered": max((r["buffered"] for r in reports), default=None),
+            "e2e_p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+            "e2e_p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+            "jitter_ms": LIVE_BENCH_JITTER_MS,
+            "serial": meter.result(baud),
+        }
+        log(f"  offered {rate:>3} fps played={result['played_fps']:>6.2f} fps dropped={result['dropped']} "
+            f"e2e p50={result['e2e_p50_ms']}ms p99={result['e2e_p99_ms']}ms")
+        results.append(result)
+    return results
+
+
+def history_suite(api):
+    """Record a week of effect-rate samples into a fresh history, then time downsampled queries"""
+    from bridge_history import History
+
+    history = History()
+    bulbs = [bulb.key for bulb in api.registry.bulbs.values()]
+    series = [history.series(key, level=True) for key in bulbs]
+    now = time.time()
+    start = now - HISTORY_BENCH_DAYS * 86400
+    # A week at 30 samples/s is too many to write; record a sample every 10 s over the week,
+    # then the last minute at the full rate, and time only the full-rate part
+    for step in range(0, HISTORY_BENCH_DAYS * 86400 - 60, 10):
+        for n, item in enumerate(series):
+            item.add((step + n * 7) % 101, start + step)
+    samples = 0
+    started = time.perf_counter()
+    for frame in range(60 * 30):
+        when = now - 60 + frame / 30
+        for n, item in enumerate(series):
+            item.set((frame * 37 + n * 85) % 101, when)
+        samples += len(series)
+    append_us = (time.perf_counter() - started) / samples * 1e6
+
+    queries = {}
+    for span, step in HISTORY_BENCH_QUERIES:
+        seconds, window = api.parse_duration(span), api.parse_duration(step)
+        started = time.perf_counter()
+        result = history.query(bulbs, now - seconds, now, window, now=now)
+        queries[span] = {
+            "step_s": result["step"],
+            "resolution_s": result["resolution"],
+            "windows": len(result["series"][bulbs[0]]),
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+    one = series[0]
+    memory = (one.times.itemsize * len(one.times) * 2
+              + sum(array.itemsize * len(array) for tier in one.tiers
+                    for array in (tier.bucket, tier.count, tier.total, tier.low, tier.high, tier.last)))
+    result = {
+        "series": len(series),
+        "append_us": round(append_us, 2),
+        "bytes_per_series": memory,
+        "queries": queries,
+    }
+    log(f"  record {result['append_us']}us/sample, {memory / 1024:.0f} KiB per series")
+    for span, query in queries.items():
+        log(f"  {span:>3} at {query['step_s']:>5.0f}s ({query['windows']} windows x {len(series)} bulbs, "
+            f"{query['resolution_s']}s buckets) {query['ms']} ms")
+    return result
+
+
+def link_suite(api, devices, baud, seconds):
+    """Level frames acknowledged per second when sent back to back, as deep as the window allows"""
+    bulbs = list(api.registry.bulbs)
+    depth = min(c.window for c in api.registry.controllers.values())
+    in_flight = collections.deque()
+    acknowledged = 0
+    meter = SerialMeter(devices)
+    started = time.monotonic()
+    for frame in itertools.count():
+        if time.monotonic() - started >= seconds:
+            break
+        # Every frame differs from the last, so none is skipped as a no-op, and has its
+        # own cancel token, so none replaces another in the queue
+        levels = {bulb_id: (frame * 37 + n * 85) % 256 for n, bulb_id in enumerate(bulbs)}
+        in_flight.append(api.submit_levels(levels, priority=api.PRIORITY_EFFECT, cancel_event=threading.Event()))
+        while len(in_flight) >= depth:
+            acknowledged += bool(api.collect_levels(in_flight.popleft(), priority=api.PRIORITY_EFFECT))
+    while in_flight:
+        acknowledged += bool(api.collect_levels(in_flight.popleft(), priority=api.PRIORITY_EFFECT))
+    elapsed = time.monotonic() - started
+    serial_stats = meter.result(baud)
+    result = {
+        "window": depth,
+        "frames_per_s": round(acknowledged / elapsed, 2),
+        "landed_fps": round(serial_stats["commands_per_s"] / max(len(devices), 1), 2),
+        "serial": serial_stats,
+    }
+    log(f"  level frames   window={depth} acknowledged={result['frames_per_s']:>6.2f} fps "
+        f"landed={result['landed_fps']:>6.2f} fps")
+    return result
+
+
+def compare(current, baseline_path):
+    """Print the relative change of the headline numbers against an older result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def change(new, old, lower_is_better):
+        if new is None or not old:
+            return "n/a"
+        pct = (new - old) / old * 100
+        better = pct < 0 if lower_is_better else pct > 0
+        return f"{pct:+7.1f}% {'better' if better and abs(pct) >= 5 else 'worse' if abs(pct) >= 5 else ''}"
+
+    log(f"\nComparison with {baseline_path} ({baseline.get('meta', {}).get('revision')}):")
+    for endpoint, levels in current["latency"].items():
+        old_levels = {r["concurrency"]: r for r in baseline.get("latency", {}).get(endpoint, [])}
+        for result in levels:
+            old = old_levels.get(result["concurrency"])
+            if old is None:
+                continue
+            log(f"  {endpoint:<13} c={result['concurrency']:<3} "
+                f"p50 {change(result['p50_ms'], old['p50_ms'], True)}  "
+                f"p99 {change(result['p99_ms'], old['p99_ms'], True)}")
+    old_effects = {(r["effect"], r.get("speed")): r for r in baseline.get("effects", [])}
+    for result in current["effects"]:
+        old = old_effects.get((result["effect"], result.get("speed")))
+        if old is None:
+            continue
+        label = result["effect"] + (f" {result['speed']}" if result.get("speed") else "")
+        log(f"  {label:<15} fps {change(result.get('landed_fps'), old.get('landed_fps'), False)}")
+    for key, label in (("startup_s", "bridge start"), ("reset_s", "board reset")):
+        new, old = (current.get("restore") or {}).get(key), (baseline.get("restore") or {}).get(key)
+        if new is not None and old is not None:
+            log(f"  {label:<15} restore {change(new, old, True)}")
+    new, old = current.get("intents") or {}, baseline.get("intents") or {}
+    if new.get("parse_p99_us") is not None and old.get("parse_p99_us") is not None:
+        log(f"  {'phrase parse':<15} p99 {change(new['parse_p99_us'], old['parse_p99_us'], True)}")
+    new, old = current.get("history") or {}, baseline.get("history") or {}
+    if new.get("append_us") is not None and old.get("append_us") is not None:
+        log(f"  {'history record':<15} {change(new['append_us'], old['append_us'], True)}")
+        for span, query in new["queries"].items():
+            if span in old.get("queries", {}):
+                log(f"  {'history ' + span:<15} query {change(query['ms'], old['queries'][span]['ms'], True)}")
+    new, old = current.get("schedule") or {}, baseline.get("schedule") or {}
+    if new.get("lateness_p99_ms") is not None and old.get("lateness_p99_ms") is not None:
+        log(f"  {'timer lateness':<15} p99 {change(new['lateness_p99_ms'], old['lateness_p99_ms'], True)}")
+    old_live = {r["offered_fps"]: r for r in baseline.get("live") or []}
+    for result in current.get("live") or []:
+        old = old_live.get(result["offered_fps"])
+        if old is None:
+            continue
+        log(f"  {'live ' + str(result['offered_fps']) + ' fps':<15} "
+            f"played {change(result['played_fps'], old['played_fps'], False)}  "
+            f"p99 {change(result['e2e_p99_ms'], old['e2e_p99_ms'], True)}")
+    if current.get("link") and baseline.get("link"):
+        log(f"  {'level frames':<15} fps "
+            f"{change(current['link']['landed_fps'], baseline['link'].get('landed_fps'), False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark arduino_api.py against simulated Arduinos")
+    parser.add_argument("--boards", type=int, default=1, help="simulated boards (3 bulbs each)")
+    parser.add_argument("--baud", type=int, default=arduino_sim.BAUD_RATE, help="simulated line speed")
+    parser.add_argument("--speech", type=float, default=0.0,
+                        help="scale of the sketch's voice feedback delays (1 = real board)")
+    parser.add_argument("--usb-latency", type=float, default=0.0,
+                        help="ms the simulated USB-serial adapter holds replies (see arduino_sim)")
+    parser.add_argument("--text-only", action="store_true",
+                        help="simulate firmware without binary frames (text protocol only)")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="requests per level")
+    parser.add_argument("--effect-seconds", type=float, default=DEFAULT_EFFECT_SECONDS)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="HTTP worker processes in front of the bridge (1 = the bridge serves HTTP itself)")
+    parser.add_argument("--skip-latency", action="store_true")
+    parser.add_argument("--skip-effects", action="store_true")
+    parser.add_argument("--skip-link", action="store_true")
+    parser.add_argument("--skip-restore", action="store_true")
+    parser.add_argument("--skip-schedule", action="store_true")
+    parser.add_argument("--skip-intents", action="store_true")
+    parser.add_argument("--skip-live", action="store_true")
+    parser.add_argument("--skip-history", action="store_true")
+    parser.add_argument("--output", default=None, help="result file (default bench_results/<rev>-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    devices = arduino_sim.start_simulators(
+        args.boards, baud=args.baud, speech=args.speech, boot=0, binary=not args.text_only,
+        usb_latency=args.usb_latency / 1000)
+    workdir = tempfile.mkdtemp(prefix="bridge-bench-")
+    config_path = os.path.join(workdir, "bridge_config.json")
+    with open(config_path, "w") as f:
+        json.dump(arduino_sim.bridge_config(devices), f)
+
+    # The bridge reads its settings at import time
+    os.environ["BRIDGE_CONFIG"] = config_path
+    os.environ["PORT_CACHE_FILE"] = os.path.join(workdir, "last_port.json")
+    os.environ["STATE_DB"] = os.path.join(workdir, "bridge.db")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    saved_levels = seed_state(os.environ["STATE_DB"], args.boards * arduino_sim.CHANNELS)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import arduino_api
+        import uvicorn
+
+        # Bridge start to lights back on (the simulated boards boot instantly, a real Uno adds ~1.5 s)
+        connect_started = time.monotonic()
+        if not arduino_api.connect_arduino():
+            log("❌ Bridge could not connect to the simulated boards")
+            sys.exit(1)
+        startup_restore = wait_for_levels(devices, saved_levels, connect_started)
+
+        port = free_port()
+        workers = None
+        if args.workers > 1:
+            socket_path, shm_path = os.path.join(workdir, "broker.sock"), os.path.join(workdir, "state.shm")
+            arduino_api.snapshot_publisher.start(shm_path)
+            server = uvicorn.Server(uvicorn.Config(arduino_api.app, uds=socket_path, log_level="warning",
+                                                   timeout_keep_alive=300))
+            workers = start_workers(args.workers, port, socket_path, shm_path)
+        else:
+            server = uvicorn.Server(uvicorn.Config(arduino_api.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        if workers is not None:
+            wait_for_port(port)
+
+        bench = Bench(port, devices, args.baud)
+        levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+        results = {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "boards": args.boards,
+                "bulbs": len(arduino_api.registry.bulbs),
+                "baud": args.baud,
+                "speech": args.speech,
+                "usb_latency_ms": args.usb_latency,
+                "protocols": sorted({c.protocol for c in arduino_api.registry.controllers.values()}),
+                "window": min(c.window for c in arduino_api.registry.controllers.values()),
+                "http_workers": args.workers,
+                "requests_per_level": args.requests,
+                "effect_seconds": args.effect_seconds,
+            },
+            "latency": {},
+            "effects": [],
+            "link": None,
+            "schedule": None,
+            "intents": None,
+            "live": None,
+            "history": None,
+            "restore": {"startup_s": round(startup_restore, 3) if startup_restore is not None else None},
+        }
+
+        log("💡 Warm restore")
+        log(f"  bridge start   restored in {startup_restore * 1000:.0f} ms" if startup_restore is not None
+            else "  bridge start   levels not restored")
+        if not args.skip_restore:
+            results["restore"].update(restore_suite(devices, saved_levels))
+
+        if not args.skip_intents:
+            log("🗣️  Voice/text intents")
+            results["intents"] = intent_suite(arduino_api)
+        if not args.skip_history:
+            log("📈 History")
+            results["history"] = history_suite(arduino_api)
+        if not args.skip_latency:
+            log("⏱️  Endpoint latency")
+            results["latency"] = latency_suite(bench, levels, args.requests, list(arduino_api.registry.bulbs))
+        if not args.skip_effects:
+            log("🎬 Effect frame rates")
+            results["effects"] = effect_suite(bench, args.effect_seconds, list(arduino_api.EFFECTS))
+        if not args.skip_schedule:
+            log("⏰ Scheduler")
+            bench.stop_effects()
+            results["schedule"] = schedule_suite(arduino_api, bench, devices, args.effect_seconds)
+        if not args.skip_live:
+            log("🎛️  Live show frames")
+            bench.stop_effects()
+            results["live"] = live_suite(arduino_api, devices, args.baud, args.effect_seconds)
+        if not args.skip_link:
+            log("🔗 Serial link")
+            bench.stop_effects()
+            results["link"] = link_suite(arduino_api, devices, args.baud, args.effect_seconds)
+
+        server.should_exit = True
+        if workers is not None:
+            workers.terminate()
+            workers.wait()
+
+    output = args.output or os.path.join(
+        "bench_results", f"{results['meta']['revision'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    log(f"💾 Results saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    for device in devices:
+        device.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""Simulated Arduino for running the bridge without hardware.
+
+Speaks the same serial protocol as arduino-sketch/arduino.ino over a pseudo
+terminal, so arduino_api.py talks to it exactly like a real Uno:
+
+    python arduino_sim.py                # prints the port to use
+    SERIAL_PORT=/dev/pts/5 python arduino_api.py
+
+Timing follows the real board: bytes move at the configured baud rate (8N1),
+only 64 bytes of input are buffered while the sketch is busy, loop() sleeps
+10 ms, speakBulbAction blocks for the length of the spoken words, and
+opening the port resets the board (bootloader + setup) before it prints
+SMART_BULBS_VOICE_READY. Set speech/boot to 0 for a fast, timing-free board.
+--usb-latency adds the delay a USB-serial adapter holds replies for before
+the host sees them (a few ms on clones, up to 16 ms on FTDI by default).
+The board answers CAPS, accepts binary level frames and tagged (pipelined)
+commands like the current sketch; --text-only models older firmware that
+knows none of them.
+Unix only (needs pty).
+"""
+import argparse
+import heapq
+import json
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+BAUD_RATE = 9600
+RX_BUFFER_SIZE = 64         # Uno hardware serial input buffer
+LOOP_DELAY = 0.010          # delay(10) at the end of loop()
+BOOT_DELAY = 1.5            # bootloader + delay(1000) in setup()
+WORD_TIME = 0.4             # rough length of one Talkie word
+CHANNELS = 3
+
+READY_LINE = "SMART_BULBS_VOICE_READY"
+CAPS_LINE = "CAPS:BIN1:SEQ:CH3"
+
+# Binary level frames (see processBinaryFrame in the sketch)
+FRAME_SYNC = 0xA5
+FRAME_OP_LEVELS = 0x01
+FRAME_ACK = 0x80
+FRAME_NAK = 0xC0
+
+# Words spoken (and pauses in seconds) by speakBulbAction for each action
+SPEECH = {
+    "ON": (3, 0.07 * 2 + 0.2),
+    "OFF": (3, 0.07 * 2 + 0.2),
+    "ACK": (1, 0.2),
+    "START": (1, 0.2),
+    "STOP": (1, 0.2),
+}
+STARTUP_SPEECH = (3, 0.2)   # "light control ready"
+
+
+class SimulatedArduino:
+    """Sketch state and command handling, independent of any transport"""
+
+    def __init__(self, speech=1.0, echo=True, binary=True):
+        self.speech = speech        # speech delay scale (0 = no voice feedback delays)
+        self.echo = echo            # send "CMD: ..." before each (non-SET) reply
+        self.binary = binary        # firmware with CAPS, binary level frames and tagged commands
+        self.reset()
+
+    def reset(self):
+        self.brightness = [0] * CHANNELS
+        self.mode = "MANUAL"
+        self.effect_running = False
+
+    def speak_time(self, action):
+        words, pauses = SPEECH[action]
+        return (words * WORD_TIME + pauses) * self.speech
+
+    def startup_time(self):
+        words, pauses = STARTUP_SPEECH
+        return (words * WORD_TIME + pauses) * self.speech
+
+    def _set(self, channel, value, action):
+        self.brightness[channel] = max(0, min(255, value))
+        self.mode = "MANUAL"
+        self.effect_running = False
+        return self.speak_time(action)
+
+    def handle(self, cmd, echo=True):
+        """Process one command line like processCommand().
+
+        Returns (lines, busy): the lines printed and how long the sketch was
+        blocked (speech) before printing the final reply.
+        """
+        cmd = cmd.upper()
+        lines = []
+        busy = 0.0
+
+        if not cmd.startswith("SET ") and self.echo and echo:
+            lines.append(f"CMD: {cmd}")
+
+        if cmd.startswith("SET "):
+            try:
+                values = [int(v) for v in cmd[4:].split()[:CHANNELS]]
+            except ValueError:
+                values = []
+            if len(values) == CHANNELS:
+                self.brightness = [max(0, min(255, v)) for v in values]
+                self.mode = "MANUAL"
+                self.effect_running = False
+                lines.append("OK:SET:" + ":".join(str(v) for v in self.brightness))
+            else:
+                lines.append(f"ERROR:UNKNOWN:{cmd}")
+
+        elif cmd in ("B1 ON", "B2 ON", "B3 ON", "B1 OFF", "B2 OFF", "B3 OFF"):
+            channel = int(cmd[1]) - 1
+            action = cmd[3:]
+            busy = self._set(channel, 255 if action == "ON" else 0, action)
+            lines.append(f"OK:B{channel + 1}:{action}")
+
+        elif cmd in ("ALL ON", "ALL OFF"):
+            action = cmd[4:]
+            for channel in range(CHANNELS):
+                self._set(channel, 255 if action == "ON" else 0, action)
+            busy = self.speak_time(action)
+            lines.append(f"OK:ALL:{action}")
+
+        elif cmd == "START STROBE":
+            self.mode = "STROBE"
+            self.effect_running = True
+            busy = self.speak_time("START")
+            lines.append("EFFECT:STROBE:STARTED")
+
+        elif cmd == "STOP":
+            self.mode = "MANUAL"
+            self.effect_running = False
+            self.brightness = [0] * CHANNELS
+            busy = self.speak_time("STOP")
+            lines.append("EFFECT:STOPPED")
+
+        elif cmd[:3] in ("B1 ", "B2 ", "B3 "):
+            value = cmd[3:].strip()
+            if value:
+                channel = int(cmd[1]) - 1
+                busy = self._set(channel, _to_int(value), "ACK")
+                lines.append(f"OK:B{channel + 1}:{self.brightness[channel]}")
+
+        elif cmd == "STATUS":
+            b1, b2, b3 = self.brightness
+            lines.append(f"STATUS:B1:{b1}:B2:{b2}:B3:{b3}:MODE:{self.mode}")
+
+        elif cmd == "CAPS" and self.binary:
+            lines.append(CAPS_LINE)
+
+        elif cmd in ("PING", "TEST"):
+            busy = self.speak_time("ACK")
+            lines.append("PONG:VOICE_ACTIVE")
+
+        else:
+            lines.append(f"ERROR:UNKNOWN:{cmd}")
+
+        return lines, busy
+
+    def handle_frame(self, frame):
+        """Process one complete binary frame, returns the ACK/NAK byte"""
+        opcode, seq, mask = frame[1], frame[2] & 0x3F, frame[3] & 0x07
+        values = frame[4:-1]
+        if opcode != FRAME_OP_LEVELS or crc8(frame[1:-1]) != frame[-1]:
+            return bytes([FRAME_NAK | seq])
+        values = iter(values)
+        for channel in range(CHANNELS):
+            if mask & (1 << channel):
+                self.brightness[channel] = next(values)
+        self.mode = "MANUAL"
+        self.effect_running = False
+        return bytes([FRAME_ACK | seq])
+
+
+def crc8(data):
+    """CRC-8, polynomial 0x07 (same as the sketch)"""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def frame_length(header):
+    """Total length of a binary frame given at least its first 4 bytes"""
+    return 4 + bin(header[3] & 0x07).count("1") + 1
+
+
+def _to_int(text):
+    """Arduino String.toInt(): leading digits, 0 if there are none"""
+    digits = ""
+    for i, ch in enumerate(text):
+        if ch.isdigit() or (i == 0 and ch in "+-"):
+            digits += ch
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+class PtyArduino:
+    """A SimulatedArduino behind a pseudo terminal, with Uno serial timing"""
+
+    def __init__(self, baud=BAUD_RATE, speech=1.0, boot=BOOT_DELAY, reset_on_open=True,
+                 echo=True, link=None, binary=True, usb_latency=0.0):
+        self.board = SimulatedArduino(speech=speech, echo=echo, binary=binary)
+        self.byte_time = 10.0 / baud if baud else 0.0   # 8N1: 10 bits per byte
+        self.usb_latency = usb_latency      # seconds before the host sees bytes the board sent
+        self.boot = boot
+        self.reset_on_open = reset_on_open
+        self.link = link
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        # With no slave fd of our own, POLLHUP tells us when the bridge opens/closes the port
+        os.close(slave)
+        if link:
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(self.port, link)
+
+        self.rx = bytearray()
+        self.rx_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.outbox = []            # (due, order, bytes) held back by the USB adapter
+        self.outbox_ready = threading.Condition()
+        self.opened = threading.Event()
+        self.booting = False
+        self.running = False
+        self.generation = 0         # bumped on every open, stale boots give up
+        self.stats = {"bytes_in": 0, "bytes_out": 0, "commands": 0, "dropped_bytes": 0, "resets": 0}
+
+    @property
+    def name(self):
+        return self.link or self.port
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._receive, daemon=True).start()
+        threading.Thread(target=self._loop, daemon=True).start()
+        if self.usb_latency:
+            threading.Thread(target=self._deliver, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+
+    def _receive(self):
+        """UART side: watch open/close and fill the 64-byte input buffer at line speed"""
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN | select.POLLHUP)
+        while self.running:
+            events = poller.poll(100)
+            hangup = any(mask & select.POLLHUP for _, mask in events)
+
+            if hangup:
+                self.opened.clear()
+                time.sleep(0.02)
+                continue
+
+            if not self.opened.is_set():
+                self.generation += 1
+                with self.rx_lock:
+                    self.rx.clear()
+                self.opened.set()
+                if self.reset_on_open:
+                    self.stats["resets"] += 1
+                    threading.Thread(target=self._boot, args=(self.generation,), daemon=True).start()
+
+            if not any(mask & select.POLLIN for _, mask in events):
+                continue
+            try:
+                data = os.read(self.master, 256)
+            except OSError:
+                continue
+            self.stats["bytes_in"] += len(data)
+            if self.byte_time:
+                time.sleep(len(data) * self.byte_time)
+            with self.rx_lock:
+                room = RX_BUFFER_SIZE - len(self.rx)
+                self.rx.extend(data[:room])
+                if len(data) > room:
+                    self.stats["dropped_bytes"] += len(data) - room
+
+    def reset(self):
+        """Reset the board while the port stays open (reset button, brown-out, watchdog)"""
+        self.generation += 1
+        self.stats["resets"] += 1
+        self.booting = True
+        self.board.reset()
+        threading.Thread(target=self._boot, args=(self.generation,), daemon=True).start()
+
+    def _boot(self, generation):
+        """Board reset: bootloader, setup() delay and startup speech, then READY"""
+        self.booting = True
+        self.board.reset()
+        time.sleep(self.boot + self.board.startup_time())
+        if generation != self.generation:
+            return
+        with self.rx_lock:
+            # Anything sent while the bootloader was running is lost
+            self.rx.clear()
+        self.booting = False
+        self._send([READY_LINE])
+
+    def _send(self, lines):
+        self._write("".join(line + "\r\n" for line in lines).encode())
+
+    def _write(self, data):
+        with self.write_lock:
+            if self.byte_time:
+                time.sleep(len(data) * self.byte_time)
+            self.stats["bytes_out"] += len(data)
+            if self.usb_latency:
+                with self.outbox_ready:
+                    heapq.heappush(self.outbox, (time.monotonic() + self.usb_latency, self.stats["bytes_out"], data))
+                    self.outbox_ready.notify()
+                return
+            self._put(data)
+
+    def _put(self, data):
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def _deliver(self):
+        """USB adapter: hand the board's bytes to the host usb_latency after they were sent"""
+        while self.running:
+            with self.outbox_ready:
+                if not self.outbox:
+                    self.outbox_ready.wait(0.1)
+                    continue
+                due, _, data = self.outbox[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.outbox_ready.wait(wait)
+                    continue
+                heapq.heappop(self.outbox)
+            self._put(data)
+
+    def _next_frame(self):
+        """A complete binary frame at the head of the input buffer, if there is one"""
+        with self.rx_lock:
+            if not self.board.binary or not self.rx or self.rx[0] != FRAME_SYNC:
+                return None
+            if len(self.rx) < 4 or len(self.rx) < frame_length(self.rx):
+                return b""      # still arriving
+            length = frame_length(self.rx)
+            frame = bytes(self.rx[:length])
+            del self.rx[:length]
+        return frame
+
+    def _next_line(self):
+        with self.rx_lock:
+            if b"\n" not in self.rx:
+                return None
+            index = self.rx.index(b"\n")
+            line = bytes(self.rx[:index])
+            del self.rx[:index + 1]
+        return line.decode("ascii", errors="ignore").strip()
+
+    def _loop(self):
+        """The sketch's loop(): handle waiting commands, then delay(10).
+
+        The current sketch handles everything that is waiting in one pass; older
+        firmware (--text-only) took one command per pass.
+        """
+        while self.running:
+            if not self.opened.wait(0.1) or self.booting:
+                time.sleep(LOOP_DELAY)
+                continue
+            while self._step() and self.board.binary:
+                pass
+            time.sleep(LOOP_DELAY)
+
+    def _step(self):
+        """Handle one waiting command, False if there was none"""
+        frame = self._next_frame()
+        if frame:
+            self.stats["commands"] += 1
+            self._write(self.board.handle_frame(frame))
+            return True
+        line = self._next_line() if frame is None else None
+        if not line:
+            return False
+        tag = ""
+        if line.startswith("#") and self.board.binary:
+            # Tagged command: the reply carries the tag, no echo
+            tag, _, line = line.partition(" ")
+            tag += " "
+            if not line:
+                return True
+        self.stats["commands"] += 1
+        lines, busy = self.board.handle(line, echo=not tag)
+        lines[-1] = tag + lines[-1]
+        # The echo goes out before speech blocks the sketch
+        if len(lines) > 1:
+            self._send(lines[:-1])
+        if busy:
+            time.sleep(busy)
+        self._send(lines[-1:])
+        return True
+
+
+def start_simulators(count=1, **options):
+    """Start `count` simulated boards, returns the running PtyArduino objects"""
+    links = options.pop("link", None)
+    devices = []
+    for index in range(count):
+        link = f"{links}{index}" if links else None
+        devices.append(PtyArduino(link=link, **options).start())
+    return devices
+
+
+def bridge_config(devices):
+    """Device registry (BRIDGE_CONFIG) with one controller per simulated board"""
+    controllers = []
+    bulbs = []
+    for index, device in enumerate(devices):
+        name = f"sim{index}"
+        controllers.append({"name": name, "port": device.name})
+        for channel in range(1, CHANNELS + 1):
+            bulbs.append({"id": len(bulbs) + 1, "controller": name, "channel": channel})
+    return {"controllers": controllers, "bulbs": bulbs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated smart bulb Arduino on a pseudo terminal")
+    parser.add_argument("--count", type=int, default=1, help="number of boards")
+    parser.add_argument("--baud", type=int, default=BAUD_RATE, help="line speed to model (0 = instant)")
+    parser.add_argument("--speech", type=float, default=1.0,
+                        help="scale of voice feedback delays (0 = none)")
+    parser.add_argument("--usb-latency", type=float, default=0.0,
+                        help="ms a USB-serial adapter holds replies before the host sees them")
+    parser.add_argument("--boot", type=float, default=BOOT_DELAY,
+                        help="seconds from port open to setup() finishing")
+    parser.add_argument("--no-reset", action="store_true", help="don't reset the board when the port opens")
+    parser.add_argument("--no-echo", action="store_true", help="don't echo CMD: lines")
+    parser.add_argument("--text-only", action="store_true",
+                        help="model older firmware without CAPS / binary level frames")
+    parser.add_argument("--link", help="symlink prefix, e.g. /tmp/ttyACM-sim (board N gets PREFIX+N)")
+    parser.add_argument("--write-config", help="write a BRIDGE_CONFIG file for the simulated boards")
+    args = parser.parse_args()
+
+    devices = start_simulators(
+        args.count,
+        baud=args.baud,
+        speech=args.speech,
+        boot=args.boot,
+        reset_on_open=not args.no_reset,
+        echo=not args.no_echo,
+        link=args.link,
+        binary=not args.text_only,
+        usb_latency=args.usb_latency / 1000,
+    )
+    for index, device in enumerate(devices):
+        print(f"🤖 Simulated Arduino {index} on {device.name}")
+    print(f"SERIAL_PORT={','.join(device.name for device in devices)}")
+
+    if args.write_config:
+        with open(args.write_config, "w") as f:
+            json.dump(bridge_config(devices), f, indent=2)
+        print(f"BRIDGE_CONFIG={args.write_config}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+
+if __name__ == "__main__":
+    main()
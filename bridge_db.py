@@ -0,0 +1,116 @@
+"""SQLite persistence for the bridge: the last known light state, named scenes and schedules.
+
+One small database file (WAL mode, so a save never blocks a reader):
+
+    state   one row - the levels last set by hand ({"bulb1": 0-255, ...}), the
+            mode and the effect that was playing ({"name": ..., "speed": ...})
+    scenes  name -> {"bulb1": 0-100, ...} brightness per bulb
+    rules   id -> schedule rule as submitted to /api/schedule
+
+Scenes and rules are also kept in memory, so listing or applying them never
+touches the disk; only saving and deleting do.
+
+    db = StateDatabase("~/.cache/smart-bulbs/bridge.db")
+    db.save_state({"bulb1": 255}, "manual")
+    db.save_scene("evening", {"bulb1": 40, "bulb2": 0})
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    levels TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    effect TEXT,
+    saved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    name TEXT PRIMARY KEY,
+    levels TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rules (
+    id TEXT PRIMARY KEY,
+    spec TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class StateDatabase:
+    """Last known state, scenes and schedule rules in one SQLite file (safe to use from any thread)"""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.scenes = {
+            name: json.loads(levels)
+            for name, levels in self.conn.execute("SELECT name, levels FROM scenes ORDER BY name")
+        }
+        self.rules = {
+            rule_id: json.loads(spec)
+            for rule_id, spec in self.conn.execute("SELECT id, spec FROM rules ORDER BY id")
+        }
+
+    def load_state(self):
+        """{"levels", "mode", "effect", "saved_at"} as last saved, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT levels, mode, effect, saved_at FROM state WHERE id = 1").fetchone()
+        if row is None:
+            return None
+        levels, mode, effect, saved_at = row
+        return {
+            "levels": json.loads(levels),
+            "mode": mode,
+            "effect": json.loads(effect) if effect else None,
+            "saved_at": saved_at,
+        }
+
+    def save_state(self, levels, mode, effect=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO state (id, levels, mode, effect, saved_at) VALUES (1, ?, ?, ?, ?)",
+                (json.dumps(levels), mode, json.dumps(effect) if effect else None, time.time())
+            )
+
+    def save_scene(self, name, levels):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scenes (name, levels, updated_at) VALUES (?, ?, ?)",
+                (name, json.dumps(levels), time.time())
+            )
+            self.scenes[name] = dict(levels)
+
+    def delete_scene(self, name):
+        """Returns False if there was no such scene"""
+        with self.lock:
+            self.conn.execute("DELETE FROM scenes WHERE name = ?", (name,))
+            return self.scenes.pop(name, None) is not None
+
+    def save_rule(self, rule_id, spec):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rules (id, spec, updated_at) VALUES (?, ?, ?)",
+                (rule_id, json.dumps(spec), time.time())
+            )
+            self.rules[rule_id] = dict(spec)
+
+    def delete_rule(self, rule_id):
+        """Returns False if there was no such rule"""
+        with self.lock:
+            self.conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+            return self.rules.pop(rule_id, None) is not None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
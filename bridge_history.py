@@ -0,0 +1,386 @@
+"""Bounded in-memory history of bulb levels and serial round trips (GET /api/history).
+
+Every series is a fixed set of preallocated arrays, so memory stays the same
+however long the bridge runs, and recording a sample overwrites a few numbers
+in place instead of growing anything:
+
+  - a raw ring with the last RAW_SAMPLES (time, value) pairs
+  - rollup tiers: count, sum, min, max and last value per time bucket (1 s
+    for the last hour, 1 min for the last day, 15 min for the last week);
+    a slot is reused once its bucket has aged out
+
+A query picks the coarsest tier whose buckets still fit the requested step
+and merges buckets into windows, so a day at 5 minute steps reads 1440
+buckets and never the samples behind them.
+
+    history = History()
+    history.series("bulb1", level=True).set(100)   # levels: only changes are recorded
+    history.series("rtt:kitchen").add(12.5)        # samples: every one is recorded
+    history.query(["bulb1"], time.time() - 3600, time.time(), 60)
+
+A level series holds its value between changes, so windows without a change
+repeat the last value (with count 0) instead of coming back empty.
+
+HistorySpill appends the samples recorded since its last run to a file, as
+compact binary blocks, and replays that file at startup so a restart does not
+wipe the history.
+"""
+import array
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+RAW_SAMPLES = 4096              # raw (time, value) pairs kept per series
+# (bucket seconds, buckets kept): 1 h, 1 day and 1 week, plus the bucket still filling
+TIERS = ((1, 3601), (60, 1441), (900, 673))
+MAX_WINDOWS = 1000              # most windows one query may ask for
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+BLOCK_MAGIC = b"BHS1"
+BLOCK_HEADER = struct.Struct("<4sHI")   # magic, series in the block, samples in the block
+BLOCK_SERIES = struct.Struct("<BB")     # level flag, name length (the UTF-8 name follows)
+SAMPLE = struct.Struct("<dHf")          # time, series index within the block, value (14 bytes)
+
+logger = logging.getLogger("arduino_api")
+
+
+def parse_duration(text):
+    """Seconds in "90", "90s", "15m", "1h" or "7d" (ValueError otherwise)"""
+    text = str(text).strip().lower()
+    unit = DURATION_UNITS.get(text[-1:])
+    seconds = float(text[:-1] if unit else text) * (unit or 1)
+    if not seconds > 0 or math.isinf(seconds):
+        raise ValueError(f"'{text}' is not a positive duration")
+    return seconds
+
+
+class Tier:
+    """Count, sum, min, max and last value per bucket, in a ring of `slots` buckets `width` seconds wide"""
+    __slots__ = ("width", "slots", "bucket", "count", "total", "low", "high", "last")
+
+    def __init__(self, width, slots):
+        self.width = width
+        self.slots = slots
+        self.bucket = array.array("q", [-1]) * slots     # which bucket each slot holds now
+        self.count = array.array("I", [0]) * slots
+        self.total = array.array("d", [0.0]) * slots
+        self.low = array.array("d", [0.0]) * slots
+        self.high = array.array("d", [0.0]) * slots
+        self.last = array.array("d", [0.0]) * slots
+
+    def add(self, when, value):
+        bucket = int(when // self.width)
+        slot = bucket % self.slots
+        held = self.bucket[slot]
+        if held != bucket:
+            if bucket < held:
+                return          # older than the bucket the slot has moved on to (clock went back)
+            self.bucket[slot] = bucket
+            self.count[slot] = 1
+            self.total[slot] = self.low[slot] = self.high[slot] = self.last[slot] = value
+            return
+        self.count[slot] += 1
+        self.total[slot] += value
+        self.last[slot] = value
+        if value < self.low[slot]:
+            self.low[slot] = value
+        elif value > self.high[slot]:
+            self.high[slot] = value
+
+    def value_before(self, bucket):
+        """Last value recorded before `bucket`, looking back as far as the tier reaches"""
+        for previous in range(bucket - 1, bucket - self.slots, -1):
+            slot = previous % self.slots
+            if self.bucket[slot] == previous:
+                return self.last[slot]
+        return None
+
+
+class Series:
+    """One named history: a raw ring and its rollup tiers (safe to append from any thread)"""
+    __slots__ = ("name", "level", "lock", "times", "values", "count", "last", "tiers", "spilled")
+
+    def __init__(self, name, level=False, raw=RAW_SAMPLES, tiers=TIERS):
+        self.name = name
+        self.level = level              # a level holds between samples; a sample stands alone
+        self.lock = threading.Lock()
+        self.times = array.array("d", [0.0]) * raw
+        self.values = array.array("d", [0.0]) * raw
+        self.count = 0                  # samples ever recorded (the ring keeps the last `raw`)
+        self.last = None
+        self.tiers = [Tier(width, slots) for width, slots in tiers]
+        self.spilled = 0                # count when HistorySpill last copied this series
+
+    def add(self, value, when=None):
+        """Record a sample"""
+        when = time.time() if when is None else when
+        with self.lock:
+            self._append(when, value)
+
+    def set(self, value, when=None):
+        """Record a level if it differs from the last one"""
+        when = time.time() if when is None else when
+        with self.lock:
+            if value != self.last:
+                self._append(when, value)
+
+    def _append(self, when, value):
+        slot = self.count % len(self.times)
+        self.times[slot] = when
+        self.values[slot] = value
+        self.count += 1
+        self.last = value
+        for tier in self.tiers:
+            tier.add(when, value)
+
+    def raw_oldest(self):
+        """Time of the oldest sample still in the raw ring (0 while nothing was overwritten)"""
+        if self.count <= len(self.times):
+            return 0.0
+        return self.times[self.count % len(self.times)]
+
+    def recent(self, since):
+        """[(time, value)] from the raw ring since `since`, oldest first"""
+        size = len(self.times)
+        samples = []
+        for index in range(self.count - 1, max(self.count - size, 0) - 1, -1):
+            when = self.times[index % size]
+            if when < since:
+                break
+            samples.append((when, self.values[index % size]))
+        samples.reverse()
+        return samples
+
+    def windows(self, start, step, count, resolution):
+        """[[window start, min, max, avg, count]] for `count` windows of `step` seconds from `start`.
+
+        `resolution` is the tier bucket width to merge (a divisor of step and start), or 0 for the raw ring.
+        """
+        counts = [0] * count
+        totals = [0.0] * count
+        lows = [math.inf] * count
+        highs = [-math.inf] * count
+        finals = [None] * count
+        before = None
+        end = start + step * count
+        with self.lock:
+            if resolution:
+                tier = next(tier for tier in self.tiers if tier.width == resolution)
+                first = int(start // resolution)
+                last = int(end // resolution)
+                # Buckets older than the tier keeps are gone; don't walk a long range to find that out
+                for bucket in range(max(first, last - tier.slots), last):
+                    slot = bucket % tier.slots
+                    if tier.bucket[slot] != bucket:
+                        continue
+                    k = int((bucket - first) * resolution // step)
+                    counts[k] += tier.count[slot]
+                    totals[k] += tier.total[slot]
+                    lows[k] = min(lows[k], tier.low[slot])
+                    highs[k] = max(highs[k], tier.high[slot])
+                    finals[k] = tier.last[slot]
+                if self.level:
+                    before = tier.value_before(first)
+            else:
+                samples = self.recent(start)
+                if self.level:
+                    size = len(self.times)
+                    index = self.count - len(samples) - 1
+                    if index >= max(self.count - size, 0):
+                        before = self.values[index % size]
+                for when, value in samples:
+                    k = int((when - start) // step)
+                    if k >= count:
+                        break
+                    counts[k] += 1
+                    totals[k] += value
+                    lows[k] = min(lows[k], value)
+                    highs[k] = max(highs[k], value)
+                    finals[k] = value
+
+        rows = []
+        held = before
+        for k in range(count):
+            when = round(start + k * step, 3)
+            if counts[k]:
+                rows.append([when, round(lows[k], 3), round(highs[k], 3), round(totals[k] / counts[k], 3), counts[k]])
+                held = finals[k]
+            elif self.level and held is not None:
+                rows.append([when, held, held, held, 0])
+            else:
+                rows.append([when, None, None, None, 0])
+        return rows
+
+
+class History:
+    """Named series, created on first use"""
+
+    def __init__(self, raw=RAW_SAMPLES, tiers=TIERS):
+        self.raw = raw
+        self.tiers = tiers
+        self.lock = threading.Lock()
+        self.by_name = {}
+
+    def series(self, name, level=False):
+        series = self.by_name.get(name)
+        if series is None:
+            with self.lock:
+                series = self.by_name.get(name)
+                if series is None:
+                    series = self.by_name[name] = Series(name, level, self.raw, self.tiers)
+        return series
+
+    def names(self):
+        return sorted(self.by_name)
+
+    def resolution(self, series, start, step, now):
+        """Bucket width to answer from: the coarsest tier no wider than `step` that reaches back
+        to `start`, else the raw ring for steps finer than every tier (if it reaches back that far),
+        else the finest tier that reaches"""
+        reaching = [width for width, slots in self.tiers
+                    if start >= (int(now // width) - slots + 1) * width]
+        fitting = [width for width in reaching if width <= step]
+        if fitting:
+            return max(fitting)
+        if step < min(width for width, _ in self.tiers) and all(s.raw_oldest() <= start for s in series):
+            return 0
+        return min(reaching) if reaching else max(width for width, _ in self.tiers)
+
+    def query(self, names, start, end, step, now=None):
+        """Downsampled windows of each named series (KeyError for an unknown name).
+
+        Returns {"start", "end", "step", "resolution", "series": {name: rows}} where the step is
+        rounded to whole buckets and start is aligned to it (which may add one window); resolution 0
+        means the windows come from raw samples. ValueError if the range holds more than
+        MAX_WINDOWS steps.
+        """
+        asked = math.ceil((end - start) / step)
+        if asked > MAX_WINDOWS:
+            raise ValueError(f"{asked} windows of {step:g}s, at most {MAX_WINDOWS}: use a larger step")
+        series = [self.by_name[name] for name in names]
+        now = time.time() if now is None else now
+        resolution = self.resolution(series, start, step, now)
+        # Rounding the step to whole buckets must not make it more than MAX_WINDOWS windows
+        if resolution:
+            step = max(resolution, round(step / resolution) * resolution)
+            step = max(step, math.ceil((end - start) / MAX_WINDOWS / resolution) * resolution)
+        start = math.floor(start / step) * step
+        count = max(1, math.ceil((end - start) / step))
+        return {
+            "start": start,
+            "end": start + count * step,
+            "step": step,
+            "resolution": resolution,
+            "series": {s.name: s.windows(start, step, count, resolution) for s in series},
+        }
+
+
+class HistorySpill:
+    """Append what each series recorded since the last spill to `path`, and replay it at startup.
+
+    Each spill is one block: BLOCK_HEADER, then per series its level flag and
+    name, then SAMPLE records (14 bytes each). When the file passes max_bytes it
+    is moved to path + ".1" (replacing the one before), so disk use is bounded too.
+    """
+
+    def __init__(self, history, path, interval=60.0, max_bytes=16 << 20):
+        self.history = history
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.thread = None
+        self.lost = 0           # samples that left the raw ring before they were spilled
+
+    def load(self):
+        """Replay the spill files into the history (call before anything is recorded), returns samples read"""
+        loaded = 0
+        for path in (self.path + ".1", self.path):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            loaded += self._replay(data)
+        for series in list(self.history.by_name.values()):
+            series.spilled = series.count
+        return loaded
+
+    def _replay(self, data):
+        offset = 0
+        loaded = 0
+        while offset + BLOCK_HEADER.size <= len(data):
+            magic, series_count, sample_count = BLOCK_HEADER.unpack_from(data, offset)
+            if magic != BLOCK_MAGIC:
+                break           # torn or foreign data: keep what was read so far
+            offset += BLOCK_HEADER.size
+            block = []
+            for _ in range(series_count):
+                level, length = BLOCK_SERIES.unpack_from(data, offset)
+                offset += BLOCK_SERIES.size
+                name = data[offset:offset + length].decode()
+                offset += length
+                block.append(self.history.series(name, bool(level)))
+            if offset + sample_count * SAMPLE.size > len(data):
+                break
+            for when, index, value in SAMPLE.iter_unpack(data[offset:offset + sample_count * SAMPLE.size]):
+                block[index].add(value, when)
+            offset += sample_count * SAMPLE.size
+            loaded += sample_count
+        return loaded
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="history-spill", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.spill()
+
+    def spill(self):
+        """Write the samples recorded since the last spill, returns how many"""
+        with self.lock:
+            names = bytearray()
+            records = bytearray()
+            written = 0
+            done = {}               # series -> its count once this block is on disk
+            lost = 0
+            for series in list(self.history.by_name.values()):
+                with series.lock:
+                    size = len(series.times)
+                    first = max(series.spilled, series.count - size)
+                    if first == series.count:
+                        continue
+                    lost += first - series.spilled
+                    index = written
+                    for n in range(first, series.count):
+                        records += SAMPLE.pack(series.times[n % size], index, series.values[n % size])
+                    done[series] = series.count
+                name = series.name.encode()
+                names += BLOCK_SERIES.pack(int(series.level), len(name)) + name
+                written += 1
+            if not written:
+                return 0
+            count = len(records) // SAMPLE.size
+            block = BLOCK_HEADER.pack(BLOCK_MAGIC, written, count) + names + records
+            try:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(block) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "ab") as f:
+                    f.write(block)
+            except OSError as e:
+                # Nothing counts as spilled: the next run writes these samples (if still in the ring)
+                logger.warning("⚠️ Could not write history to %s: %s", self.path, e)
+                return 0
+            for series, spilled in done.items():
+                with series.lock:
+                    series.spilled = spilled
+            self.lost += lost
+            return count
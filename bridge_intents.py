@@ -0,0 +1,333 @@
+"""Voice/text intent engine for the bridge: a spoken or typed phrase in, batch operations out.
+
+The vocabulary (bulb names and numbers, controller names as groups, effects,
+actions, spelled-out numbers) is compiled once into a trie over words, so a
+phrase is read in one left-to-right pass with a dict lookup per word. Words
+the trie does not know are corrected to the closest known word (one typo or
+mis-heard letter) through a precomputed deletion index, without scanning the
+vocabulary.
+
+    engine = IntentEngine({1: [], 2: ["desk lamp"]}, groups={"kitchen": [1, 2]})
+    engine.parse("turn light two to fifty percent").operations
+    # -> [{"bulb": 2, "action": "brightness", "value": 50}]
+
+Operations have the shape POST /api/batch takes. Phrases may chain clauses
+with "and" / "then" ("light one on and light two off").
+"""
+import re
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {"twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90}
+LEVEL_WORDS = {"half": 50, "quarter": 25, "full": 100, "max": 100, "maximum": 100}
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7,
+    "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12,
+}
+
+# (phrase, tag, value) - the fixed part of the vocabulary
+PHRASES = [
+    *(("on", "action", "on"), ("enable", "action", "on"), ("light up", "action", "on")),
+    *(("off", "action", "off"), ("disable", "action", "off"), ("out", "action", "off")),
+    *(("stop", "action", "stop"), ("end", "action", "stop"), ("cancel", "action", "stop")),
+    *(("dim", "action", "dim"), ("dimmer", "action", "dim"), ("lower", "action", "dim")),
+    *(("brighten", "action", "brighten"), ("brighter", "action", "brighten"), ("raise", "action", "brighten")),
+    *((word, "noun", None) for word in ("light", "lights", "lite", "bulb", "bulbs", "lamp", "lamps", "number")),
+    *((word, "all", None) for word in ("all", "every", "everything", "both", "whole house")),
+    *((word, "percent", None) for word in ("percent", "per cent", "%")),
+    *((word, "to", None) for word in ("to", "at", "brightness", "level")),
+    *((word, "conj", None) for word in ("and", "then", "also", ",")),
+    *(("slow", "speed", 1), ("slowly", "speed", 1), ("slower", "speed", 1), ("slowest", "speed", 1)),
+    *(("normal", "speed", 2), ("medium", "speed", 2)),
+    *(("fast", "speed", 4), ("quick", "speed", 4), ("quickly", "speed", 4), ("faster", "speed", 4)),
+    *(("very fast", "speed", 5), ("fastest", "speed", 5), ("full speed", "speed", 5)),
+    ("speed", "speed_word", None),
+    ("a hundred", "number", 100), ("hundred", "number", 100),
+    *((word, "number", value) for word, value in {**UNITS, **TENS, **LEVEL_WORDS}.items()),
+    *((word, "ordinal", value) for word, value in ORDINALS.items()),
+]
+EFFECT_WORDS = {
+    "strobe": ("strobe", "strobing", "flash", "flashing"),
+    "fade": ("fade", "fading"),
+    "pulse": ("pulse", "pulsing", "breathe", "breathing"),
+    "alternate": ("alternate", "alternating", "chase"),
+    "rainbow": ("rainbow", "colors", "colours", "color cycle"),
+}
+DIM_LEVEL = 25                  # "dim the lights" without a number
+FUZZY_MIN_LENGTH = 4            # shorter words are too easily confused ("of" / "off", "on" / "one")
+FUZZY_CACHE_SIZE = 4096
+
+TOKEN_RE = re.compile(r"\d+|[a-z]+|%|,")
+ORDINAL_DIGITS_RE = re.compile(r"(\d+)(?:st|nd|rd|th)\b")
+
+
+class Intent:
+    """What a phrase asks for: batch operations, plus the words that were corrected or ignored.
+
+    A phrase naming a bulb number the registry does not have ("light 7" with
+    three bulbs) has no operations; the numbers are listed in `unknown`.
+    """
+    __slots__ = ("text", "operations", "corrections", "ignored", "unknown")
+
+    def __init__(self, text, operations, corrections, ignored, unknown=()):
+        self.text = text
+        self.operations = operations
+        self.corrections = corrections      # {heard: understood as}
+        self.ignored = ignored              # words with no meaning here ("please", "the", ...)
+        self.unknown = list(unknown)        # bulb numbers named that do not exist
+
+    def view(self):
+        return {"text": self.text, "operations": self.operations,
+                "corrections": self.corrections, "ignored": self.ignored, "unknown": self.unknown}
+
+
+class _Clause:
+    __slots__ = ("action", "bulbs", "all", "value", "effect", "speed")
+
+    def __init__(self):
+        self.action = None
+        self.bulbs = []
+        self.all = False
+        self.value = None
+        self.effect = None
+        self.speed = None
+
+
+def _deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _edit_distance(a, b):
+    """Levenshtein distance counting a swap of neighbouring letters as one edit"""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class IntentEngine:
+    """Phrase -> batch operations for one registry of bulbs (rebuild it if the registry changes)"""
+
+    def __init__(self, bulbs, groups=None, effects=EFFECT_WORDS):
+        """bulbs: {bulb id: [extra names]}, groups: {name: [bulb ids]}, effects: {effect: (words...)}"""
+        self.bulb_ids = frozenset(bulbs)
+        self.trie = {}
+        for phrase, tag, value in PHRASES:
+            self._add(phrase, tag, value)
+        for effect, words in effects.items():
+            for word in words:
+                self._add(word, "effect", effect)
+        for bulb_id, names in bulbs.items():
+            for name in names:
+                self._add(name, "bulbs", (bulb_id,))
+        for name, bulb_ids in (groups or {}).items():
+            self._add(name, "bulbs", tuple(bulb_ids))
+
+        # Deletion index for typo correction: every known word and its one-letter deletions
+        self.fuzzy_index = {}
+        for word in self.trie:
+            if len(word) >= FUZZY_MIN_LENGTH:
+                for key in {word} | _deletions(word):
+                    self.fuzzy_index.setdefault(key, []).append(word)
+        self.fuzzy_cache = {}
+
+    def _add(self, phrase, tag, value):
+        node = self.trie
+        for word in self._words(phrase.replace("-", " ")):
+            node = node.setdefault(word, {})
+        node[None] = (tag, value)
+
+    # ----- words -----
+
+    def _correct(self, word):
+        """Closest known word within one edit (insert, delete, substitute, swap), or None"""
+        if word in self.fuzzy_cache:
+            return self.fuzzy_cache[word]
+        best = None
+        if len(word) >= FUZZY_MIN_LENGTH:
+            candidates = set(self.fuzzy_index.get(word, ()))
+            for key in _deletions(word):
+                candidates.update(self.fuzzy_index.get(key, ()))
+            # Closest first, then the same first letter, then the alphabetically first
+            ranked = sorted(candidates, key=lambda c: (_edit_distance(word, c), c[0] != word[0], c))
+            best = ranked[0] if ranked else None
+        if len(self.fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self.fuzzy_cache.clear()
+        self.fuzzy_cache[word] = best
+        return best
+
+    def _words(self, text):
+        text = ORDINAL_DIGITS_RE.sub(lambda m: f" #{m.group(1)} ", text.lower())
+        words = []
+        for part in text.split():
+            if part.startswith("#") and part[1:].isdigit():
+                words.append(part)          # ordinal written with digits ("2nd")
+            else:
+                words.extend(TOKEN_RE.findall(part))
+        return words
+
+    def _tokens(self, words, corrections, ignored):
+        """Longest trie matches, left to right: [(tag, value)]"""
+        tokens = []
+        i = 0
+        while i < len(words):
+            word = words[i]
+            if word.isdigit():
+                tokens.append(("number", int(word)))
+                i += 1
+                continue
+            if word.startswith("#"):
+                tokens.append(("ordinal", int(word[1:])))
+                i += 1
+                continue
+            node, match, end = self.trie, None, i
+            corrected_here, kept = [], 0
+            j = i
+            while j < len(words):
+                child = node.get(words[j])
+                if child is None:
+                    corrected = self._correct(words[j]) if words[j] not in self.trie else None
+                    child = node.get(corrected) if corrected else None
+                    if child is None:
+                        break
+                    corrected_here.append((words[j], corrected))
+                node = child
+                j += 1
+                if None in node:
+                    match, end, kept = node[None], j, len(corrected_here)
+            if match is None:
+                ignored.append(word)
+                i += 1
+            else:
+                corrections.update(corrected_here[:kept])
+                tokens.append(match)
+                i = end
+        return self._numbers(tokens)
+
+    @staticmethod
+    def _numbers(tokens):
+        """Join spelled-out numbers: "fifty five" -> 55, "one hundred" -> 100"""
+        joined = []
+        for tag, value in tokens:
+            if tag == "number" and joined and joined[-1][0] == "number":
+                previous = joined[-1][1]
+                if value == 100 and previous == 1:
+                    joined[-1] = ("number", 100)
+                    continue
+                if previous in TENS.values() and 1 <= value <= 9:
+                    joined[-1] = ("number", previous + value)
+                    continue
+            joined.append((tag, value))
+        return joined
+
+    # ----- clauses -----
+
+    def parse(self, text, bulb=None):
+        """Intent of a phrase; `bulb` is the bulb meant when the phrase names none"""
+        corrections, ignored = {}, []
+        tokens = self._tokens(self._words(text), corrections, ignored)
+        operations, unknown = [], []
+        clause = _Clause()
+        expect_id = False           # after "light" a number is a bulb id, until something else comes
+        last = None                 # tag of the previous token
+        for index, (tag, value) in enumerate(tokens):
+            following = tokens[index + 1][0] if index + 1 < len(tokens) else None
+            if tag == "conj":
+                # "light one and two" keeps going; anything else starts a new clause
+                if last not in ("bulb_id", "bulbs") or following not in ("number", "ordinal", "bulbs", "noun"):
+                    self._finish(clause, operations, bulb)
+                    clause = _Clause()
+                    expect_id = False
+                else:
+                    continue
+                last = tag
+                continue
+
+            if tag in ("noun", "bulbs", "all", "ordinal") and last == "action" and (clause.bulbs or clause.all):
+                # "light one on light two off" - no "and" between the clauses
+                self._finish(clause, operations, bulb)
+                clause = _Clause()
+
+            if tag == "number":
+                # A number right after "light" names a bulb, whether or not the bulb exists
+                as_id = following != "percent" and (
+                    expect_id or (last == "conj" and (clause.bulbs or following == "to"))
+                    or (clause.action in ("on", "off") and not clause.bulbs and not clause.all
+                        and following != "to" and last != "to"))
+                if last == "speed_word" and 1 <= value <= 5:
+                    clause.speed = value
+                elif as_id:
+                    if value in self.bulb_ids:
+                        clause.bulbs.append(value)
+                    else:
+                        unknown.append(value)
+                    tag = "bulb_id"
+                else:
+                    clause.value = min(value, 100)
+                    expect_id = False
+            elif tag == "ordinal":
+                if value in self.bulb_ids:
+                    clause.bulbs.append(value)
+                else:
+                    unknown.append(value)
+                tag = "bulb_id"
+            elif tag == "noun":
+                expect_id = True
+            elif tag == "bulbs":
+                clause.bulbs.extend(value)
+            elif tag == "all":
+                clause.all = True
+            elif tag == "to":
+                expect_id = False
+            elif tag == "action":
+                clause.action = value
+            elif tag == "effect":
+                clause.effect = value
+            elif tag == "speed":
+                clause.speed = value
+            last = tag
+        self._finish(clause, operations, bulb)
+        if unknown:
+            operations = []         # never fall back to some other bulb, or to all of them
+        return Intent(text, operations, corrections, ignored, unknown)
+
+    @staticmethod
+    def _finish(clause, operations, default_bulb):
+        if clause.action == "stop" or (clause.effect is not None and clause.action == "off"):
+            operations.append({"effect": "stop"})      # "stop", "turn the strobe off"
+            return
+        if clause.effect is not None and clause.value is None:
+            operation = {"effect": clause.effect}
+            if clause.speed is not None:
+                operation["speed"] = clause.speed
+            operations.append(operation)
+            return
+
+        value = clause.value
+        if value is None and clause.action == "dim":
+            value = DIM_LEVEL
+        elif value is None and clause.action == "brighten":
+            value = 100
+        if value is not None:
+            fields = {"action": "brightness", "value": value}
+        elif clause.action in ("on", "off"):
+            fields = {"action": clause.action}
+        else:
+            return                  # nothing to do ("light two", "please")
+
+        bulbs = [] if clause.all else list(dict.fromkeys(clause.bulbs))
+        if not bulbs and not clause.all and default_bulb is not None:
+            bulbs = [default_bulb]
+        if bulbs:
+            operations.extend({"bulb": bulb_id, **fields} for bulb_id in bulbs)
+        else:
+            operations.append(dict(fields))
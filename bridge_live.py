@@ -0,0 +1,87 @@
+"""Jitter buffer for client-driven light shows (WebSocket /api/live).
+
+A client streams binary frames: a 12 byte header (sequence number, the
+client's send time in milliseconds on any clock it likes) followed by one
+PWM byte (0-255) per bulb. Frames reach the bridge with network jitter; the
+buffer plays them back at the client's own spacing, a fixed delay later, and
+when the serial link cannot keep up only the newest frame that is due gets
+played. Older ones are dropped, never queued, so latency stays bounded.
+
+    buffer = JitterBuffer(delay=0.03)
+    buffer.push(LiveFrame.parse(message, bulbs=3), time.monotonic())
+    frame, skipped = buffer.pop_due(time.monotonic())
+
+A frame plays at client time + offset + delay. The offset is the smallest
+(arrival - client time) seen over the last OFFSET_WINDOW frames: the frame
+that got through fastest shows the path's base latency, and a sliding
+minimum follows clock drift between the two ends.
+"""
+import collections
+import struct
+
+FRAME_HEADER = struct.Struct("<Id")     # sequence number, client send time (ms)
+OFFSET_WINDOW = 64          # frames the clock offset is estimated over
+BUFFER_FRAMES = 8           # frames held at most; the oldest goes when a new one arrives
+
+
+class LiveFrame:
+    """One frame from the client: PWM per bulb (bulb order) and when it arrived"""
+    __slots__ = ("seq", "client_time", "levels", "arrived", "play_at")
+
+    def __init__(self, seq, client_time, levels):
+        self.seq = seq
+        self.client_time = client_time
+        self.levels = levels
+        self.arrived = None
+        self.play_at = None
+
+    @classmethod
+    def parse(cls, data, bulbs):
+        if len(data) != FRAME_HEADER.size + bulbs:
+            raise ValueError(f"Frame needs {FRAME_HEADER.size} header bytes and {bulbs} levels, got {len(data)} bytes")
+        seq, client_time = FRAME_HEADER.unpack_from(data)
+        return cls(seq, client_time, data[FRAME_HEADER.size:])
+
+
+class JitterBuffer:
+    """Frames waiting for their playout time (the event loop's only, not thread-safe)"""
+
+    def __init__(self, delay, capacity=BUFFER_FRAMES, window=OFFSET_WINDOW):
+        self.delay = delay
+        self.frames = collections.deque()
+        self.capacity = capacity
+        self.offsets = collections.deque(maxlen=window)
+        self.last_seq = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, frame, now):
+        """Buffer a frame that arrived at `now` (monotonic seconds), returns how many frames were dropped"""
+        # Sequence numbers wrap at 2^32; anything not ahead of the last one is a duplicate or stale
+        if self.last_seq is not None and not 0 < (frame.seq - self.last_seq) % (1 << 32) < (1 << 31):
+            return 1
+        self.last_seq = frame.seq
+        client_time = frame.client_time / 1000.0
+        self.offsets.append(now - client_time)
+        frame.arrived = now
+        frame.play_at = client_time + min(self.offsets) + self.delay
+        dropped = 0
+        if len(self.frames) >= self.capacity:
+            self.frames.popleft()
+            dropped = 1
+        self.frames.append(frame)
+        return dropped
+
+    def next_due(self):
+        """Play time of the earliest buffered frame, None if empty"""
+        return self.frames[0].play_at if self.frames else None
+
+    def pop_due(self, now):
+        """(newest frame due by `now` or None, how many older due frames it replaced)"""
+        frame = None
+        skipped = -1
+        while self.frames and self.frames[0].play_at <= now:
+            frame = self.frames.popleft()
+            skipped += 1
+        return frame, max(skipped, 0)
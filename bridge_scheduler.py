@@ -0,0 +1,317 @@
+"""In-process scheduler for the bridge: cron-like rules, one-shot timers and ramps.
+
+Every job sits in one heap ordered by due time (Unix seconds). A single thread
+sleeps until the earliest job is due, works out when that job runs next, and
+hands the work itself to a small thread pool, so thousands of rules cost one
+heap entry each and a job that waits on the serial port never delays the rest.
+
+    scheduler = Scheduler()
+    scheduler.add(Rule("wake", action, cron=CronSpec.parse("30 6 * * 1-5")))
+    scheduler.add(Ramp("fade", {"bulb1": 0}, {"bulb1": 255}, time.time(), 600, send))
+    scheduler.start()
+
+A Ramp does not tick at a fixed rate: it is due exactly when the next PWM value
+of some bulb changes, so a 10 minute fade from 0 to 255 is 255 writes.
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("arduino_api")
+
+CRON_FIELDS = (           # (name, lowest, highest)
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),    # 0 and 7 are both Sunday
+)
+CRON_SEARCH_YEARS = 5     # give up on expressions that never match (e.g. 30 February)
+
+
+def _parse_cron_field(text, lowest, highest):
+    values = set()
+    for part in text.split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = lowest, highest
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        if step < 1 or not lowest <= start <= end <= highest:
+            raise ValueError(f"'{text}' is out of range {lowest}-{highest}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSpec:
+    """A five-field cron expression (minute hour day month weekday) in local time.
+
+    Fields take *, numbers, ranges (1-5), lists (1,15) and steps (*/10, 8-18/2).
+    Like cron, a rule restricting both day and weekday runs when either matches.
+    """
+    __slots__ = ("text", "minutes", "hours", "days", "months", "weekdays", "any_day", "any_weekday")
+
+    def __init__(self, text, minutes, hours, days, months, weekdays, any_day, any_weekday):
+        self.text = text
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = weekdays
+        self.any_day = any_day
+        self.any_weekday = any_weekday
+
+    @classmethod
+    def parse(cls, text):
+        fields = text.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression needs {len(CRON_FIELDS)} fields, got '{text}'")
+        try:
+            parsed = [_parse_cron_field(field, lowest, highest)
+                      for field, (_, lowest, highest) in zip(fields, CRON_FIELDS)]
+        except ValueError as e:
+            raise ValueError(f"Bad cron expression '{text}': {e}") from None
+        minutes, hours, days, months, weekdays = parsed
+        # Python counts Monday as 0; cron counts Sunday as 0 (and 7)
+        weekdays = frozenset((day - 1) % 7 for day in weekdays)
+        return cls(" ".join(fields), minutes, hours, days, months, weekdays,
+                   fields[2] == "*", fields[4] == "*")
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = moment.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, when):
+        """First matching minute strictly after `when` (Unix seconds), as Unix seconds.
+
+        Skips whole months, days and hours that cannot match, so even a yearly
+        rule takes a few dozen steps.
+        """
+        moment = datetime.datetime.fromtimestamp(when).replace(second=0, microsecond=0)
+        moment += datetime.timedelta(minutes=1)
+        last_year = moment.year + CRON_SEARCH_YEARS
+        while moment.year <= last_year:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"Cron expression '{self.text}' never matches")
+
+
+class Rule:
+    """Calls action(rule) on a cron schedule, or once at a fixed time"""
+    __slots__ = ("id", "action", "cron", "at", "due", "cancelled")
+
+    def __init__(self, rule_id, action, cron=None, at=None):
+        if (cron is None) == (at is None):
+            raise ValueError("A rule needs either a cron expression or a time")
+        self.id = rule_id
+        self.action = action
+        self.cron = cron
+        self.at = at
+        self.due = None
+        self.cancelled = False
+
+    def first_due(self, now):
+        return self.cron.next_after(now) if self.cron is not None else self.at
+
+    def next_due(self, now):
+        return self.cron.next_after(now) if self.cron is not None else None
+
+    def fire(self, now):
+        self.action(self)
+
+
+class Ramp:
+    """Fade levels ({key: 0-255}) from start to end over `duration` seconds.
+
+    Each value moves in whole PWM steps, and the ramp is only due when at
+    least one of them changes (but no more often than min_interval), so
+    nothing is sent for steps that would not change a value. If current()
+    shows that something else changed a level since the ramp set it, that key
+    is left alone from then on.
+    """
+    __slots__ = ("id", "start", "end", "started_at", "duration", "send", "current",
+                 "min_interval", "sent", "due", "cancelled", "lock", "send_lock", "writes")
+
+    def __init__(self, ramp_id, start, end, started_at, duration, send, current=None, min_interval=0.05):
+        self.id = ramp_id
+        self.start = {key: start.get(key, 0) for key in end}
+        self.end = dict(end)
+        self.started_at = started_at
+        self.duration = max(duration, 1e-3)
+        self.send = send                # send({key: pwm}) - may block on the serial port
+        self.current = current          # current() -> {key: pwm}, to notice manual overrides
+        self.min_interval = min_interval
+        self.sent = dict(self.start)    # last value written per key still being ramped
+        self.due = None
+        self.cancelled = False
+        self.lock = threading.Lock()         # guards `sent`, never held while sending
+        self.send_lock = threading.Lock()    # keeps this ramp's writes in order
+        self.writes = 0
+
+    def value(self, key, now):
+        """PWM of one key at time `now` (whole steps, reaching the end value exactly)"""
+        start, end = self.start[key], self.end[key]
+        progress = min(max((now - self.started_at) / self.duration, 0.0), 1.0)
+        steps = int(abs(end - start) * progress + 1e-9)
+        return start + steps if end >= start else start - steps
+
+    def _next_change(self, now):
+        """When the next PWM value changes after `now`, None once every key has reached its end"""
+        due = None
+        for key in list(self.sent):
+            span = abs(self.end[key] - self.start[key])
+            done = abs(self.value(key, now) - self.start[key])
+            if done < span:
+                change_at = self.started_at + self.duration * (done + 1) / span
+                due = change_at if due is None else min(due, change_at)
+        return due
+
+    def first_due(self, now):
+        return self._next_change(now)
+
+    def next_due(self, now):
+        """Called as the ramp fires at `now` (that run sends the values due by then)"""
+        due = self._next_change(now)
+        return None if due is None else max(due, now + self.min_interval)
+
+    def fire(self, now):
+        with self.send_lock:
+            with self.lock:
+                if self.current is not None:
+                    current = self.current()
+                    for key in [key for key in self.sent if current.get(key, self.sent[key]) != self.sent[key]]:
+                        del self.sent[key]
+                changes = {}
+                for key, sent in self.sent.items():
+                    value = self.value(key, now)
+                    if value != sent:
+                        changes[key] = self.sent[key] = value
+            if changes:
+                self.writes += 1
+                self.send(changes)
+
+    def release(self, keys=None):
+        """Stop ramping these keys (all if None); the ramp ends once none are left"""
+        with self.lock:
+            for key in list(self.sent) if keys is None else keys:
+                self.sent.pop(key, None)
+
+    def progress(self, now):
+        return round(min(max((now - self.started_at) / self.duration, 0.0), 1.0), 3)
+
+
+class Scheduler:
+    """Heap of jobs (Rule, Ramp, or anything with id/due/cancelled, first_due(), next_due() and
+    fire()) run by one thread, with the work done on a small pool"""
+
+    def __init__(self, workers=4, clock=time.time, max_sleep=30.0, observe_lateness=None):
+        self.clock = clock
+        self.max_sleep = max_sleep      # re-check at least this often (wall clock jumps, DST)
+        self.observe_lateness = observe_lateness
+        self.heap = []                  # (due, order, job); stale entries are skipped when popped
+        self.jobs = {}                  # id -> job
+        self.order = itertools.count()
+        self.changed = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="schedule")
+        self.thread = None
+        self.fired = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def add(self, job, due=None):
+        """Schedule a job (replacing any job with the same id), returns its first due time
+        (None if it has nothing to do)"""
+        due = job.first_due(self.clock()) if due is None else due
+        if due is None:
+            self.cancel(job.id)
+            return None
+        with self.changed:
+            previous = self.jobs.get(job.id)
+            if previous is not None and previous is not job:
+                previous.cancelled = True
+            self.jobs[job.id] = job
+            self._push(job, due)
+        return due
+
+    def cancel(self, job_id):
+        """Drop a job, returns False if there was none"""
+        with self.changed:
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                return False
+            job.cancelled = True
+            return True
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def _push(self, job, due):
+        job.due = due
+        heapq.heappush(self.heap, (due, next(self.order), job))
+        if self.heap[0][2] is job:
+            self.changed.notify()
+
+    def _next(self):
+        """Wait for the earliest live job to be due, pop it"""
+        with self.changed:
+            while True:
+                while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] != self.heap[0][2].due):
+                    heapq.heappop(self.heap)
+                now = self.clock()
+                if self.heap and self.heap[0][0] <= now:
+                    due, _, job = heapq.heappop(self.heap)
+                    return job, due, now
+                wait = min(self.heap[0][0] - now, self.max_sleep) if self.heap else self.max_sleep
+                self.changed.wait(wait)
+
+    def _run(self):
+        while True:
+            job, due, now = self._next()
+            if self.observe_lateness is not None:
+                self.observe_lateness(now - due)
+            try:
+                next_due = job.next_due(now)
+            except Exception as e:
+                logger.warning("⚠️ Schedule %s: %s", job.id, e)
+                next_due = None
+            with self.changed:
+                if not job.cancelled and self.jobs.get(job.id) is job:
+                    if next_due is None:
+                        del self.jobs[job.id]
+                    else:
+                        self._push(job, next_due)
+            self.fired += 1
+            self.pool.submit(self._fire, job)
+
+    def _fire(self, job):
+        if job.cancelled:
+            return
+        try:
+            job.fire(self.clock())
+        except Exception:
+            logger.exception("❌ Scheduled job %s failed", job.id)
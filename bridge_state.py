@@ -0,0 +1,164 @@
+"""Thread-safe store for the bridge's light state (replaces the global current_state dict).
+
+Bulbs are __slots__ records. Every change happens under one lock and bumps a
+version counter, readers get an immutable snapshot together with its version,
+and subscribers are called (outside the lock) after each change. Snapshots are
+cached per version and reuse the dicts of bulbs that did not change, so taking
+one at effect frame rates costs a dict per changed bulb.
+
+    store = StateStore([("bulb1", 9), ("bulb2", 10)])
+    store.set_brightness({"bulb1": 100}, mode="manual")
+    version, state = store.versioned()      # state["bulb1"] == {"state": "on", ...}
+"""
+import threading
+
+
+def diff_state(old, new):
+    """Top-level keys (and changed sub-fields of bulbs) that differ between two snapshots"""
+    changes = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if value == previous:
+            continue
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changes[key] = {k: v for k, v in value.items() if previous.get(k) != v}
+        else:
+            changes[key] = value
+    return changes
+
+
+def pwm_to_percent(pwm):
+    """Convert a 0-255 PWM value back to the 0-100 brightness the API uses"""
+    return round(pwm / 2.55)
+
+
+class BulbState:
+    """One bulb: brightness in percent and whether it is lit"""
+    __slots__ = ("key", "pin", "brightness", "on", "_view")
+
+    def __init__(self, key, pin=None):
+        self.key = key
+        self.pin = pin
+        self.brightness = 0
+        self.on = False
+        self._view = None
+
+    def set(self, brightness, on):
+        """Returns True if anything changed"""
+        if brightness == self.brightness and on == self.on:
+            return False
+        self.brightness = brightness
+        self.on = on
+        self._view = None
+        return True
+
+    def view(self):
+        """The bulb as the API shows it (shared between snapshots until it changes)"""
+        if self._view is None:
+            self._view = {"state": "on" if self.on else "off", "brightness": self.brightness, "pin": self.pin}
+        return self._view
+
+
+class StateStore:
+    """Bulb levels, mode and controller connections behind one lock, with a version counter.
+
+    Snapshots are shared: treat them as read-only.
+    """
+
+    def __init__(self, bulbs=(), controllers=(), on_level=None):
+        self.lock = threading.Lock()
+        self.on_level = on_level        # on_level(key, percent) for each bulb whose brightness changes
+        self.bulbs = {key: BulbState(key, pin) for key, pin in bulbs}
+        self.mode = "manual"
+        self.strobe_speed = 2
+        self.controllers = {name: {"connected": False, "port": None, "protocol": "text", "window": 1}
+                            for name in controllers}
+        self.connected = False
+        self.version = 0
+        self.subscribers = []
+        self._snapshot = None
+        self._snapshot_version = -1
+
+    # ----- reads -----
+
+    def versioned(self):
+        """(version, snapshot) read atomically"""
+        with self.lock:
+            if self._snapshot_version != self.version:
+                snapshot = {key: bulb.view() for key, bulb in self.bulbs.items()}
+                snapshot["mode"] = self.mode
+                snapshot["strobe_speed"] = self.strobe_speed
+                snapshot["connected"] = self.connected
+                snapshot["controllers"] = self.controllers
+                self._snapshot = snapshot
+                self._snapshot_version = self.version
+            return self.version, self._snapshot
+
+    def snapshot(self):
+        return self.versioned()[1]
+
+    def bulb(self, key):
+        """(version, one bulb's view)"""
+        with self.lock:
+            return self.version, self.bulbs[key].view()
+
+    # ----- writes -----
+
+    def set_brightness(self, levels, mode=None):
+        """Set bulbs to {key: percent} (lit above 0), optionally switching the mode in the same change"""
+        return self._apply(((key, brightness, brightness > 0) for key, brightness in levels.items()), mode)
+
+    def set_pwm(self, levels, mode=None):
+        """Record {key: 0-255} levels the board reported"""
+        return self._apply(((key, pwm_to_percent(pwm), pwm > 0) for key, pwm in levels.items()), mode)
+
+    def set_mode(self, mode, strobe_speed=None):
+        return self._apply((), mode, strobe_speed)
+
+    def set_controllers(self, controllers):
+        """Replace the per-controller connection info; connected = every controller is up"""
+        with self.lock:
+            connected = all(info["connected"] for info in controllers.values())
+            if controllers == self.controllers and connected == self.connected:
+                return False
+            self.controllers = controllers
+            self.connected = connected
+            self.version += 1
+        self._notify()
+        return True
+
+    def _apply(self, bulbs, mode=None, strobe_speed=None):
+        changed = False
+        with self.lock:
+            for key, brightness, on in bulbs:
+                bulb = self.bulbs[key]
+                previous = bulb.brightness
+                if bulb.set(brightness, on):
+                    changed = True
+                    if self.on_level is not None and brightness != previous:
+                        self.on_level(key, brightness)
+            if mode is not None and mode != self.mode:
+                self.mode = mode
+                changed = True
+            if strobe_speed is not None and strobe_speed != self.strobe_speed:
+                self.strobe_speed = strobe_speed
+                changed = True
+            if changed:
+                self.version += 1
+        if changed:
+            self._notify()
+        return changed
+
+    # ----- change notifications -----
+
+    def subscribe(self, callback):
+        """Call callback() after every change (from the changing thread; keep it cheap)"""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def _notify(self):
+        for callback in list(self.subscribers):
+            callback()
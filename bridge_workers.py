@@ -0,0 +1,500 @@
+"""Multi-process serving: one broker owns the serial ports and the state, N HTTP workers face the clients.
+
+    python arduino_api.py --workers 4
+
+The broker is the normal bridge app, served on a Unix socket (BROKER_SOCKET)
+instead of a TCP port. It writes every state snapshot to a shared memory file
+(BROKER_SHM). The workers run this module's app under uvicorn's own
+multi-process supervisor on the public port:
+
+  - GET /api/status (cached), WS /api/stream and GET /api/stream/sse are
+    served from the shared snapshot, without a round trip to the broker
+  - every other request is forwarded to the broker over a pool of
+    keep-alive Unix socket connections, and WS /api/live (live show frames)
+    is relayed message by message over a WebSocket of its own
+
+so HTTP parsing, JSON encoding and stream fan-out spread over the workers
+while the broker stays the only process that writes to the boards.
+
+The snapshot file is a seqlock: a 20 byte header (sequence number, odd
+while a write is in progress; payload length; publish time) followed by the
+JSON payload. Readers copy the payload and retry if the sequence changed.
+"""
+import asyncio
+import base64
+import contextlib
+import json
+import mmap
+import os
+import signal
+import socket
+import struct
+import tempfile
+import time
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from uvicorn.protocols.http.auto import AutoHTTPProtocol
+
+from bridge_state import diff_state
+
+_RUNTIME_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+BROKER_SOCKET = os.environ.get("BROKER_SOCKET", os.path.join(tempfile.gettempdir(), "smart-bulbs-broker.sock"))
+BROKER_SHM = os.environ.get("BROKER_SHM", os.path.join(_RUNTIME_DIR, "smart-bulbs-state"))
+BROKER_POOL_SIZE = int(os.environ.get("BROKER_POOL_SIZE", "16"))   # idle connections kept per worker
+BROKER_TIMEOUT = float(os.environ.get("BROKER_TIMEOUT", "30"))     # seconds to wait for the broker's reply
+SNAPSHOT_SIZE = 1 << 20         # payload capacity of the shared snapshot (about 10k bulbs)
+BROKER_PID = int(os.environ.get("BROKER_PID", "0"))   # set by the broker; workers exit when it is gone
+BROKER_WATCH_INTERVAL = 2.0
+STREAM_MAX_FPS = float(os.environ.get("STREAM_MAX_FPS", "10"))
+STREAM_KEEPALIVE = 15.0
+STREAM_CLIENT_QUEUE = 32
+
+WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+HEADER = struct.Struct("<QId")  # sequence, payload length, publish time (Unix seconds)
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}   # may be sent again if the broker's reply is lost
+HOP_BY_HOP = {b"connection", b"keep-alive", b"transfer-encoding", b"date", b"server", b"content-length"}
+
+
+class SnapshotWriter:
+    """Broker side of the shared snapshot (one writer thread)"""
+
+    def __init__(self, path=BROKER_SHM, size=SNAPSHOT_SIZE):
+        self.path = path
+        with open(path, "w+b") as f:
+            f.truncate(HEADER.size + size)
+            self.map = mmap.mmap(f.fileno(), HEADER.size + size)
+        self.capacity = size
+        self.sequence = 0
+
+    def publish(self, payload):
+        """Write one snapshot (bytes); readers never see it half written"""
+        if len(payload) > self.capacity:
+            raise ValueError(f"Snapshot of {len(payload)} bytes does not fit in {self.capacity}")
+        self.sequence += 1                       # odd: write in progress
+        struct.pack_into("<Q", self.map, 0, self.sequence)
+        self.map[HEADER.size:HEADER.size + len(payload)] = payload
+        self.sequence += 1
+        HEADER.pack_into(self.map, 0, self.sequence, len(payload), time.time())
+
+    def close(self):
+        self.map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SnapshotReader:
+    """Worker side of the shared snapshot: parses each published payload once"""
+
+    def __init__(self, path=BROKER_SHM):
+        self.path = path
+        self.map = None
+        self.sequence = None
+        self.payload = None         # raw JSON of the last snapshot read
+        self.snapshot = None        # ... parsed
+        self.state_json = None      # ... and its "state" re-encoded, spliced into status responses
+
+    def _open(self):
+        if self.map is None:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def current_sequence(self):
+        """Sequence of the latest snapshot (8 bytes read, no copy)"""
+        self._open()
+        return struct.unpack_from("<Q", self.map, 0)[0]
+
+    def read(self):
+        """The latest snapshot as a dict (None before the broker published one)"""
+        self._open()
+        while True:
+            sequence, length, _ = HEADER.unpack_from(self.map, 0)
+            if sequence == self.sequence:
+                return self.snapshot
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0)           # writer busy, let it finish
+                continue
+            payload = self.map[HEADER.size:HEADER.size + length]
+            if struct.unpack_from("<Q", self.map, 0)[0] != sequence:
+                continue                # overwritten while copying
+            self.sequence, self.payload = sequence, payload
+            self.snapshot = json.loads(payload)
+            self.state_json = json.dumps(self.snapshot["state"], separators=(",", ":")).encode()
+            return self.snapshot
+
+
+class ReplyLost(Exception):
+    """The broker took a request but the connection broke before it answered: it may have run"""
+
+
+class BrokerClient:
+    """HTTP/1.1 over the broker's Unix socket, with a pool of keep-alive connections"""
+
+    def __init__(self, path=BROKER_SOCKET, pool_size=BROKER_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.idle = []
+
+    async def request(self, method, target, headers, body):
+        """Forward one request, returns (status, headers, body bytes or async iterator of chunks).
+
+        ReplyLost if the connection broke after the request was sent and it is not safe to repeat.
+        """
+        while self.idle and self.idle[-1][0].at_eof():
+            self.idle.pop()[1].close()      # the broker closed it while it sat idle
+        reused = bool(self.idle)
+        reader, writer = self.idle.pop() if reused else await asyncio.open_unix_connection(self.path)
+        sent = False
+        try:
+            head = [f"{method} {target} HTTP/1.1".encode(), b"host: broker", b"content-length: %d" % len(body)]
+            head += [name + b": " + value for name, value in headers
+                     if name not in (b"host", b"content-length", b"connection", b"transfer-encoding")]
+            writer.write(b"\r\n".join(head) + b"\r\n\r\n" + body)
+            await writer.drain()
+            sent = True
+            status_line = await asyncio.wait_for(reader.readline(), BROKER_TIMEOUT)
+            if not status_line:
+                raise ConnectionResetError("Broker closed the connection")
+            response_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), BROKER_TIMEOUT)
+
+            status = int(status_line.split()[1])
+            response_headers = []
+            length, chunked, close = None, False, False
+            for line in response_head.split(b"\r\n"):
+                if not line:
+                    continue
+                name, _, value = line.partition(b":")
+                name, value = name.strip().lower(), value.strip()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"transfer-encoding":
+                    chunked = b"chunked" in value.lower()
+                elif name == b"connection":
+                    close = value.lower() == b"close"
+                if name not in HOP_BY_HOP:
+                    response_headers.append((name, value))
+
+            if chunked:
+                return status, response_headers, self._chunks(reader, writer)
+            data = await asyncio.wait_for(reader.readexactly(length), BROKER_TIMEOUT) if length else b""
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            writer.close()
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            if reused and not timed_out and (not sent or method in SAFE_METHODS):
+                # The broker drops connections that sat idle too long; retry on a new one, unless
+                # the broker may already have run a request that changes something
+                return await self.request(method, target, headers, body)
+            if sent and method not in SAFE_METHODS:
+                raise ReplyLost(f"Connection to the broker broke before it answered in full ({e!r})") from e
+            raise
+        self._release(reader, writer, close or length is None)
+        return status, response_headers, data
+
+    async def _chunks(self, reader, writer):
+        done = False
+        try:
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readuntil(b"\r\n")
+                    done = True
+                    return
+                chunk = await reader.readexactly(size + 2)
+                yield chunk[:-2]
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            return                  # the response has started, all that can be done is to end it
+        finally:
+            # A stream the client left early leaves the connection mid-response: don't reuse it
+            self._release(reader, writer, not done)
+
+    def _release(self, reader, writer, close):
+        if close or len(self.idle) >= self.pool_size:
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+
+
+class BrokerWebSocket:
+    """Minimal WebSocket client over the broker's Unix socket (for relaying /api/live).
+
+    Enough for uvicorn on the other end: it never fragments the small messages
+    the live show sends, so every frame read is a whole message.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, path, target):
+        reader, writer = await asyncio.open_unix_connection(path)
+        key = base64.b64encode(os.urandom(16))
+        writer.write(b"GET %s HTTP/1.1\r\nhost: broker\r\nupgrade: websocket\r\nconnection: Upgrade\r\n"
+                     b"sec-websocket-key: %s\r\nsec-websocket-version: 13\r\n\r\n" % (target.encode(), key))
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), BROKER_TIMEOUT)
+            if head.split(b" ", 2)[1] != b"101":
+                raise ConnectionError(f"Broker refused the WebSocket: {head.splitlines()[0].decode()}")
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer)
+
+    async def send(self, opcode, payload):
+        """One masked frame (clients must mask)"""
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        key = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+        self.writer.write(header + mask + masked)
+        await self.writer.drain()
+
+    async def receive(self):
+        """(opcode, payload) of the next frame from the broker"""
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        return first & 0x0F, await self.reader.readexactly(length)
+
+    async def close(self):
+        with contextlib.suppress(OSError):
+            await self.send(WS_CLOSE, struct.pack("!H", 1000))
+        self.writer.close()
+
+
+class SnapshotStream:
+    """The broker's state stream (snapshot, then coalesced diffs) rebuilt from the shared snapshot"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.subscribers = set()
+        self.task = None
+        self.version = None
+        self.last_state = None
+
+    def snapshot_frame(self):
+        return json.dumps({"type": "snapshot", "version": self.version, "state": self.last_state,
+                           "timestamp": time.time()})
+
+    def subscribe(self):
+        if self.task is None:
+            self._refresh()
+            self.task = asyncio.get_running_loop().create_task(self._broadcast())
+        subscriber = asyncio.Queue(maxsize=STREAM_CLIENT_QUEUE)
+        subscriber.put_nowait(self.snapshot_frame())
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def _refresh(self):
+        """Diff against the latest snapshot, None if nothing changed"""
+        snapshot = self.reader.read()
+        if snapshot is None or snapshot["version"] == self.version:
+            return None
+        changes = diff_state(self.last_state, snapshot["state"]) if self.last_state is not None else None
+        self.version, self.last_state = snapshot["version"], snapshot["state"]
+        return changes
+
+    async def _broadcast(self):
+        interval = 1.0 / STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else 0.05
+        last_frame = time.monotonic()
+        sequence = self.reader.sequence
+        while True:
+            await asyncio.sleep(interval)
+            if not self.subscribers:
+                continue
+            changes = None
+            if self.reader.current_sequence() != sequence:
+                changes = self._refresh()
+                sequence = self.reader.sequence
+            if changes:
+                frame = json.dumps({"type": "diff", "version": self.version, "changes": changes,
+                                    "timestamp": time.time()})
+            elif time.monotonic() - last_frame >= STREAM_KEEPALIVE:
+                frame = json.dumps({"type": "keepalive", "version": self.version})
+            else:
+                continue
+            last_frame = time.monotonic()
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(frame)
+                except asyncio.QueueFull:
+                    while not subscriber.empty():
+                        subscriber.get_nowait()
+                    subscriber.put_nowait(self.snapshot_frame())
+
+
+class WorkerHTTPProtocol(AutoHTTPProtocol):
+    """uvicorn's HTTP protocol with Nagle off (run the workers with --http bridge_workers:WorkerHTTPProtocol).
+
+    uvicorn's multi-process supervisor binds the listening socket itself, without
+    IPPROTO_TCP, so asyncio skips TCP_NODELAY on the connections it accepts and
+    every keep-alive response waits ~40 ms on the client's delayed ACK.
+    """
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().connection_made(transport)
+
+
+# ========== WORKER APP ==========
+
+app = FastAPI(title="Smart Bulb Control API (worker)")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+snapshot_reader = SnapshotReader()
+broker = BrokerClient()
+snapshot_stream = SnapshotStream(snapshot_reader)
+
+
+@app.on_event("startup")
+async def watch_broker():
+    """Take the worker supervisor down with the broker, even if the broker crashed"""
+    async def watch():
+        while True:
+            await asyncio.sleep(BROKER_WATCH_INTERVAL)
+            try:
+                os.kill(BROKER_PID, 0)
+            except ProcessLookupError:
+                os.kill(os.getppid(), signal.SIGTERM)
+                return
+
+    if BROKER_PID:
+        asyncio.get_running_loop().create_task(watch())
+
+
+@app.get("/api/status")
+async def get_status(request: Request, fresh: bool = False):
+    """Cached status straight from the shared snapshot (fresh=1 goes to the broker)"""
+    snapshot = None if fresh else snapshot_reader.read()
+    if snapshot is None:
+        return await forward(request)
+    now = time.time()
+    updated_at = snapshot["updated_at"]
+    tail = json.dumps({
+        "version": snapshot["version"],
+        "arduino_response": snapshot["arduino_response"],
+        "connected": snapshot["state"]["connected"],
+        "cached": True,
+        "age": round(now - updated_at, 3) if updated_at is not None else None,
+        "timestamp": now,
+    }, separators=(",", ":")).encode()
+    body = b'{"success":true,"state":' + snapshot_reader.state_json + b"," + tail[1:]
+    return Response(content=body, media_type="application/json")
+
+
+@app.websocket("/api/stream")
+async def stream_state_ws(websocket: WebSocket):
+    await websocket.accept()
+    subscriber = snapshot_stream.subscribe()
+    try:
+        while True:
+            await websocket.send_text(await subscriber.get())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        snapshot_stream.unsubscribe(subscriber)
+
+
+@app.get("/api/stream/sse")
+async def stream_state_sse(request: Request):
+    subscriber = snapshot_stream.subscribe()
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                yield f"data: {await subscriber.get()}\n\n"
+        finally:
+            snapshot_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/api/live")
+async def live_show(websocket: WebSocket):
+    """Live show frames go to the broker as they come, its acks and stats come back the same way"""
+    target = websocket.url.path + (f"?{websocket.url.query}" if websocket.url.query else "")
+    try:
+        upstream = await BrokerWebSocket.connect(broker.path, target)
+    except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        await websocket.close(code=1013)    # try again later
+        return
+    await websocket.accept()
+
+    async def relay_replies():
+        try:
+            while True:
+                opcode, payload = await upstream.receive()
+                if opcode == WS_TEXT:
+                    await websocket.send_text(payload.decode())
+                elif opcode == WS_BINARY:
+                    await websocket.send_bytes(payload)
+                elif opcode == WS_PING:
+                    await upstream.send(WS_PONG, payload)
+                elif opcode == WS_CLOSE:
+                    break
+        except (OSError, asyncio.IncompleteReadError, RuntimeError):
+            pass
+        with contextlib.suppress(RuntimeError):
+            await websocket.close()
+
+    replies = asyncio.get_running_loop().create_task(relay_replies())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                await upstream.send(WS_BINARY, message["bytes"])
+            else:
+                await upstream.send(WS_TEXT, message["text"].encode())
+    except (WebSocketDisconnect, RuntimeError, OSError):
+        pass
+    finally:
+        replies.cancel()
+        await upstream.close()
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+async def forward(request: Request):
+    """Anything else: the broker handles it"""
+    target = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    try:
+        status, headers, body = await broker.request(request.method, target, request.headers.raw,
+                                                     await request.body())
+    except ReplyLost as e:
+        # Not retried: a batch, scene or new schedule rule would run twice
+        return JSONResponse({"success": False, "error": f"{e}; the request may or may not have been carried out"},
+                            status_code=502)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        return JSONResponse({"success": False, "error": f"Bridge broker unavailable: {e}"}, status_code=503)
+    media_type = dict(headers).get(b"content-type", b"application/json").decode()
+    # This app's own CORS middleware adds the access-control headers
+    headers = {name.decode(): value.decode() for name, value in headers
+               if name != b"content-type" and not name.startswith(b"access-control-")}
+    if isinstance(body, bytes):
+        return Response(content=body, status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(body, status_code=status, headers=headers, media_type=media_type)
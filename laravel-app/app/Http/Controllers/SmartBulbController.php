@@ -7,7 +7,12 @@
 
 class SmartBulbController extends Controller
 {
-    private $apiUrl = 'http://localhost:5000';
+    private $apiUrl;
+    
+    public function __construct()
+    {
+        $this->apiUrl = rtrim(config('services.fastapi.url'), '/');
+    }
     
     public function dashboard()
     {
@@ -18,7 +23,7 @@ public function dashboard()
     public function bulbControl(Request $request)
     {
         $request->validate([
-            'bulb' => 'required|integer|in:1,2,3',  // Updated for 3 bulbs
+            'bulb' => 'required|integer|min:1',  // Bulb ids come from the bridge's device registry
             'action' => 'required|string|in:on,off,brightness',
             'value' => 'nullable|integer|min:0|max:100'
         ]);
@@ -125,7 +130,7 @@ public function voiceCommand(Request $request)
     {
         $request->validate([
             'command' => 'required|string',
-            'bulb' => 'nullable|integer|in:1,2,3',
+            'bulb' => 'nullable|integer|min:1',
             'action' => 'nullable|string',
             'value' => 'nullable|integer|min:0|max:100',
             'effect' => 'nullable|string|in:strobe,fade,pulse,alternate,rainbow'
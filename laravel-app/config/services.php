@@ -28,6 +28,12 @@
         'region' => env('AWS_DEFAULT_REGION', 'us-east-1'),
     ],
 
+    'fastapi' => [
+        'url' => env('FASTAPI_URL', 'http://localhost:5000'),
+        // Server-Sent Events state stream for the dashboard, empty = same host on port 5000
+        'stream_url' => env('FASTAPI_STREAM_URL', ''),
+    ],
+
     'slack' => [
         'notifications' => [
             'bot_user_oauth_token' => env('SLACK_BOT_USER_OAUTH_TOKEN'),
@@ -1,5 +1,8 @@
         // Core Application State
         let csrfToken = document.querySelector('meta[name="csrf-token"]')?.content || '';
+        let streamUrl = document.querySelector('meta[name="bulb-stream-url"]')?.content ||
+            `${window.location.protocol}//${window.location.hostname}:5000/api/stream/sse`;
+        let statusPollTimer = null;
         let currentState = {
             bulb1: { state: 'off', brightness: 0 },
             bulb2: { state: 'off', brightness: 0 },
@@ -29,8 +32,8 @@
             // Initial status check
             updateStatus();
             
-            // Auto-refresh every 5 seconds
-            setInterval(updateStatus, 5000);
+            // Live updates pushed by the bridge (falls back to polling)
+            connectStateStream();
             
             console.log('System Ready!');
             showToast('Smart Bulb Control Ready', 'success');
@@ -38,9 +41,8 @@
         
         // Setup slider event listeners
         function setupSliders() {
-            for (let i = 1; i <= 3; i++) {
-                const slider = document.getElementById(`bulb${i}-slider`);
-                if (!slider) continue;
+            document.querySelectorAll('input[id^="bulb"][id$="-slider"]').forEach(slider => {
+                const i = parseInt(slider.id.slice(4));
                 
                 slider.addEventListener('input', function() {
                     const value = parseInt(this.value);
@@ -52,7 +54,7 @@
                     const value = parseInt(this.value);
                     controlBulb(i, 'brightness', value);
                 });
-            }
+            });
             
             // Strobe speed slider
             const strobeSpeedSlider = document.getElementById('strobe-speed');
@@ -252,9 +254,9 @@
                         };
                         
                         // Update UI
-                        updateBulbUI(1, data.state.bulb1);
-                        updateBulbUI(2, data.state.bulb2);
-                        updateBulbUI(3, data.state.bulb3);
+                        for (const bulbNum of bulbNumbers(data.state)) {
+                            updateBulbUI(bulbNum, data.state[`bulb${bulbNum}`]);
+                        }
                         
                         // Update mode
                         if (data.state.mode) {
@@ -269,6 +271,81 @@
             }
         }
         
+        // Subscribe to pushed state diffs from the bridge
+        function connectStateStream() {
+            if (!window.EventSource) {
+                startStatusPolling();
+                return;
+            }
+            
+            const source = new EventSource(streamUrl);
+            
+            source.onopen = () => {
+                stopStatusPolling();
+            };
+            
+            source.onmessage = (event) => {
+                const message = JSON.parse(event.data);
+                
+                if (message.type === 'snapshot') {
+                    applyStreamState(message.state);
+                } else if (message.type === 'diff') {
+                    const merged = {};
+                    for (const [key, value] of Object.entries(message.changes)) {
+                        merged[key] = (value && typeof value === 'object')
+                            ? { ...(currentState[key] || {}), ...value }
+                            : value;
+                    }
+                    applyStreamState(merged);
+                }
+            };
+            
+            source.onerror = () => {
+                // EventSource reconnects by itself; poll until it does
+                startStatusPolling();
+            };
+        }
+        
+        // Apply (part of) the bridge state pushed over the stream
+        function applyStreamState(state) {
+            currentState = { ...currentState, ...state };
+            
+            for (const bulbNum of bulbNumbers(state)) {
+                updateBulbUI(bulbNum, currentState[`bulb${bulbNum}`]);
+            }
+            
+            if (state.mode) {
+                document.getElementById('active-mode').textContent = 
+                    `• ${state.mode.charAt(0).toUpperCase() + state.mode.slice(1)} Mode`;
+            }
+            
+            if (state.connected !== undefined) {
+                updateConnectionStatus(state.connected);
+            }
+        }
+        
+        // Bulb numbers in a state snapshot or diff ("bulb1", "bulb7", ... - the registry decides how many)
+        function bulbNumbers(state) {
+            return Object.keys(state)
+                .map(key => /^bulb(\d+)$/.exec(key))
+                .filter(match => match && state[match[0]])
+                .map(match => parseInt(match[1]));
+        }
+        
+        // Fallback polling every 5 seconds
+        function startStatusPolling() {
+            if (!statusPollTimer) {
+                statusPollTimer = setInterval(updateStatus, 5000);
+            }
+        }
+        
+        function stopStatusPolling() {
+            if (statusPollTimer) {
+                clearInterval(statusPollTimer);
+                statusPollTimer = null;
+            }
+        }
+        
         // Update bulb UI
         function updateBulbUI(bulbNum, bulbState) {
             if (!bulbState) return;